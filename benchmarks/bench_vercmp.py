@@ -0,0 +1,88 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Measures the throughput of the package version comparisons.
+
+Run it with `python benchmarks/bench_vercmp.py`.
+"""
+from typing import List, Tuple
+from pacmanpie.vercmp import PackageVersion, parse_version, rank_versions, vercmp
+import random
+import timeit
+
+
+def _versions(amount: int, rng: random.Random) -> List[str]:
+    return [
+        f"{rng.choice(['', '1:'])}{rng.randint(0, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 9999)}"
+        f"{rng.choice(['', 'rc1', '.r42.g1a2b3c'])}-{rng.randint(1, 5)}"
+        for _ in range(amount)
+    ]
+
+
+def _report(name: str, amount: int, seconds: float) -> None:
+    print(f"{name:<32} {amount / seconds:>14,.0f} ops/s")
+
+
+def main(amount: int = 100000, repeat: int = 5) -> None:
+    """Runs the benchmarks.
+
+    Args:
+        amount: The amount of comparisons per run.
+        repeat: The amount of runs, the fastest one is reported.
+    """
+    rng: random.Random = random.Random(0)
+    versions: List[str] = _versions(amount, rng)
+    pairs: List[Tuple[str, str]] = list(zip(versions, reversed(versions)))
+    parsed: List[Tuple[PackageVersion, PackageVersion]] = [
+        (PackageVersion(first), PackageVersion(second)) for first, second in pairs
+    ]
+    _report(
+        "parse (uncached)",
+        amount,
+        min(
+            timeit.repeat(
+                lambda: [PackageVersion(v) for v in versions], number=1, repeat=repeat
+            )
+        ),
+    )
+    _report(
+        "vercmp (cached parse)",
+        amount,
+        min(
+            timeit.repeat(
+                lambda: [vercmp(a, b) for a, b in pairs], number=1, repeat=repeat
+            )
+        ),
+    )
+    _report(
+        "PackageVersion.compare",
+        amount,
+        min(
+            timeit.repeat(
+                lambda: [a.compare(b) for a, b in parsed], number=1, repeat=repeat
+            )
+        ),
+    )
+    _report(
+        "rank_versions",
+        amount,
+        min(timeit.repeat(lambda: rank_versions(versions), number=1, repeat=repeat)),
+    )
+    print(f"parse cache: {parse_version.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,10 +17,30 @@
 """This module will be the main module to be used for cli."""
 import pyalpm as libalpm
 import argparse
+import json
+import os
+import subprocess
 import sys
-from typing import List
+import tarfile
+import time
+from typing import Dict, List
 from pacmanpie.__version__ import __version__ as version
-from pacmanpie import levels
+from pacmanpie import (
+    batch,
+    check,
+    complete,
+    config,
+    database,
+    journal,
+    levels,
+    lock,
+    owners,
+    prefetch,
+    progress,
+    repo,
+    snapshot,
+    upgrades,
+)
 
 
 _version_string: str = f"""pacman-pie {version} - pyalpm {libalpm.version()}
@@ -59,6 +79,158 @@ def _parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="enable debug output"
     )
+    parser.add_argument(
+        "--config",
+        help="specify an alternative pacman configuration file",
+        default="/etc/pacman.conf",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    batch_parser: argparse.ArgumentParser = subparsers.add_parser(
+        "batch",
+        help="upgrade many roots at once, sharing the sync databases of --dbpath "
+        "(the sync databases of every root are replaced by links to them)",
+    )
+    batch_parser.add_argument(
+        "roots",
+        nargs="*",
+        metavar="ROOT[:DBPATH]",
+        help="a root to upgrade, its database location defaults to ROOT/var/lib/pacman",
+    )
+    batch_parser.add_argument(
+        "-f", "--roots-file", help="read the roots from a file, one per line"
+    )
+    batch_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=4,
+        help="the maximum amount of roots upgraded at the same time",
+    )
+    batch_parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only show the pending upgrades",
+    )
+    batch_parser.add_argument(
+        "--json", action="store_true", help="print the summaries as json to stdout"
+    )
+    query_parser: argparse.ArgumentParser = subparsers.add_parser(
+        "query", help="query the databases"
+    )
+    query_subparsers = query_parser.add_subparsers(dest="query_command")
+    owns_parser: argparse.ArgumentParser = query_subparsers.add_parser(
+        "owns", help="find the packages owning files"
+    )
+    owns_parser.add_argument("paths", nargs="*", metavar="PATH", help="a file")
+    owns_parser.add_argument(
+        "-f",
+        "--paths-file",
+        help="read the files from a file, one per line ('-' for stdin)",
+    )
+    owns_parser.add_argument(
+        "-s",
+        "--sync",
+        action="store_true",
+        help="search the .files databases of the sync repositories instead",
+    )
+    upgrades_parser: argparse.ArgumentParser = query_subparsers.add_parser(
+        "upgrades", help="list the pending upgrades and replacements"
+    )
+    upgrades_parser.add_argument(
+        "--json", action="store_true", help="print the upgrades as json to stdout"
+    )
+    check_parser: argparse.ArgumentParser = subparsers.add_parser(
+        "check", help="check the installed files against the .MTREE of their packages"
+    )
+    check_parser.add_argument(
+        "packages", nargs="*", metavar="PACKAGE", help="a package, every one if none"
+    )
+    check_parser.add_argument(
+        "-r", "--root", default="/", help="specify an alternative installation root"
+    )
+    check_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="the amount of worker processes, the amount of CPUs by default",
+    )
+    check_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="hash every file, even the unchanged ones that matched before",
+    )
+    prefetch_parser: argparse.ArgumentParser = subparsers.add_parser(
+        "prefetch",
+        help="download the archives of the pending upgrades into the package cache",
+    )
+    prefetch_parser.add_argument(
+        "--rate", help="the maximum download rate per second, e.g. 512K or 2M"
+    )
+    prefetch_parser.add_argument(
+        "--max-cache-size",
+        help="skip archives that would make the package cache bigger, e.g. 5G",
+    )
+    prefetch_parser.add_argument(
+        "--detach",
+        action="store_true",
+        help="run in the background, logging to the pacmanpie directory of --dbpath",
+    )
+    completion_parser: argparse.ArgumentParser = subparsers.add_parser(
+        "completion", help="shell completion of package names"
+    )
+    completion_parser.add_argument(
+        "action",
+        choices=["bash", "refresh"],
+        help="print the bash completion script, or regenerate the name cache of "
+        "--dbpath (e.g. after a sync)",
+    )
+    subparsers.add_parser("history", help="list the recorded transactions")
+    rollback_parser: argparse.ArgumentParser = subparsers.add_parser(
+        "rollback",
+        help="bring back the packages installed before a transaction, from the cache",
+    )
+    rollback_parser.add_argument(
+        "transaction", type=int, help="the number of the transaction, see history"
+    )
+    rollback_parser.add_argument(
+        "-r", "--root", default="/", help="specify an alternative installation root"
+    )
+    rollback_parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only show the changes",
+    )
+    repo_parser: argparse.ArgumentParser = subparsers.add_parser(
+        "repo", help="manage repositories of package archives"
+    )
+    repo_subparsers = repo_parser.add_subparsers(dest="repo_command")
+    build_parser: argparse.ArgumentParser = repo_subparsers.add_parser(
+        "build", help="build the databases of a directory of package archives"
+    )
+    build_parser.add_argument("directory", help="the repository directory")
+    build_parser.add_argument(
+        "-n",
+        "--name",
+        default=None,
+        help="the repository name, the name of the directory by default",
+    )
+    build_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="the amount of archives read at once, the amount of CPUs by default",
+    )
+    build_parser.add_argument(
+        "-c",
+        "--compression",
+        choices=["zst", "gz"],
+        default="zst",
+        help="the compression of the databases",
+    )
     return parser
 
 
@@ -77,6 +249,320 @@ def _parse_args(
     return parser.parse_args(args or sys.argv[1:])
 
 
+def _batch(args: argparse.Namespace) -> None:
+    """Upgrades many roots at once.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    roots: List[batch.RootSpec] = [batch.parse_root(root) for root in args.roots]
+    if args.roots_file:
+        roots.extend(batch.read_roots_file(args.roots_file))
+    pacman_config: config.PacmanConfig = config.read_config(args.config)
+    summaries: List[batch.RootSummary]
+    if args.dry_run:
+        summaries = batch.plan(roots, args.dbpath, pacman_config, args.jobs)
+    else:
+        with progress.Progress() as live:
+            summaries = batch.run(
+                roots, args.dbpath, pacman_config, args.jobs, progress=live
+            )
+    if args.json:
+        print(json.dumps([summary.as_dict() for summary in summaries], indent=2))
+        return
+    summary: batch.RootSummary
+    for summary in summaries:
+        if summary.error:
+            levels.error(f"{summary.root}: {summary.error}")
+            continue
+        levels.success(f"{summary.root}: {len(summary.upgrades)} package(s)")
+        upgrade: batch.Upgrade
+        for upgrade in summary.upgrades:
+            levels.info(
+                f"    {upgrade.name} {upgrade.old_version} -> {upgrade.new_version}",
+                no_icon=True,
+            )
+
+
+def _query_owns(args: argparse.Namespace) -> None:
+    """Finds the packages owning files.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    paths: List[str] = list(args.paths)
+    if args.paths_file:
+        with (
+            sys.stdin if args.paths_file == "-" else open(args.paths_file)
+        ) as paths_file:
+            paths.extend(line.rstrip("\n") for line in paths_file if line.strip())
+    normalized: Dict[str, str] = {path: owners.normalize(path) for path in paths}
+    # directories are listed with a trailing slash
+    keys: List[str] = [
+        key for path in normalized.values() for key in (path, path.rstrip("/") + "/")
+    ]
+    results: Dict[str, List[str]]
+    if args.sync:
+        repos: List[str] = list(config.read_config(args.config).repos)
+        results = owners.lookup_sync(args.dbpath, repos, keys)
+    else:
+        local: journal.Journal = journal.Journal(args.dbpath)
+        try:
+            with local.reading():
+                index: owners.OwnerIndex = local.owners()
+                results = index.lookup_many(keys)
+                index.close()
+                dirnames: Dict[str, str] = database.local_dirnames(args.dbpath)
+        except PermissionError:
+            # the index can't be kept up to date without write access to --dbpath
+            with lock.shared(args.dbpath):
+                results = owners.lookup_packages(
+                    database.read_local_db(args.dbpath, files=True).values(), keys
+                )
+                dirnames = database.local_dirnames(args.dbpath)
+        results = {
+            key: [f"{name} {dirnames[name][len(name) + 1:]}" for name in names]
+            for key, names in results.items()
+        }
+    for path, key in normalized.items():
+        found: List[str] = results[key] or results[key.rstrip("/") + "/"]
+        if not found:
+            levels.error(f"No package owns {path}")
+        for package in found:
+            levels.info(
+                f"{path} is {'provided' if args.sync else 'owned'} by {package}"
+            )
+
+
+def _query_upgrades(args: argparse.Namespace) -> None:
+    """Lists the pending upgrades and replacements.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    pacman_config: config.PacmanConfig = config.read_config(args.config)
+    pending: List[upgrades.Upgrade] = upgrades.pending(
+        args.dbpath,
+        list(pacman_config.repos),
+        pacman_config.ignore_pkgs,
+        pacman_config.ignore_groups,
+    )
+    if args.json:
+        print(json.dumps([upgrade.__dict__ for upgrade in pending], indent=2))
+        return
+    if not pending:
+        levels.success("Nothing to upgrade")
+    upgrade: upgrades.Upgrade
+    for upgrade in pending:
+        replaced: str = f" (replaces {upgrade.replaces})" if upgrade.replaces else ""
+        levels.info(
+            f"{upgrade.repo}/{upgrade.name} {upgrade.old_version} -> "
+            f"{upgrade.new_version}{replaced}"
+        )
+
+
+def _check(args: argparse.Namespace) -> None:
+    """Checks the installed files against the .MTREE of their packages.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    mismatches: int = 0
+    try:
+        with journal.Journal(args.dbpath).reading():
+            entries: List[check.MtreeEntry] = check.read_entries(
+                args.dbpath, args.packages or None
+            )
+    except ValueError as error:
+        levels.error(str(error))
+        return
+    mismatch: check.Mismatch
+    for mismatch in check.audit(
+        args.root, args.dbpath, entries, args.jobs, not args.no_cache
+    ):
+        mismatches += 1
+        levels.warn(f"{mismatch.package}: /{mismatch.path} ({mismatch.reason})")
+    if mismatches:
+        levels.error(f"{len(entries)} files checked, {mismatches} mismatch(es)")
+    else:
+        levels.success(f"{len(entries)} files checked, no mismatches")
+
+
+def _prefetch(args: argparse.Namespace) -> None:
+    """Downloads the archives of the pending upgrades with a low priority.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    if args.detach:
+        arguments: List[str] = ["-b", args.dbpath, "--config", args.config, "prefetch"]
+        for option, value in (
+            ("--rate", args.rate),
+            ("--max-cache-size", args.max_cache_size),
+        ):
+            if value:
+                arguments.extend([option, value])
+        log_path: str = os.path.join(database.state_dir(args.dbpath), "prefetch.log")
+        with open(log_path, "a") as log:
+            process: subprocess.Popen = subprocess.Popen(
+                [sys.executable, "-m", "pacmanpie", *arguments],
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                start_new_session=True,
+            )
+        levels.success(
+            f"Prefetching in the background (pid {process.pid}, log {log_path})"
+        )
+        return
+    prefetch.lower_priority()
+    pacman_config: config.PacmanConfig = config.read_config(args.config)
+    try:
+        with progress.Progress() as live:
+            results: List[prefetch.Fetched] = prefetch.prefetch(
+                args.dbpath,
+                pacman_config,
+                prefetch.parse_size(args.rate) if args.rate else None,
+                prefetch.parse_size(args.max_cache_size)
+                if args.max_cache_size
+                else None,
+                live,
+            )
+    except RuntimeError as error:
+        levels.error(str(error))
+        return
+    result: prefetch.Fetched
+    for result in results:
+        if result.status in ("cached", "downloaded"):
+            levels.success(f"{result.filename} {result.status}")
+        elif result.status == "skipped":
+            levels.warn(f"{result.filename} skipped: {result.reason}")
+        else:
+            levels.error(f"{result.filename} failed: {result.reason}")
+
+
+def _completion(args: argparse.Namespace, parser: argparse.ArgumentParser) -> None:
+    """Prints the shell completion script or regenerates the name cache.
+
+    Args:
+        args: The parsed arguments.
+        parser: The argument parser, providing the subcommands.
+
+    Returns:
+        Nothing will be returned.
+    """
+    if args.action == "bash":
+        commands: List[str] = sorted(
+            next(
+                action.choices
+                for action in parser._actions
+                if isinstance(action, argparse._SubParsersAction)
+            )
+        )
+        print(complete.bash_script(args.dbpath, commands), end="")
+        return
+    complete.refresh(args.dbpath, list(config.read_config(args.config).repos))
+    levels.success(f"Regenerated {complete.cache_path(args.dbpath)}")
+
+
+def _history(args: argparse.Namespace) -> None:
+    """Lists the recorded transactions.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    transaction: snapshot.Transaction
+    for transaction in snapshot.transactions(args.dbpath):
+        when: str = time.strftime("%Y-%m-%d %H:%M", time.localtime(transaction.time))
+        levels.info(f"#{transaction.id} {when} {transaction.reason}")
+        for name, (before, after) in transaction.changes.items():
+            levels.info(f"    {name} {before or '(none)'} -> {after or '(none)'}")
+
+
+def _rollback(args: argparse.Namespace) -> None:
+    """Brings back the packages installed before a transaction.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    pacman_config: config.PacmanConfig = config.read_config(args.config)
+    cache_dirs: List[str] = pacman_config.cache_dirs or [pacman_config.cache_dir]
+    try:
+        if args.dry_run:
+            changes: snapshot.Rollback = snapshot.plan(
+                args.dbpath, args.transaction, cache_dirs, pacman_config.arch
+            )
+        else:
+            changes = snapshot.rollback(
+                args.root,
+                args.dbpath,
+                args.transaction,
+                cache_dirs,
+                pacman_config.arch,
+            )
+    except (ValueError, FileNotFoundError, BlockingIOError) as error:
+        levels.error(str(error))
+        return
+    for path in changes.install:
+        levels.info(
+            f"{'Would install' if args.dry_run else 'Installed'} "
+            f"{os.path.basename(path)}"
+        )
+    for name in changes.remove:
+        levels.info(f"{'Would remove' if args.dry_run else 'Removed'} {name}")
+    for package in changes.missing:
+        levels.error(f"{package} isn't in the package cache")
+    if not args.dry_run:
+        levels.success(f"Rolled back to before transaction #{args.transaction}")
+
+
+def _repo_build(args: argparse.Namespace) -> None:
+    """Builds the databases of a directory of package archives.
+
+    Args:
+        args: The parsed arguments.
+
+    Returns:
+        Nothing will be returned.
+    """
+    name: str = args.name or os.path.basename(os.path.abspath(args.directory))
+    try:
+        result: repo.Build = repo.build(
+            args.directory, name, args.jobs, args.compression
+        )
+    except (ValueError, OSError, ImportError, tarfile.TarError) as error:
+        levels.error(str(error))
+        return
+    if not result.written:
+        levels.info(f"{name} is up to date ({result.packages} packages)")
+        return
+    levels.success(
+        f"Built {repo.database_path(args.directory, name)} with "
+        f"{result.packages} packages ({result.read} archives read)"
+    )
+
+
 def main(arguments: List[str] = None) -> None:
     """The main entry point.
 
@@ -90,3 +576,21 @@ def main(arguments: List[str] = None) -> None:
     args: argparse.Namespace = _parse_args(parser, arguments or sys.argv[1:])
     if args.version:
         levels.info(_version_string)
+    elif args.command == "batch":
+        _batch(args)
+    elif args.command == "query" and args.query_command == "owns":
+        _query_owns(args)
+    elif args.command == "query" and args.query_command == "upgrades":
+        _query_upgrades(args)
+    elif args.command == "check":
+        _check(args)
+    elif args.command == "prefetch":
+        _prefetch(args)
+    elif args.command == "completion":
+        _completion(args, parser)
+    elif args.command == "history":
+        _history(args)
+    elif args.command == "rollback":
+        _rollback(args)
+    elif args.command == "repo" and args.repo_command == "build":
+        _repo_build(args)
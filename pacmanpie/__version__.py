@@ -207,9 +207,9 @@ class Version:
             >>> version.name  # with label
             '0.1.0.label'
         """
-        versions: List[str] = [str(part) for part in self.__iter__()]
-        if not self.label:
-            versions.remove("None")
+        versions: List[str] = [str(self.major), str(self.minor), str(self.micro)]
+        if self.label:
+            versions.append(self.label)
         return ".".join(versions)
 
     def bump_major(self) -> None:
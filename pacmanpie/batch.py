@@ -0,0 +1,347 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Upgrades many roots (e.g. build chroots) at once.
+
+The sync databases are parsed once and shared by every root, and every root uses the same package cache. The
+archives are downloaded once, before the roots are upgraded concurrently. libalpm runs in worker processes, one
+transaction at a time in each, and their progress is sent back to this process.
+
+libalpm reads the sync databases from the database location of a root, so upgrading (but not planning) replaces the
+sync databases of every root with symbolic links to the shared ones, for good.
+"""
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from functools import partial
+from multiprocessing import Manager
+from queue import Queue
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from pacmanpie import complete, database, lock, snapshot, upgrades
+from pacmanpie.config import PacmanConfig
+from pacmanpie.progress import Progress
+from pacmanpie.upgrades import Upgrade
+import os
+import threading
+
+
+@dataclass
+class RootSpec:
+    """A root to upgrade.
+
+    Args:
+        root (str): The installation root.
+        dbpath (str): The database location of the root.
+    """
+
+    root: str
+    dbpath: str
+
+
+@dataclass
+class RootSummary:
+    """The result of upgrading a root.
+
+    Args:
+        root (str): The installation root.
+        dbpath (str): The database location of the root.
+        upgrades (List[Upgrade]): The upgraded (or, in a dry run, pending) packages.
+        error (Optional[str]): The error that stopped the upgrade, if any.
+    """
+
+    root: str
+    dbpath: str
+    upgrades: List[Upgrade] = field(default_factory=list)
+    error: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        """The summary as plain data, for structured output.
+
+        Returns:
+            dict: The summary.
+        """
+        return {
+            "root": self.root,
+            "dbpath": self.dbpath,
+            "upgrades": [upgrade.__dict__ for upgrade in self.upgrades],
+            "error": self.error,
+        }
+
+
+Upgrader = Callable[[RootSpec, bool], None]
+# a libalpm callback sent by a worker process: the callback, the prefix of its tasks and its arguments
+Event = Tuple[str, str, Tuple[Any, ...]]
+
+
+def parse_root(spec: str) -> RootSpec:
+    """Parses a ROOT[:DBPATH] root specification.
+
+    Args:
+        spec: The specification. The database location defaults to ROOT/var/lib/pacman.
+
+    Returns:
+        RootSpec: The root.
+
+    Examples:
+        >>> parse_root("/srv/chroots/x86_64")
+        RootSpec(root='/srv/chroots/x86_64', dbpath='/srv/chroots/x86_64/var/lib/pacman')
+        >>> parse_root("/srv/chroots/x86_64:/srv/db")
+        RootSpec(root='/srv/chroots/x86_64', dbpath='/srv/db')
+    """
+    root, _, dbpath = spec.partition(":")
+    return RootSpec(root, dbpath or os.path.join(root, "var", "lib", "pacman"))
+
+
+def read_roots_file(path: str) -> List[RootSpec]:
+    """Reads a file of root specifications, one per line.
+
+    Args:
+        path: The path of the file. Empty lines and lines starting with '#' are ignored.
+
+    Returns:
+        List[RootSpec]: The roots.
+    """
+    with open(path) as roots_file:
+        lines: List[str] = [line.strip() for line in roots_file]
+    return [parse_root(line) for line in lines if line and not line.startswith("#")]
+
+
+def link_sync_dbs(dbpath: str, sync_dbpath: str, repos: List[str]) -> None:
+    """Points the sync databases of a root to the shared ones.
+
+    Notes:
+        The sync databases of the root are replaced by symbolic links, and aren't restored afterwards. Syncing the
+        root itself replaces the links by databases of its own again.
+
+    Args:
+        dbpath: The database location of the root.
+        sync_dbpath: The database location holding the shared sync databases.
+        repos: The repository names.
+    """
+    if os.path.realpath(dbpath) == os.path.realpath(sync_dbpath):
+        return
+    os.makedirs(os.path.join(dbpath, "sync"), exist_ok=True)
+    for repo in repos:
+        source: str = os.path.abspath(database.sync_db_path(sync_dbpath, repo))
+        target: str = database.sync_db_path(dbpath, repo)
+        if not os.path.exists(source) or os.path.realpath(target) == source:
+            continue
+        os.symlink(source, target + ".pacmanpie")
+        os.replace(target + ".pacmanpie", target)
+
+
+def _report(events: Queue, kind: str, prefix: str, *args: Any) -> None:
+    """Sends a libalpm callback to the parent process, see _relay.
+
+    Args:
+        events: The queue the parent process reads.
+        kind: "download" or "progress", the callback.
+        prefix: Prepended to the labels of the tasks, the root.
+        args: The arguments of the callback.
+    """
+    events.put((kind, prefix, args))
+
+
+def _relay(events: Queue, progress: Progress) -> None:
+    """Passes the libalpm callbacks sent by the worker processes to the progress, until None is read.
+
+    Args:
+        events: The queue the worker processes send the callbacks to.
+        progress: Where the progress is shown.
+    """
+    callbacks: Dict[Tuple[str, str], Callable[..., None]] = {}
+    event: Optional[Event]
+    for event in iter(events.get, None):
+        kind, prefix, args = event
+        callback: Optional[Callable[..., None]] = callbacks.get((kind, prefix))
+        if callback is None:
+            callback = callbacks[kind, prefix] = (
+                progress.download_callback(prefix)
+                if kind == "download"
+                else progress.progress_callback(prefix)
+            )
+        callback(*args)
+
+
+def _alpm_upgrade(
+    spec: RootSpec,
+    download_only: bool,
+    sync_dbpath: str,
+    config: PacmanConfig,
+    events: Optional[Queue] = None,
+) -> None:
+    """Upgrades a root with libalpm, in a worker process.
+
+    Notes:
+        Downloading holds no lock of pacman-pie, as the db.lck file libalpm creates keeps the writers out.
+        Upgrading holds the exclusive lock, without db.lck, which libalpm creates itself, and is recorded in the
+        transaction history of the root.
+
+    Args:
+        spec: The root.
+        download_only: Whether or not the packages should only be downloaded into the cache.
+        sync_dbpath: The database location holding the shared sync databases.
+        config: The configuration providing the repositories, the package cache and the ignored packages.
+        events: Where the downloads and the transaction report their progress, if anywhere.
+    """
+    import pyalpm as libalpm
+
+    link_sync_dbs(spec.dbpath, sync_dbpath, list(config.repos))
+    handle = libalpm.Handle(spec.root, spec.dbpath)
+    handle.add_cachedir(config.cache_dir)
+    if events is not None:
+        handle.dlcb = partial(_report, events, "download", f"{spec.root}: ")
+        handle.progresscb = partial(_report, events, "progress", f"{spec.root}: ")
+    for name in config.ignore_pkgs:
+        handle.add_ignorepkg(name)
+    for group in config.ignore_groups:
+        handle.add_ignoregrp(group)
+    for repo in config.repos:
+        sync_db = handle.register_syncdb(repo, libalpm.SIG_DATABASE_OPTIONAL)
+        sync_db.servers = config.servers(repo)
+
+    def run_transaction() -> None:
+        transaction = handle.init_transaction(downloadonly=download_only)
+        try:
+            transaction.sysupgrade(False)
+            if transaction.to_add or transaction.to_remove:
+                transaction.prepare()
+                transaction.commit()
+        finally:
+            transaction.release()
+
+    if download_only:
+        run_transaction()
+        return
+    with lock.exclusive(spec.dbpath, pacman=False), snapshot.recording(
+        spec.dbpath, "upgrade"
+    ):
+        run_transaction()
+
+
+def plan(
+    roots: List[RootSpec], sync_dbpath: str, config: PacmanConfig, jobs: int = 4
+) -> List[RootSummary]:
+    """Computes the pending upgrades of every root, without upgrading anything.
+
+    Args:
+        roots: The roots.
+        sync_dbpath: The database location holding the shared sync databases.
+        config: The configuration providing the repositories and the ignored packages.
+        jobs: The maximum amount of roots read at the same time.
+
+    Returns:
+        List[RootSummary]: The summaries, in the order of roots.
+    """
+    index: upgrades.SyncIndex = upgrades.load_index(sync_dbpath, list(config.repos))
+
+    def plan_root(spec: RootSpec) -> RootSummary:
+        summary: RootSummary = RootSummary(spec.root, spec.dbpath)
+        try:
+            summary.upgrades = upgrades.find_upgrades(
+                upgrades.local_versions(spec.dbpath),
+                index,
+                config.ignore_pkgs,
+                config.ignore_groups,
+            )
+        except OSError as error:
+            summary.error = str(error)
+        return summary
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(plan_root, roots))
+
+
+def run(
+    roots: List[RootSpec],
+    sync_dbpath: str,
+    config: PacmanConfig,
+    jobs: int = 4,
+    upgrader: Optional[Upgrader] = None,
+    progress: Optional[Progress] = None,
+) -> List[RootSummary]:
+    """Upgrades every root.
+
+    Notes:
+        The missing archives are downloaded one root at a time first, so no archive is downloaded twice. Only then
+        are the roots upgraded concurrently, straight from the shared package cache. The shell completion caches
+        of the upgraded roots are updated afterwards.
+
+    Args:
+        roots: The roots.
+        sync_dbpath: The database location holding the shared sync databases.
+        config: The configuration providing the repositories, the package cache and the ignored packages.
+        jobs: The maximum amount of roots upgraded at the same time.
+        upgrader: Upgrades a root, or only downloads its packages if its second argument is True, run in a thread
+            pool. By default, every root is upgraded with libalpm in a worker process of its own, as the callbacks
+            of libalpm are global to a process and it holds the GIL while it commits.
+        progress: Where the default upgrader reports its progress, if anywhere. The worker processes send it
+            through a queue, read by a thread of this process.
+
+    Returns:
+        List[RootSummary]: The summaries, in the order of roots.
+    """
+    summaries: List[RootSummary] = plan(roots, sync_dbpath, config, jobs)
+    pending: List[RootSpec] = [
+        spec
+        for spec, summary in zip(roots, summaries)
+        if summary.upgrades and not summary.error
+    ]
+    by_root: Dict[str, RootSummary] = {summary.root: summary for summary in summaries}
+
+    def wait(spec: RootSpec, future: Future) -> None:
+        try:
+            future.result()
+        # the other roots shouldn't be stopped by one failing root
+        except Exception as error:
+            by_root[spec.root].error = str(error)
+
+    with ExitStack() as stack:
+        executor: Executor
+        if upgrader:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=jobs))
+        else:
+            events: Optional[Queue] = None
+            if progress:
+                events = stack.enter_context(Manager()).Queue()
+                relay: threading.Thread = threading.Thread(
+                    target=_relay, args=(events, progress), daemon=True
+                )
+                relay.start()
+                stack.callback(relay.join)
+                stack.callback(events.put, None)
+            upgrader = partial(
+                _alpm_upgrade, sync_dbpath=sync_dbpath, config=config, events=events
+            )
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=jobs))
+        spec: RootSpec
+        for spec in pending:
+            if any(
+                upgrade.filename
+                and not os.path.exists(os.path.join(config.cache_dir, upgrade.filename))
+                for upgrade in by_root[spec.root].upgrades
+            ):
+                wait(spec, executor.submit(upgrader, spec, True))
+        futures: List[Tuple[RootSpec, Future]] = [
+            (spec, executor.submit(upgrader, spec, False))
+            for spec in pending
+            if not by_root[spec.root].error
+        ]
+        for spec, future in futures:
+            wait(spec, future)
+    for spec in pending:
+        complete.refresh_local(spec.dbpath)
+    return summaries
@@ -0,0 +1,356 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Checks the installed files against the .MTREE of their packages.
+
+The files are sharded across a process pool and the mismatches are yielded as soon as a shard finds them. A file
+whose mtime, ctime, size and inode didn't change since it last matched its checksum isn't hashed again.
+"""
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from pacmanpie import database
+import gzip
+import hashlib
+import json
+import os
+import re
+import stat
+
+_SHARD_SIZE: int = 512
+_TYPES: Dict[str, int] = {
+    "file": stat.S_IFREG,
+    "dir": stat.S_IFDIR,
+    "link": stat.S_IFLNK,
+}
+# (mtime and ctime in nanoseconds, size, inode, the checksum the file matched)
+_CacheValue = Tuple[int, int, int, int, str]
+
+
+@dataclass
+class MtreeEntry:
+    """A file of an .MTREE.
+
+    Args:
+        package (str): The package owning the file.
+        path (str): The path, relative to the root.
+        type (str): file, dir or link.
+        mode (int): The permissions.
+        uid (int): The owner.
+        gid (int): The group.
+        size (Optional[int]): The size of a file.
+        mtime (Optional[int]): The modification time of a file, in seconds.
+        digest (Optional[str]): The sha256 (or, for old packages, md5) checksum of a file.
+        link (Optional[str]): The target of a symlink.
+        backup (bool): Whether or not the file is a backup file, whose content is expected to change.
+    """
+
+    package: str
+    path: str
+    type: str = "file"
+    mode: int = 0o644
+    uid: int = 0
+    gid: int = 0
+    size: Optional[int] = None
+    mtime: Optional[int] = None
+    digest: Optional[str] = None
+    link: Optional[str] = None
+    backup: bool = False
+
+
+@dataclass
+class Mismatch:
+    """A file that doesn't match its .MTREE entry.
+
+    Args:
+        package (str): The package owning the file.
+        path (str): The path, relative to the root.
+        reason (str): What doesn't match.
+    """
+
+    package: str
+    path: str
+    reason: str
+
+
+def _unescape(token: bytes) -> str:
+    return re.sub(
+        rb"\\([0-7]{3})", lambda match: bytes([int(match.group(1), 8)]), token
+    ).decode(errors="surrogateescape")
+
+
+def parse_mtree(
+    data: bytes, package: str, backup: Iterable[str] = ()
+) -> List[MtreeEntry]:
+    """Parses an (optionally gzip compressed) .MTREE.
+
+    Args:
+        data: The content of the .MTREE.
+        package: The package owning the files.
+        backup: The backup files of the package.
+
+    Returns:
+        List[MtreeEntry]: The files, without the package metadata files (.PKGINFO, .INSTALL, ...).
+    """
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    backup = set(backup)
+    defaults: Dict[str, str] = {}
+    entries: List[MtreeEntry] = []
+    for line in data.splitlines():
+        tokens: List[bytes] = line.split()
+        if not tokens or tokens[0].startswith(b"#"):
+            continue
+        keywords: Dict[str, str] = dict(
+            (_unescape(key), _unescape(value))
+            for key, _, value in (token.partition(b"=") for token in tokens[1:])
+        )
+        if tokens[0] == b"/set":
+            defaults.update(keywords)
+            continue
+        if tokens[0] == b"/unset":
+            for key in keywords:
+                defaults.pop(key, None)
+            continue
+        path: str = _unescape(tokens[0])
+        path = path[2:] if path.startswith("./") else path
+        if path.startswith("."):
+            continue
+        keywords = {**defaults, **keywords}
+        entries.append(
+            MtreeEntry(
+                package,
+                path,
+                keywords.get("type", "file"),
+                int(keywords.get("mode", "644"), 8),
+                int(keywords.get("uid", "0")),
+                int(keywords.get("gid", "0")),
+                int(keywords["size"]) if "size" in keywords else None,
+                int(float(keywords["time"])) if "time" in keywords else None,
+                keywords.get("sha256digest") or keywords.get("md5digest"),
+                keywords.get("link"),
+                path in backup,
+            )
+        )
+    return entries
+
+
+def read_entries(
+    dbpath: str, packages: Optional[Iterable[str]] = None
+) -> List[MtreeEntry]:
+    """Reads the .MTREE of installed packages.
+
+    Args:
+        dbpath: The database location.
+        packages: The package names, every installed package if None.
+
+    Returns:
+        List[MtreeEntry]: The files of the packages. Packages without an .MTREE are skipped.
+
+    Raises:
+        ValueError: If a package isn't installed.
+    """
+    dirnames: Dict[str, str] = database.local_dirnames(dbpath)
+    missing: List[str] = [name for name in packages or () if name not in dirnames]
+    if missing:
+        raise ValueError(f"not installed: {', '.join(missing)}")
+    entries: List[MtreeEntry] = []
+    for name in sorted(dirnames if packages is None else packages):
+        mtree_path: str = os.path.join(dbpath, "local", dirnames[name], "mtree")
+        if not os.path.exists(mtree_path):
+            continue
+        package: database.Package = database.read_local_package(
+            dbpath, dirnames[name], files=True
+        )
+        with open(mtree_path, "rb") as mtree_file:
+            entries.extend(
+                parse_mtree(
+                    mtree_file.read(),
+                    name,
+                    (line.split("\t")[0] for line in package.fields.get("BACKUP", [])),
+                )
+            )
+    return entries
+
+
+def _digest(path: str, length: int) -> str:
+    """Hashes a file with the algorithm matching the length of the expected checksum.
+
+    Args:
+        path: The path of the file.
+        length: The length of the expected checksum, 32 for md5.
+
+    Returns:
+        The checksum.
+    """
+    digest = hashlib.md5() if length == 32 else hashlib.sha256()
+    with open(path, "rb") as checked_file:
+        for chunk in iter(lambda: checked_file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _check_entry(
+    root: str, entry: MtreeEntry, cached: Optional[_CacheValue]
+) -> Tuple[List[str], Optional[_CacheValue]]:
+    """Checks a file against its .MTREE entry.
+
+    Args:
+        root: The installation root.
+        entry: The entry.
+        cached: The cached result of the last check, if any.
+
+    Returns:
+        The reasons the file doesn't match, and the result to cache if its checksum matched.
+    """
+    path: str = os.path.join(root, entry.path)
+    try:
+        status: os.stat_result = os.lstat(path)
+    except FileNotFoundError:
+        return ["missing"], None
+    if stat.S_IFMT(status.st_mode) != _TYPES.get(entry.type):
+        return [f"type mismatch (expected {entry.type})"], None
+    reasons: List[str] = []
+    if entry.type != "link" and stat.S_IMODE(status.st_mode) != entry.mode:
+        reasons.append("permissions mismatch")
+    if (status.st_uid, status.st_gid) != (entry.uid, entry.gid):
+        reasons.append("owner mismatch")
+    if entry.type == "link" and os.readlink(path) != entry.link:
+        reasons.append("symlink target mismatch")
+    if entry.type != "file" or entry.backup:
+        return reasons, None
+    if entry.mtime is not None and int(status.st_mtime) != entry.mtime:
+        reasons.append("modification time mismatch")
+    if entry.size is not None and status.st_size != entry.size:
+        reasons.append("size mismatch")
+        return reasons, None
+    if not entry.digest:
+        return reasons, None
+    value: _CacheValue = (
+        status.st_mtime_ns,
+        status.st_ctime_ns,
+        status.st_size,
+        status.st_ino,
+        entry.digest,
+    )
+    if cached is not None and tuple(cached) == value:
+        return reasons, value
+    if _digest(path, len(entry.digest)) != entry.digest:
+        reasons.append("checksum mismatch")
+        return reasons, None
+    return reasons, value
+
+
+def _check_shard(
+    root: str, shard: List[Tuple[MtreeEntry, Optional[_CacheValue]]]
+) -> Tuple[List[Mismatch], Dict[str, _CacheValue]]:
+    """Checks a shard of files, in a worker process.
+
+    Args:
+        root: The installation root.
+        shard: The entries, with their cached results.
+
+    Returns:
+        The mismatches, and the results to cache.
+    """
+    mismatches: List[Mismatch] = []
+    results: Dict[str, _CacheValue] = {}
+    for entry, cached in shard:
+        reasons, value = _check_entry(root, entry, cached)
+        mismatches.extend(
+            Mismatch(entry.package, entry.path, reason) for reason in reasons
+        )
+        if value is not None:
+            results[entry.path] = value
+    return mismatches, results
+
+
+def _cache_path(dbpath: str) -> str:
+    return os.path.join(database.state_dir(dbpath, create=False), "check-cache.json")
+
+
+def _read_cache(dbpath: str, root: str) -> Dict[str, _CacheValue]:
+    try:
+        with open(_cache_path(dbpath)) as cache_file:
+            data: dict = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    return data["files"] if data.get("root") == os.path.abspath(root) else {}
+
+
+def _write_cache(dbpath: str, root: str, files: Dict[str, _CacheValue]) -> None:
+    path: str = _cache_path(dbpath)
+    temporary: str = database.temporary_path(path)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(temporary, "w") as cache_file:
+            json.dump({"root": os.path.abspath(root), "files": files}, cache_file)
+        os.replace(temporary, path)
+    except PermissionError:
+        # without write access to dbpath, every run checks every file
+        pass
+
+
+def audit(
+    root: str,
+    dbpath: str,
+    entries: List[MtreeEntry],
+    jobs: Optional[int] = None,
+    use_cache: bool = True,
+) -> Iterator[Mismatch]:
+    """Checks installed files against their .MTREE entries.
+
+    Notes:
+        The cache of matching checksums is only updated once every file was checked.
+
+    Args:
+        root: The installation root.
+        dbpath: The database location, where the cache is kept.
+        entries: The files to check, see read_entries.
+        jobs: The amount of worker processes, the amount of CPUs if None. 1 checks in this process.
+        use_cache: Whether or not files that matched before and didn't change should skip the checksum.
+
+    Returns:
+        Iterator[Mismatch]: The mismatches, as soon as they are found.
+    """
+    cache: Dict[str, _CacheValue] = _read_cache(dbpath, root) if use_cache else {}
+    pairs: List[Tuple[MtreeEntry, Optional[_CacheValue]]] = [
+        (entry, cache.get(entry.path)) for entry in entries
+    ]
+    shards: List[List[Tuple[MtreeEntry, Optional[_CacheValue]]]] = [
+        pairs[start : start + _SHARD_SIZE]
+        for start in range(0, len(pairs), _SHARD_SIZE)
+    ]
+    checked: Set[str] = {entry.path for entry in entries}
+    updated: Dict[str, _CacheValue] = {
+        path: value for path, value in cache.items() if path not in checked
+    }
+    if jobs == 1:
+        for shard in shards:
+            mismatches, results = _check_shard(root, shard)
+            updated.update(results)
+            yield from mismatches
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures: List[Future] = [
+                executor.submit(_check_shard, root, shard) for shard in shards
+            ]
+            for future in as_completed(futures):
+                mismatches, results = future.result()
+                updated.update(results)
+                yield from mismatches
+    if use_cache:
+        _write_cache(dbpath, root, updated)
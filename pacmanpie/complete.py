@@ -0,0 +1,256 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Shell completion of package names, served from a precomputed name cache.
+
+The cache is a header, a table of (offset, length, kinds) entries sorted by name and a blob holding the names. It is
+searched by prefix with a binary search. The shell runs this file as a script with ``python -I -S``, so answering
+a completion imports neither pacmanpie (and with it rich and pyalpm) nor anything outside the standard library.
+Only regenerating the cache reads the databases. Even typing isn't imported, as it takes longer to import than the
+lookup takes; the annotations use the builtin types instead.
+"""
+import os
+import struct
+import sys
+
+LOCAL: int = 1
+SYNC: int = 2
+_MAGIC: bytes = b"PPNC"
+_FORMAT_VERSION: int = 1
+_HEADER: struct.Struct = struct.Struct("<4sII")  # magic, format version, name count
+_ENTRY: struct.Struct = struct.Struct("<IHB")  # offset and length of the name, kinds
+_BASH_SCRIPT: str = """_ppacman() {
+    local cur="${COMP_WORDS[COMP_CWORD]}" dbpath=%(dbpath)s kind="" word i
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        word="${COMP_WORDS[i]}"
+        case "$word" in
+            -b|--dbpath) dbpath="${COMP_WORDS[i + 1]}" ;;
+            --dbpath=*) dbpath="${word#--dbpath=}" ;;
+            install) kind=--sync ;;
+            remove|check) kind=--local ;;
+        esac
+    done
+    if ((COMP_CWORD == 1)); then
+        COMPREPLY=($(compgen -W "%(commands)s" -- "$cur"))
+    elif [[ -n "$kind" && "$cur" != -* ]]; then
+        COMPREPLY=($(%(executable)s -I -S %(script)s "$kind" --dbpath "$dbpath" -- "$cur"))
+    fi
+}
+complete -o default -F _ppacman ppacman
+"""
+
+
+def cache_path(dbpath: str) -> str:
+    """The path of the name cache of a --dbpath.
+
+    Args:
+        dbpath: The database location.
+
+    Returns:
+        The path, inside the directory pacmanpie keeps its own data in.
+    """
+    return os.path.join(dbpath, "pacmanpie", "names.cache")
+
+
+def write_cache(path: str, names: dict) -> None:
+    """Writes a name cache atomically.
+
+    Args:
+        path: The path of the cache.
+        names: The kinds (LOCAL, SYNC or both) of every name, mapped to the name.
+    """
+    from pacmanpie import database
+
+    entries: bytearray = bytearray()
+    blob: bytearray = bytearray()
+    for name in sorted(names):
+        encoded: bytes = name.encode()
+        entries += _ENTRY.pack(len(blob), len(encoded), names[name])
+        blob += encoded
+    temporary: str = database.temporary_path(path)
+    with open(temporary, "wb") as cache_file:
+        cache_file.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, len(names)))
+        cache_file.write(entries)
+        cache_file.write(blob)
+    os.replace(temporary, path)
+
+
+class NameCache:
+    """A name cache, read at once.
+
+    Attributes:
+        path (str): The path of the cache.
+    """
+
+    def __init__(self, path: str) -> None:
+        """The initialization of NameCache.
+
+        Args:
+            path: The path of the cache.
+
+        Raises:
+            ValueError: If the file isn't a name cache of this version.
+        """
+        self.path: str = path
+        with open(path, "rb") as cache_file:
+            self._data: bytes = cache_file.read()
+        magic, version, self._count = _HEADER.unpack_from(self._data)
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {_FORMAT_VERSION} name cache")
+        self._blob: int = _HEADER.size + self._count * _ENTRY.size
+
+    def _entry(self, index: int) -> tuple:
+        offset, length, kinds = _ENTRY.unpack_from(
+            self._data, _HEADER.size + index * _ENTRY.size
+        )
+        return self._data[self._blob + offset : self._blob + offset + length], kinds
+
+    def complete(self, prefix: str, kinds: int = LOCAL | SYNC) -> list:
+        """Finds the names starting with a prefix.
+
+        Args:
+            prefix: The prefix.
+            kinds: The kinds the names should have any of.
+
+        Returns:
+            list: The names, sorted.
+        """
+        key: bytes = prefix.encode()
+        low, high = 0, self._count
+        while low < high:
+            middle: int = (low + high) // 2
+            if self._entry(middle)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        names: list = []
+        for index in range(low, self._count):
+            name, name_kinds = self._entry(index)
+            if not name.startswith(key):
+                break
+            if name_kinds & kinds:
+                names.append(name.decode())
+        return names
+
+    def names(self) -> dict:
+        """Lists every name.
+
+        Returns:
+            dict: The kinds of every name, mapped to the name.
+        """
+        return {
+            name.decode(): kinds
+            for name, kinds in (self._entry(index) for index in range(self._count))
+        }
+
+
+def refresh(dbpath: str, repos: list) -> None:
+    """Regenerates the name cache of a --dbpath, e.g. after the sync databases were refreshed.
+
+    Args:
+        dbpath: The database location.
+        repos: The repository names.
+    """
+    from pacmanpie import database, lock
+
+    with lock.shared(dbpath):
+        names: dict = dict.fromkeys(database.local_dirnames(dbpath), LOCAL)
+        for packages in database.load_sync_dbs(dbpath, repos):
+            for name in packages:
+                names[name] = names.get(name, 0) | SYNC
+    write_cache(os.path.join(database.state_dir(dbpath), "names.cache"), names)
+
+
+def refresh_local(dbpath: str) -> None:
+    """Updates the installed names of an existing name cache, after a transaction.
+
+    Notes:
+        The sync names are kept as they are, so no sync database is read. Nothing is done if there's no cache.
+
+    Args:
+        dbpath: The database location.
+    """
+    from pacmanpie import database, lock
+
+    path: str = cache_path(dbpath)
+    with lock.shared(dbpath):
+        try:
+            names: dict = NameCache(path).names()
+        except (OSError, ValueError):
+            return
+        names = {name: kinds & ~LOCAL for name, kinds in names.items() if kinds & SYNC}
+        for name in database.local_dirnames(dbpath):
+            names[name] = names.get(name, 0) | LOCAL
+        write_cache(path, names)
+
+
+def bash_script(dbpath: str, commands: list) -> str:
+    """Generates the bash completion script.
+
+    Args:
+        dbpath: The default database location.
+        commands: The subcommands to complete.
+
+    Returns:
+        The script, running this file with the current interpreter.
+    """
+    import shlex
+
+    return _BASH_SCRIPT % {
+        "dbpath": shlex.quote(dbpath),
+        "commands": " ".join(commands),
+        "executable": shlex.quote(sys.executable),
+        "script": shlex.quote(os.path.abspath(__file__)),
+    }
+
+
+def main(arguments: list) -> int:
+    """Prints the names starting with a prefix, one per line.
+
+    Args:
+        arguments: [--local | --sync] [--dbpath DBPATH] [--] PREFIX
+
+    Returns:
+        The exit status, 1 if there's no usable name cache.
+    """
+    kinds: int = LOCAL | SYNC
+    dbpath: str = "/var/lib/pacman"
+    prefix: str = ""
+    arguments = list(arguments)
+    while arguments:
+        argument: str = arguments.pop(0)
+        if argument == "--local":
+            kinds = LOCAL
+        elif argument == "--sync":
+            kinds = SYNC
+        elif argument == "--dbpath" and arguments:
+            dbpath = arguments.pop(0)
+        elif argument == "--":
+            prefix = arguments[0] if arguments else ""
+            break
+        else:
+            prefix = argument
+    try:
+        names: list = NameCache(cache_path(dbpath)).complete(prefix, kinds)
+    except (OSError, ValueError):
+        return 1
+    if names:
+        sys.stdout.write("\n".join(names) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
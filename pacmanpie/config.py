@@ -0,0 +1,129 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""A small reader for pacman.conf, only covering the options pacman-pie uses."""
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import os
+
+
+@dataclass
+class PacmanConfig:
+    """The parsed options of a pacman.conf file.
+
+    Args:
+        architecture (str): The Architecture option, "auto" if it wasn't given.
+        cache_dirs (List[str]): The CacheDir options, in the order they were given.
+        repos (Dict[str, List[str]]): The repositories in priority order, mapped to their servers.
+        ignore_pkgs (List[str]): The IgnorePkg patterns.
+        ignore_groups (List[str]): The IgnoreGroup groups.
+    """
+
+    architecture: str = "auto"
+    cache_dirs: List[str] = field(default_factory=list)
+    repos: Dict[str, List[str]] = field(default_factory=dict)
+    ignore_pkgs: List[str] = field(default_factory=list)
+    ignore_groups: List[str] = field(default_factory=list)
+
+    @property
+    def cache_dir(self) -> str:
+        """The first cache directory, which is the one pacman downloads to.
+
+        Returns:
+            str: The cache directory.
+        """
+        return self.cache_dirs[0] if self.cache_dirs else "/var/cache/pacman/pkg/"
+
+    @property
+    def arch(self) -> str:
+        """The architecture, with "auto" resolved to the one of the machine.
+
+        Returns:
+            str: The architecture.
+        """
+        return os.uname().machine if self.architecture == "auto" else self.architecture
+
+    def servers(self, repo: str) -> List[str]:
+        """The servers of a repository, with $repo and $arch substituted.
+
+        Args:
+            repo: The repository name.
+
+        Returns:
+            List[str]: The server URLs.
+        """
+        return [
+            server.replace("$repo", repo).replace("$arch", self.arch)
+            for server in self.repos.get(repo, [])
+        ]
+
+
+def _read_lines(path: str) -> List[str]:
+    """Reads the meaningful lines of a configuration file.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        The stripped lines, without comments and empty lines.
+    """
+    with open(path) as config_file:
+        lines: List[str] = [line.split("#", 1)[0].strip() for line in config_file]
+    return [line for line in lines if line]
+
+
+def _parse(path: str, config: PacmanConfig, section: Optional[str] = None) -> None:
+    """Parses a configuration file into config, following Include directives.
+
+    Args:
+        path: The path of the file.
+        config: The configuration to fill in.
+        section: The section the file is included from, if any.
+    """
+    for line in _read_lines(path):
+        if line.startswith("[") and line.endswith("]"):
+            section = line[1:-1]
+            if section != "options":
+                config.repos.setdefault(section, [])
+            continue
+        key, _, value = (part.strip() for part in line.partition("="))
+        if key == "Include" and os.path.exists(value):
+            _parse(value, config, section)
+        elif section == "options" and key == "Architecture":
+            config.architecture = value.split()[0]
+        elif section == "options" and key == "CacheDir":
+            config.cache_dirs.extend(value.split())
+        elif section == "options" and key == "IgnorePkg":
+            config.ignore_pkgs.extend(value.split())
+        elif section == "options" and key == "IgnoreGroup":
+            config.ignore_groups.extend(value.split())
+        elif section not in (None, "options") and key == "Server":
+            config.repos[section].append(value)
+
+
+def read_config(path: str = "/etc/pacman.conf") -> PacmanConfig:
+    """Reads a pacman.conf file.
+
+    Args:
+        path: The path of the pacman.conf file.
+
+    Returns:
+        PacmanConfig: The parsed configuration, or the defaults if the file doesn't exist.
+    """
+    config: PacmanConfig = PacmanConfig()
+    if os.path.exists(path):
+        _parse(path, config)
+    return config
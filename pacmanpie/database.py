@@ -0,0 +1,411 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Readers for the on-disk pacman databases found under --dbpath."""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple, IO, Union
+import io
+import os
+import re
+import tarfile
+import threading
+
+_ZSTD_MAGIC: bytes = b"\x28\xb5\x2f\xfd"
+
+
+@dataclass
+class Package:
+    """A package entry of a local or sync database.
+
+    Args:
+        name (str): The package name.
+        version (str): The full package version, e.g. 1:8.2.0814-3
+        fields (Dict[str, List[str]]): Every %FIELD% of the desc file, mapped to its values.
+        files (List[str]): The file list, relative to the root. Empty if it wasn't read.
+        repo (Optional[str]): The repository the package belongs to, None for local packages.
+    """
+
+    name: str
+    version: str
+    fields: Dict[str, List[str]] = field(default_factory=dict)
+    files: List[str] = field(default_factory=list)
+    repo: Optional[str] = None
+
+    def _values(self, key: str) -> List[str]:
+        return self.fields.get(key, [])
+
+    def _value(self, key: str) -> Optional[str]:
+        values: List[str] = self._values(key)
+        return values[0] if values else None
+
+    @property
+    def filename(self) -> Optional[str]:
+        """The archive filename of a sync package."""
+        return self._value("FILENAME")
+
+    @property
+    def depends(self) -> List[str]:
+        """The dependencies of the package, with their version constraints."""
+        return self._values("DEPENDS")
+
+    @property
+    def provides(self) -> List[str]:
+        """The virtual packages provided by the package, with their versions."""
+        return self._values("PROVIDES")
+
+    @property
+    def replaces(self) -> List[str]:
+        """The packages replaced by the package."""
+        return self._values("REPLACES")
+
+    @property
+    def groups(self) -> List[str]:
+        """The groups the package belongs to."""
+        return self._values("GROUPS")
+
+    @property
+    def sha256sum(self) -> Optional[str]:
+        """The sha256 checksum of the package archive."""
+        return self._value("SHA256SUM")
+
+    @property
+    def csize(self) -> int:
+        """The compressed size of the package archive."""
+        return int(self._value("CSIZE") or 0)
+
+    @property
+    def dirname(self) -> str:
+        """The name of the package directory inside a database."""
+        return f"{self.name}-{self.version}"
+
+
+def parse_desc(text: str) -> Dict[str, List[str]]:
+    """Parses a desc, depends or files database file.
+
+    Args:
+        text: The content of the file.
+
+    Returns:
+        The fields of the file, mapped to their values.
+
+    Examples:
+        >>> parse_desc("%NAME%\\nvim\\n\\n%DEPENDS%\\nvim-runtime=8.2.0814-3\\ngpm\\n")
+        {'NAME': ['vim'], 'DEPENDS': ['vim-runtime=8.2.0814-3', 'gpm']}
+    """
+    fields: Dict[str, List[str]] = {}
+    values: Optional[List[str]] = None
+    for line in text.splitlines():
+        if not line:
+            values = None
+        elif values is None and len(line) > 2 and line[0] == line[-1] == "%":
+            values = fields.setdefault(line[1:-1], [])
+        elif values is not None:
+            values.append(line)
+    return fields
+
+
+def format_desc(fields: Dict[str, List[str]]) -> str:
+    """The inverse of parse_desc.
+
+    Args:
+        fields: The fields to format, mapped to their values.
+
+    Returns:
+        The content of the file.
+    """
+    return "".join(
+        f"%{key}%\n" + "".join(f"{value}\n" for value in values) + "\n"
+        for key, values in fields.items()
+        if values
+    )
+
+
+def open_tar(path: str) -> tarfile.TarFile:
+    """Opens a (compressed) database or package archive.
+
+    Notes:
+        zstd compressed archives need the optional zstandard module.
+
+    Args:
+        path: The path of the archive.
+
+    Returns:
+        The opened archive.
+    """
+    with open(path, "rb") as archive:
+        magic: bytes = archive.read(4)
+    if magic != _ZSTD_MAGIC:
+        return tarfile.open(path)
+    import zstandard
+
+    with open(path, "rb") as archive:
+        data: bytes = zstandard.ZstdDecompressor().stream_reader(archive).read()
+    return tarfile.open(fileobj=io.BytesIO(data))
+
+
+@contextmanager
+def stream_tar(source: Union[str, io.BufferedReader]) -> Iterator[tarfile.TarFile]:
+    """Opens a (compressed) database or package archive for one pass over its members.
+
+    Notes:
+        Unlike open_tar, the archive is decompressed while its members are read, so nothing is loaded at once and
+        the members can only be read in order. zstd compressed archives need the optional zstandard module.
+
+    Args:
+        source: The path of the archive, or the archive opened in binary mode.
+
+    Returns:
+        A context manager giving the opened archive.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as archive_file:
+            with stream_tar(archive_file) as archive:
+                yield archive
+        return
+    if source.peek(4)[:4] != _ZSTD_MAGIC:
+        with tarfile.open(fileobj=source, mode="r|*") as archive:
+            yield archive
+        return
+    import zstandard
+
+    with zstandard.ZstdDecompressor().stream_reader(
+        source, closefd=False
+    ) as reader, tarfile.open(fileobj=reader, mode="r|") as archive:
+        yield archive
+
+
+def _read_member(archive: tarfile.TarFile, member: tarfile.TarInfo) -> str:
+    member_file: Optional[IO[bytes]] = archive.extractfile(member)
+    return member_file.read().decode() if member_file else ""
+
+
+def _package(fields: Dict[str, List[str]], repo: Optional[str] = None) -> Package:
+    return Package(fields["NAME"][0], fields["VERSION"][0], fields, repo=repo)
+
+
+def read_sync_db(path: str, repo: str) -> Dict[str, Package]:
+    """Reads a sync database (a .db or .files archive).
+
+    Args:
+        path: The path of the archive.
+        repo: The repository name.
+
+    Returns:
+        The packages of the repository, mapped to their names.
+    """
+    entries: Dict[str, Dict[str, List[str]]] = {}
+    file_lists: Dict[str, List[str]] = {}
+    with open_tar(path) as archive:
+        member: tarfile.TarInfo
+        for member in archive:
+            if not member.isfile():
+                continue
+            dirname, _, kind = member.name.partition("/")
+            fields: Dict[str, List[str]] = parse_desc(_read_member(archive, member))
+            if kind == "files":
+                file_lists[dirname] = fields.get("FILES", [])
+            else:
+                entries.setdefault(dirname, {}).update(fields)
+    packages: Dict[str, Package] = {}
+    for dirname, fields in entries.items():
+        package: Package = _package(fields, repo)
+        package.files = file_lists.get(dirname, [])
+        packages[package.name] = package
+    return packages
+
+
+def read_local_db(dbpath: str, files: bool = False) -> Dict[str, Package]:
+    """Reads the local database of a --dbpath.
+
+    Args:
+        dbpath: The database location.
+        files: Whether or not the file lists should be read too.
+
+    Returns:
+        The installed packages, mapped to their names.
+    """
+    packages: Dict[str, Package] = {}
+    local_path: str = os.path.join(dbpath, "local")
+    if not os.path.isdir(local_path):
+        return packages
+    entry: os.DirEntry
+    for entry in os.scandir(local_path):
+        if entry.is_dir() and os.path.exists(os.path.join(entry.path, "desc")):
+            package: Package = read_local_package(dbpath, entry.name, files)
+            packages[package.name] = package
+    return packages
+
+
+def read_local_package(dbpath: str, dirname: str, files: bool = False) -> Package:
+    """Reads a package of the local database of a --dbpath.
+
+    Args:
+        dbpath: The database location.
+        dirname: The name of the package directory, e.g. vim-8.2.0814-3
+        files: Whether or not the file list (and the %BACKUP% field next to it) should be read too.
+
+    Returns:
+        Package: The installed package.
+    """
+    path: str = os.path.join(dbpath, "local", dirname)
+    with open(os.path.join(path, "desc")) as desc_file:
+        package: Package = _package(parse_desc(desc_file.read()))
+    files_path: str = os.path.join(path, "files")
+    if files and os.path.exists(files_path):
+        with open(files_path) as files_file:
+            files_fields: Dict[str, List[str]] = parse_desc(files_file.read())
+        package.files = files_fields.pop("FILES", [])
+        package.fields.update(files_fields)
+    return package
+
+
+def local_dirnames(dbpath: str) -> Dict[str, str]:
+    """Lists the package directories of the local database of a --dbpath, without reading them.
+
+    Args:
+        dbpath: The database location.
+
+    Returns:
+        The package directory names, mapped to their package names.
+    """
+    local_path: str = os.path.join(dbpath, "local")
+    if not os.path.isdir(local_path):
+        return {}
+    return {
+        dirname.rsplit("-", 2)[0]: dirname
+        for dirname in os.listdir(local_path)
+        if dirname.count("-") >= 2
+    }
+
+
+def dependency_name(dependency: str) -> str:
+    """Strips the version constraint of a dependency, provision or conflict.
+
+    Args:
+        dependency: The dependency, e.g. glibc>=2.30
+
+    Returns:
+        The name of the dependency.
+
+    Examples:
+        >>> dependency_name("libfoo.so=1-64")
+        'libfoo.so'
+        >>> dependency_name("glibc")
+        'glibc'
+    """
+    return re.split("[<>=]", dependency, maxsplit=1)[0]
+
+
+def sync_db_path(dbpath: str, repo: str, extension: str = "db") -> str:
+    """The path of a sync database.
+
+    Args:
+        dbpath: The database location.
+        repo: The repository name.
+        extension: "db" for the package database, "files" for the file lists database.
+
+    Returns:
+        The path.
+    """
+    return os.path.join(dbpath, "sync", f"{repo}.{extension}")
+
+
+def state_dir(dbpath: str, create: bool = True) -> str:
+    """The directory where pacman-pie keeps its own data next to a database.
+
+    Args:
+        dbpath: The database location.
+        create: Whether or not the directory is created if it doesn't exist. Readers don't, as they may not have
+            write access to the database location.
+
+    Returns:
+        The path of the directory.
+    """
+    path: str = os.path.join(dbpath, "pacmanpie")
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+
+def temporary_path(path: str) -> str:
+    """A temporary path to write a file at before it replaces another one.
+
+    Notes:
+        The path is unique to the current process and thread, so concurrent writers of the same file never write
+        into each other's temporary file.
+
+    Args:
+        path: The path of the file to replace.
+
+    Returns:
+        The temporary path, next to the file and ending with .tmp.
+    """
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def file_key(path: str) -> Tuple[str, int, int]:
+    """Identifies a version of a file without reading it.
+
+    Args:
+        path: The path of the file.
+
+    Returns:
+        The real path, the modification time in nanoseconds and the size of the file.
+    """
+    stat: os.stat_result = os.stat(path)
+    return os.path.realpath(path), stat.st_mtime_ns, stat.st_size
+
+
+_sync_cache: Dict[Tuple[str, int, int], Dict[str, Package]] = {}
+_sync_cache_lock: threading.Lock = threading.Lock()
+
+
+def load_sync_db(path: str, repo: str) -> Dict[str, Package]:
+    """Reads a sync database, reusing the already parsed one if the file didn't change.
+
+    Notes:
+        The returned packages are shared between callers and shouldn't be modified.
+
+    Args:
+        path: The path of the archive.
+        repo: The repository name.
+
+    Returns:
+        The packages of the repository, mapped to their names.
+    """
+    key: Tuple[str, int, int] = file_key(path)
+    with _sync_cache_lock:
+        if key not in _sync_cache:
+            _sync_cache[key] = read_sync_db(path, repo)
+        return _sync_cache[key]
+
+
+def load_sync_dbs(dbpath: str, repos: List[str]) -> List[Dict[str, Package]]:
+    """Reads the sync databases of a --dbpath, in priority order.
+
+    Args:
+        dbpath: The database location.
+        repos: The repository names in priority order. Missing databases are skipped.
+
+    Returns:
+        The packages of every repository, mapped to their names.
+    """
+    return [
+        load_sync_db(sync_db_path(dbpath, repo), repo)
+        for repo in repos
+        if os.path.exists(sync_db_path(dbpath, repo))
+    ]
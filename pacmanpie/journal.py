@@ -0,0 +1,545 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""A journaled write path for the local database of a --dbpath.
+
+A commit is first written to the journal as a pending record. Then only the changed package directories are written
+and the record is marked as done. A crash at any point is repaired by replaying the pending records.
+
+The done records double as the change log of the indexes derived from the local database: the indexes are loaded
+from their last snapshot (or index file, for the file owners) and brought up to date by replaying the newer records,
+instead of being rebuilt.
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from pacmanpie import complete, database, lock
+from pacmanpie.database import Package
+from pacmanpie.owners import OwnerIndex, Source, merge_index, package_pairs, write_index
+import base64
+import hashlib
+import json
+import os
+import shutil
+
+_PENDING: str = ".pending"
+_DONE: str = ".done"
+_COMPACT_AFTER: int = 64
+
+
+def _fsync(path: str) -> None:
+    """Flushes a file or a directory to disk.
+
+    Args:
+        path: The path of the file or directory.
+    """
+    fd: int = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _write_durably(path: str, data: bytes) -> None:
+    """Atomically replaces a file, flushing it to disk first.
+
+    Args:
+        path: The path of the file. Its directory still has to be flushed by the caller.
+        data: The content of the file.
+    """
+    temporary: str = database.temporary_path(path)
+    with open(temporary, "wb") as temporary_file:
+        temporary_file.write(data)
+        temporary_file.flush()
+        os.fsync(temporary_file.fileno())
+    os.replace(temporary, path)
+
+
+def _entry(package: Package, mtree: Optional[bytes] = None) -> dict:
+    return {
+        "fields": package.fields,
+        "files": package.files,
+        "mtree": base64.b64encode(mtree).decode() if mtree else None,
+    }
+
+
+def _package(entry: dict) -> Package:
+    fields: Dict[str, List[str]] = entry["fields"]
+    return Package(fields["NAME"][0], fields["VERSION"][0], fields, entry["files"])
+
+
+def _is_contiguous(seq: int, newer: List[Tuple[int, str]]) -> bool:
+    """Checks if no record between an index and the newer records was dropped.
+
+    Args:
+        seq: The last record the index is up to date with.
+        newer: The newer records.
+
+    Returns:
+        True if the newer records can be replayed onto the index, False otherwise.
+    """
+    return not newer or newer[0][0] == seq + 1
+
+
+class DerivedIndex:
+    """The indexes derived from the local database.
+
+    Notes:
+        The file owners are kept in a separate, memory-mapped index, see Journal.owners.
+
+    Attributes:
+        seq (int): The last journal record the indexes are up to date with.
+        generation (int): The generation of the local database the indexes were built from.
+        provides (Dict[str, Set[str]]): The provisions, mapped to the packages providing them.
+        required_by (Dict[str, Set[str]]): The dependencies, mapped to the packages depending on them.
+    """
+
+    def __init__(self, seq: int = 0, generation: int = 0) -> None:
+        """The initialization of DerivedIndex.
+
+        Args:
+            seq: The last journal record the indexes are up to date with.
+            generation: The generation of the local database the indexes were built from.
+        """
+        self.seq: int = seq
+        self.generation: int = generation
+        self.provides: Dict[str, Set[str]] = {}
+        self.required_by: Dict[str, Set[str]] = {}
+
+    @classmethod
+    def build(
+        cls, packages: Iterable[Package], seq: int = 0, generation: int = 0
+    ) -> "DerivedIndex":
+        """Builds the indexes from scratch.
+
+        Args:
+            packages: The installed packages.
+            seq: The last journal record the packages are up to date with.
+            generation: The generation of the local database.
+
+        Returns:
+            DerivedIndex: The indexes.
+        """
+        index: DerivedIndex = cls(seq, generation)
+        for package in packages:
+            index.add(package)
+        return index
+
+    def _keys(self, package: Package) -> Iterable[Tuple[Dict[str, Set[str]], str]]:
+        for provision in package.provides:
+            yield self.provides, database.dependency_name(provision)
+        for dependency in package.depends:
+            yield self.required_by, database.dependency_name(dependency)
+
+    def add(self, package: Package) -> None:
+        """Adds an installed package to the indexes.
+
+        Args:
+            package: The package.
+        """
+        for index, key in self._keys(package):
+            index.setdefault(key, set()).add(package.name)
+
+    def remove(self, package: Package) -> None:
+        """Removes a package that is no longer installed from the indexes.
+
+        Args:
+            package: The package.
+        """
+        for index, key in self._keys(package):
+            names: Set[str] = index.get(key, set())
+            names.discard(package.name)
+            if not names:
+                index.pop(key, None)
+
+    def apply(self, record: dict) -> None:
+        """Brings the indexes up to date with a journal record.
+
+        Args:
+            record: The journal record.
+        """
+        for entry in record["remove"]:
+            self.remove(_package(entry))
+        for entry in record["add"]:
+            self.add(_package(entry))
+        self.seq = record["seq"]
+
+    def as_dict(self) -> dict:
+        """The indexes as plain data, for the snapshot.
+
+        Returns:
+            dict: The indexes.
+        """
+        return {
+            "seq": self.seq,
+            "generation": self.generation,
+            "provides": {key: sorted(names) for key, names in self.provides.items()},
+            "required_by": {
+                key: sorted(names) for key, names in self.required_by.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DerivedIndex":
+        """The inverse of as_dict.
+
+        Args:
+            data: The indexes as plain data.
+
+        Returns:
+            DerivedIndex: The indexes.
+        """
+        index: DerivedIndex = cls(data["seq"], data["generation"])
+        index.provides = {key: set(names) for key, names in data["provides"].items()}
+        index.required_by = {
+            key: set(names) for key, names in data["required_by"].items()
+        }
+        return index
+
+
+class Journal:
+    """The journal of the local database of a --dbpath.
+
+    Attributes:
+        dbpath (str): The database location.
+        path (str): The directory of the journal records.
+
+    Examples:
+        Installing a package and removing another one in a single commit:
+
+        >>> journal = Journal("/var/lib/pacman")  # doctest: +SKIP
+        >>> journal.commit(add=[vim], remove=["nano"], mtrees={"vim": vim_mtree})  # doctest: +SKIP
+        1
+    """
+
+    def __init__(self, dbpath: str) -> None:
+        """The initialization of Journal.
+
+        Args:
+            dbpath: The database location.
+        """
+        self.dbpath: str = dbpath
+        # created by the first writer, so reading needs no write access
+        self.path: str = os.path.join(
+            database.state_dir(dbpath, create=False), "journal"
+        )
+
+    @property
+    def _index_path(self) -> str:
+        return os.path.join(database.state_dir(self.dbpath), "local-index.json")
+
+    @property
+    def _owners_path(self) -> str:
+        return os.path.join(database.state_dir(self.dbpath), "local.owners")
+
+    @property
+    def _stamp_path(self) -> str:
+        return os.path.join(self.path, "stamp")
+
+    def _stamp(self) -> str:
+        """Fingerprints the package directories of the local database.
+
+        Returns:
+            The fingerprint, which changes whenever a package is installed, upgraded or removed.
+        """
+        local: str = os.path.join(self.dbpath, "local")
+        dirnames: List[str] = sorted(os.listdir(local)) if os.path.isdir(local) else []
+        return hashlib.sha1("\n".join(dirnames).encode()).hexdigest()
+
+    def _read_stamp(self) -> Tuple[int, Optional[str]]:
+        if not os.path.exists(self._stamp_path):
+            return 0, None
+        with open(self._stamp_path) as stamp_file:
+            generation, stamp = stamp_file.read().split()
+        return int(generation), stamp
+
+    def _write_stamp(self, generation: int) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        _write_durably(self._stamp_path, f"{generation} {self._stamp()}".encode())
+        _fsync(self.path)
+
+    def _generation(self) -> int:
+        """The generation of the local database.
+
+        Notes:
+            The generation is bumped whenever the local database was changed without going through the journal
+            (e.g. by pacman itself), which makes every derived index of an older generation stale.
+
+        Returns:
+            The generation.
+        """
+        generation, stamp = self._read_stamp()
+        if stamp != self._stamp():
+            generation += 1
+            self._write_stamp(generation)
+        return generation
+
+    def _records(self, suffix: str) -> List[Tuple[int, str]]:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(
+            (int(name[: -len(suffix)]), os.path.join(self.path, name))
+            for name in os.listdir(self.path)
+            if name.endswith(suffix)
+        )
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        with open(path) as record_file:
+            return json.load(record_file)
+
+    def _next_seq(self) -> int:
+        seqs: List[int] = [
+            seq for seq, _ in self._records(_PENDING) + self._records(_DONE)
+        ]
+        return max(seqs, default=0) + 1
+
+    def _apply(self, record: dict) -> None:
+        """Writes the changed package directories of a record into the local database.
+
+        Notes:
+            The new package directories are written and flushed to disk as a batch before anything in the local
+            database is touched. Applying a record again, e.g. after a crash, gives the same result.
+
+        Args:
+            record: The journal record.
+        """
+        local: str = os.path.join(self.dbpath, "local")
+        staging: str = os.path.join(self.path, f"staging-{record['seq']}")
+        trash: str = os.path.join(self.path, f"trash-{record['seq']}")
+        for path in (staging, trash):
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+        os.makedirs(local, exist_ok=True)
+        written: List[str] = []
+        packages: List[Package] = [_package(entry) for entry in record["add"]]
+        for package, entry in zip(packages, record["add"]):
+            path: str = os.path.join(staging, package.dirname)
+            os.makedirs(path)
+            files: Dict[str, bytes] = {
+                "desc": database.format_desc(
+                    {k: v for k, v in package.fields.items() if k != "BACKUP"}
+                ).encode(),
+                "files": database.format_desc(
+                    {"FILES": package.files, "BACKUP": package.fields.get("BACKUP", [])}
+                ).encode(),
+            }
+            if entry["mtree"]:
+                files["mtree"] = base64.b64decode(entry["mtree"])
+            for name, data in files.items():
+                with open(os.path.join(path, name), "wb") as package_file:
+                    package_file.write(data)
+                written.append(os.path.join(path, name))
+            written.append(path)
+        for path in written + [staging]:
+            _fsync(path)
+        for entry in record["remove"]:
+            old_path: str = os.path.join(local, _package(entry).dirname)
+            if os.path.exists(old_path):
+                os.replace(old_path, os.path.join(trash, _package(entry).dirname))
+        for package in packages:
+            new_path: str = os.path.join(local, package.dirname)
+            if os.path.exists(new_path):
+                shutil.rmtree(new_path)
+            os.replace(os.path.join(staging, package.dirname), new_path)
+        _fsync(local)
+        shutil.rmtree(trash)
+        shutil.rmtree(staging)
+
+    def _finish(self, seq: int, path: str) -> None:
+        os.replace(path, os.path.join(self.path, f"{seq:012d}{_DONE}"))
+        self._write_stamp(self._read_stamp()[0])
+
+    def _recover(self) -> int:
+        os.makedirs(self.path, exist_ok=True)
+        for name in os.listdir(self.path):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(self.path, name))
+        pending: List[Tuple[int, str]] = self._records(_PENDING)
+        for seq, path in pending:
+            self._apply(self._read(path))
+            self._finish(seq, path)
+        return len(pending)
+
+    def recover(self) -> int:
+        """Replays the records of interrupted commits, under the exclusive lock of the database location.
+
+        Returns:
+            int: The amount of replayed records.
+        """
+        with lock.exclusive(self.dbpath):
+            return self._recover()
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """Holds the shared lock of the database location, so no commit is seen half-done.
+
+        Notes:
+            Interrupted commits are replayed first, unless the current thread already holds a lock.
+
+        Returns:
+            A context manager holding the lock.
+        """
+        if self._records(_PENDING) and lock.held(self.dbpath) is None:
+            self.recover()
+        with lock.shared(self.dbpath):
+            yield
+
+    def commit(
+        self,
+        add: Iterable[Package] = (),
+        remove: Iterable[str] = (),
+        mtrees: Optional[Dict[str, bytes]] = None,
+    ) -> int:
+        """Installs and removes packages in the local database, as a single commit.
+
+        Notes:
+            The commit holds the exclusive lock of the database location, and the db.lck file of pacman, from
+            start to end. The installed names of the shell completion cache are updated too, if there's one.
+
+        Args:
+            add: The installed packages, with their file lists. Replaces an older version of the same package.
+            remove: The names of the removed packages.
+            mtrees: The (gzip compressed) mtree files of the installed packages, mapped to their names.
+
+        Returns:
+            int: The sequence number of the commit.
+        """
+        with lock.exclusive(self.dbpath):
+            self._recover()
+            self._generation()
+            mtrees = mtrees or {}
+            added: List[Package] = list(add)
+            dirnames: Dict[str, str] = database.local_dirnames(self.dbpath)
+            removed: Set[str] = set(remove) | {package.name for package in added}
+            seq: int = self._next_seq()
+            record: dict = {
+                "seq": seq,
+                "add": [_entry(package, mtrees.get(package.name)) for package in added],
+                "remove": [
+                    _entry(
+                        database.read_local_package(self.dbpath, dirnames[name], True)
+                    )
+                    for name in sorted(removed)
+                    if name in dirnames
+                ],
+            }
+            path: str = os.path.join(self.path, f"{seq:012d}{_PENDING}")
+            _write_durably(path, json.dumps(record).encode())
+            _fsync(self.path)
+            self._apply(record)
+            self._finish(seq, path)
+            complete.refresh_local(self.dbpath)
+            if len(self._records(_DONE)) > _COMPACT_AFTER:
+                self.compact()
+            return seq
+
+    def index(self) -> DerivedIndex:
+        """Loads the derived indexes, up to date with every commit.
+
+        Notes:
+            The indexes are only built from the whole local database if they have no snapshot of the current
+            generation. A new snapshot is written once many records had to be replayed.
+
+        Returns:
+            DerivedIndex: The indexes.
+        """
+        with self.reading():
+            generation: int = self._generation()
+            done: List[Tuple[int, str]] = self._records(_DONE)
+            if os.path.exists(self._index_path):
+                index: DerivedIndex = DerivedIndex.from_dict(
+                    self._read(self._index_path)
+                )
+                newer: List[Tuple[int, str]] = [
+                    (seq, path) for seq, path in done if seq > index.seq
+                ]
+                if index.generation == generation and _is_contiguous(index.seq, newer):
+                    for _, path in newer:
+                        index.apply(self._read(path))
+                    if len(newer) >= _COMPACT_AFTER:
+                        self._snapshot(index)
+                    return index
+            index = DerivedIndex.build(
+                database.read_local_db(self.dbpath).values(),
+                max((seq for seq, _ in done), default=0),
+                generation,
+            )
+            self._snapshot(index)
+            return index
+
+    def owners(self) -> OwnerIndex:
+        """Opens the file owner index, up to date with every commit.
+
+        Notes:
+            The index file is only built from the whole local database if it isn't of the current generation.
+            Otherwise the changes of the newer records are merged into it.
+
+        Returns:
+            OwnerIndex: The index, mapping paths to package names.
+        """
+        with self.reading():
+            generation: int = self._generation()
+            done: List[Tuple[int, str]] = self._records(_DONE)
+            source: Source = (generation, max((seq for seq, _ in done), default=0))
+            if os.path.exists(self._owners_path):
+                index: OwnerIndex = OwnerIndex(self._owners_path)
+                index_generation, index_seq = index.source
+                newer: List[Tuple[int, str]] = [
+                    (seq, path) for seq, path in done if seq > index_seq
+                ]
+                if index_generation == generation and _is_contiguous(index_seq, newer):
+                    if not newer:
+                        return index
+                    added: Set[Tuple[str, str]] = set()
+                    removed: Set[Tuple[str, str]] = set()
+                    for _, path in newer:
+                        record: dict = self._read(path)
+                        for entry in record["remove"]:
+                            pairs: List[Tuple[str, str]] = package_pairs(
+                                [_package(entry)]
+                            )
+                            added.difference_update(pairs)
+                            removed.update(pairs)
+                        for entry in record["add"]:
+                            added.update(package_pairs([_package(entry)]))
+                    index.close()
+                    return merge_index(self._owners_path, source, added, removed)
+                index.close()
+            write_index(
+                self._owners_path,
+                package_pairs(database.read_local_db(self.dbpath, files=True).values()),
+                source,
+            )
+            return OwnerIndex(self._owners_path)
+
+    def _snapshot(self, index: DerivedIndex) -> None:
+        _write_durably(self._index_path, json.dumps(index.as_dict()).encode())
+        _fsync(os.path.dirname(self._index_path))
+
+    def compact(self) -> None:
+        """Brings every derived index up to date and drops the records they cover.
+
+        Notes:
+            The newest record is always kept, so the sequence numbers keep increasing.
+        """
+        index: DerivedIndex = self.index()
+        self._snapshot(index)
+        owner_index: OwnerIndex = self.owners()
+        covered: int = min(index.seq, owner_index.source[1])
+        owner_index.close()
+        for seq, path in self._records(_DONE)[:-1]:
+            if seq <= covered:
+                os.remove(path)
@@ -0,0 +1,246 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Reader/writer locking of a --dbpath.
+
+Readers take a shared flock of the rw.lock file in the pacmanpie directory of the database, so any amount of them
+(and downloads, which hold no lock at all) run in parallel. A writer takes the exclusive flock for its commit phase
+only, and also creates the db.lck file pacman itself uses, so pacman and pacman-pie never commit at the same time.
+flock doesn't favor waiting writers, not even over new shared locks, so both first take the writer.lock turnstile
+exclusively: a reader only holds it while it waits for rw.lock, a writer holds it until it's done, which lets the
+running readers finish while no new reader starts. The flip side is that a writer waiting for a long reader keeps
+every new reader waiting too, so readers must only hold the lock while they read the database, e.g. check reads
+the .MTREE entries under it but checks the files without it, and downloads hold no lock of pacman-pie at all.
+
+Readers only open the lock files for reading, as flock doesn't need more, so they work without write access to the
+database location (e.g. a query run by a user). If the lock files don't exist yet and can't be created, no writer
+of pacman-pie has run there, and readers go without the lock.
+
+The locks are re-entrant per thread: a thread holding a lock may take it again, and a thread holding the exclusive
+lock may take the shared one. Taking the exclusive lock while holding only the shared one is an error, as it could
+never be granted.
+"""
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+import errno
+import fcntl
+import os
+import threading
+import time
+
+SHARED: int = fcntl.LOCK_SH
+EXCLUSIVE: int = fcntl.LOCK_EX
+_POLL_INTERVAL: float = 0.01
+_MARKER: bytes = b"pacmanpie\n"
+_held: threading.local = threading.local()
+
+
+def _locks() -> Dict[str, int]:
+    """The locks held by the current thread.
+
+    Returns:
+        The mode of every lock, mapped to the real path of its database location.
+    """
+    if not hasattr(_held, "locks"):
+        _held.locks = {}
+    return _held.locks
+
+
+def held(dbpath: str) -> Optional[int]:
+    """The lock the current thread holds on a --dbpath.
+
+    Args:
+        dbpath: The database location.
+
+    Returns:
+        SHARED, EXCLUSIVE or None if the thread holds no lock.
+    """
+    return _locks().get(os.path.realpath(dbpath))
+
+
+def _expired(deadline: Optional[float]) -> bool:
+    if deadline is not None and time.monotonic() >= deadline:
+        return True
+    time.sleep(_POLL_INTERVAL)
+    return False
+
+
+def _open(path: str, reader: bool) -> Optional[int]:
+    """Opens a lock file, creating it and its directory if it doesn't exist.
+
+    Returns:
+        The file descriptor, None if a reader can't create the file.
+
+    Raises:
+        PermissionError: If a writer can't create the file.
+    """
+    if reader:
+        try:
+            return os.open(path, os.O_RDONLY)
+        except FileNotFoundError:
+            pass
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    except PermissionError:
+        if reader:
+            return None
+        raise
+
+
+def _flock(
+    path: str, mode: int, deadline: Optional[float], reader: bool
+) -> Optional[int]:
+    """Opens and flocks a lock file.
+
+    Returns:
+        The file descriptor holding the lock, None if a reader can't create the file.
+
+    Raises:
+        BlockingIOError: If the lock wasn't granted before the deadline.
+        PermissionError: If a writer can't create the file.
+    """
+    descriptor: Optional[int] = _open(path, reader)
+    if descriptor is None:
+        return None
+    if deadline is None:
+        fcntl.flock(descriptor, mode)
+        return descriptor
+    while True:
+        try:
+            fcntl.flock(descriptor, mode | fcntl.LOCK_NB)
+            return descriptor
+        except BlockingIOError:
+            if _expired(deadline):
+                os.close(descriptor)
+                raise BlockingIOError(errno.EAGAIN, f"{path} is locked")
+
+
+def _create_db_lck(dbpath: str) -> str:
+    """Creates the db.lck file of pacman.
+
+    Notes:
+        Like pacman, this doesn't wait for the file to go away. A db.lck file written by pacman-pie is taken over
+        though, as its writer held the exclusive lock and so can only have been interrupted.
+
+    Returns:
+        The path of the file.
+
+    Raises:
+        BlockingIOError: If the file exists, e.g. because pacman is running.
+    """
+    path: str = os.path.join(dbpath, "db.lck")
+    try:
+        descriptor: int = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        try:
+            with open(path, "rb") as lock_file:
+                if lock_file.read() == _MARKER:
+                    return path
+        except OSError:
+            pass
+        raise BlockingIOError(
+            errno.EAGAIN, f"{path} exists, pacman is running or was interrupted"
+        )
+    try:
+        os.write(descriptor, _MARKER)
+    finally:
+        os.close(descriptor)
+    return path
+
+
+@contextmanager
+def _lock(
+    dbpath: str, mode: int, timeout: Optional[float], pacman: bool
+) -> Iterator[None]:
+    key: str = os.path.realpath(dbpath)
+    held: Optional[int] = _locks().get(key)
+    if held is not None:
+        if mode == EXCLUSIVE and held != EXCLUSIVE:
+            raise RuntimeError(f"can't lock {dbpath} exclusively while reading it")
+        yield
+        return
+    deadline: Optional[float] = None if timeout is None else time.monotonic() + timeout
+    directory: str = os.path.join(dbpath, "pacmanpie")
+    # a waiting writer holds the turnstile, so no new reader starves it
+    turnstile: Optional[int] = _flock(
+        os.path.join(directory, "writer.lock"), EXCLUSIVE, deadline, mode == SHARED
+    )
+    descriptors: List[int] = [] if turnstile is None else [turnstile]
+    db_lck: Optional[str] = None
+    try:
+        rw_lock: Optional[int] = None
+        if turnstile is not None:
+            rw_lock = _flock(
+                os.path.join(directory, "rw.lock"), mode, deadline, mode == SHARED
+            )
+        if rw_lock is not None:
+            descriptors.append(rw_lock)
+        if mode == SHARED and turnstile is not None:
+            descriptors.remove(turnstile)
+            os.close(turnstile)
+        elif mode == EXCLUSIVE and pacman:
+            db_lck = _create_db_lck(dbpath)
+        _locks()[key] = mode
+        try:
+            yield
+        finally:
+            del _locks()[key]
+            if db_lck:
+                os.remove(db_lck)
+    finally:
+        for descriptor in descriptors:
+            os.close(descriptor)
+
+
+def shared(dbpath: str, timeout: Optional[float] = None) -> Iterator[None]:
+    """Locks a --dbpath for reading, along with other readers.
+
+    Notes:
+        Keep the critical section short: while a writer waits for the lock to be released, no new reader gets it.
+
+    Args:
+        dbpath: The database location.
+        timeout: How many seconds to wait for a writer, forever if None.
+
+    Returns:
+        A context manager holding the lock.
+
+    Raises:
+        BlockingIOError: If the lock wasn't granted in time.
+    """
+    return _lock(dbpath, SHARED, timeout, False)
+
+
+def exclusive(
+    dbpath: str, timeout: Optional[float] = None, pacman: bool = True
+) -> Iterator[None]:
+    """Locks a --dbpath for committing, without any reader or other writer.
+
+    Args:
+        dbpath: The database location.
+        timeout: How many seconds to wait for the readers and writers, forever if None.
+        pacman: Whether or not the db.lck file of pacman should be created too, failing at once if it exists.
+            libalpm transactions create it themselves.
+
+    Returns:
+        A context manager holding the lock.
+
+    Raises:
+        BlockingIOError: If the lock wasn't granted in time, or if db.lck exists.
+        RuntimeError: If the current thread holds the shared lock.
+    """
+    return _lock(dbpath, EXCLUSIVE, timeout, pacman)
@@ -0,0 +1,339 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Persistent, memory-mapped file to package indexes.
+
+An index file is a header, a table of package names, a table of (path, package) entries sorted by path and a blob
+holding the strings. Lookups binary search the memory-mapped entries, so opening an index doesn't read it.
+"""
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+from pacmanpie import database
+import heapq
+import mmap
+import os
+import struct
+
+_MAGIC: bytes = b"PPOW"
+_FORMAT_VERSION: int = 1
+# magic, format version, source (what the index was built from), path count, package count
+_HEADER: struct.Struct = struct.Struct("<4sIqqII")
+_PACKAGE: struct.Struct = struct.Struct("<II")  # offset and length of the name
+_ENTRY: struct.Struct = struct.Struct("<III")  # offset and length of the path, package
+Source = Tuple[int, int]
+
+
+def normalize(path: str) -> str:
+    """Converts a path to the form used by file lists.
+
+    Args:
+        path: The absolute or relative path.
+
+    Returns:
+        The path relative to the root, with the symlinks of its directories resolved.
+
+    Examples:
+        >>> normalize("/usr/lib/../lib/libalpm.so")
+        'usr/lib/libalpm.so'
+    """
+    path = os.path.abspath(path)
+    directory, name = os.path.split(path)
+    return os.path.join(os.path.realpath(directory), name).lstrip("/")
+
+
+def write_index(path: str, pairs: Iterable[Tuple[str, str]], source: Source) -> None:
+    """Writes an index file atomically.
+
+    Args:
+        path: The path of the index file.
+        pairs: The (path, package) pairs, sorted.
+        source: What the index was built from, e.g. the size and mtime of a .files database.
+    """
+    packages: Dict[str, int] = {}
+    entries: List[Tuple[bytes, int]] = []
+    for file_path, package in pairs:
+        entries.append(
+            (file_path.encode(), packages.setdefault(package, len(packages)))
+        )
+    blob: bytearray = bytearray()
+    package_table: bytearray = bytearray()
+    for package in packages:
+        package_table += _PACKAGE.pack(len(blob), len(package.encode()))
+        blob += package.encode()
+    entry_table: bytearray = bytearray()
+    for file_path, package_index in entries:
+        entry_table += _ENTRY.pack(len(blob), len(file_path), package_index)
+        blob += file_path
+    temporary: str = database.temporary_path(path)
+    with open(temporary, "wb") as index_file:
+        index_file.write(
+            _HEADER.pack(
+                _MAGIC,
+                _FORMAT_VERSION,
+                source[0],
+                source[1],
+                len(entries),
+                len(packages),
+            )
+        )
+        index_file.write(package_table)
+        index_file.write(entry_table)
+        index_file.write(blob)
+        index_file.flush()
+        os.fsync(index_file.fileno())
+    os.replace(temporary, path)
+
+
+class OwnerIndex:
+    """A memory-mapped index file.
+
+    Attributes:
+        path (str): The path of the index file.
+        source (Tuple[int, int]): What the index was built from.
+    """
+
+    def __init__(self, path: str) -> None:
+        """The initialization of OwnerIndex.
+
+        Args:
+            path: The path of the index file.
+
+        Raises:
+            ValueError: If the file isn't an index file of this version.
+        """
+        self.path: str = path
+        with open(path, "rb") as index_file:
+            self._map: mmap.mmap = mmap.mmap(
+                index_file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        magic, version, first, second, self._count, packages = _HEADER.unpack_from(
+            self._map
+        )
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {_FORMAT_VERSION} index file")
+        self.source: Source = (first, second)
+        self._entries: int = _HEADER.size + packages * _PACKAGE.size
+        self._blob: int = self._entries + self._count * _ENTRY.size
+        self._packages: List[str] = [
+            self._string(
+                *_PACKAGE.unpack_from(self._map, _HEADER.size + i * _PACKAGE.size)
+            )
+            for i in range(packages)
+        ]
+
+    def _string(self, offset: int, length: int) -> str:
+        return self._map[self._blob + offset : self._blob + offset + length].decode()
+
+    def _path(self, index: int) -> bytes:
+        offset, length, _ = _ENTRY.unpack_from(
+            self._map, self._entries + index * _ENTRY.size
+        )
+        return self._map[self._blob + offset : self._blob + offset + length]
+
+    def _package(self, index: int) -> str:
+        return self._packages[
+            _ENTRY.unpack_from(self._map, self._entries + index * _ENTRY.size)[2]
+        ]
+
+    def _bisect(self, path: bytes, low: int = 0) -> int:
+        high: int = self._count
+        while low < high:
+            middle: int = (low + high) // 2
+            if self._path(middle) < path:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def lookup(self, path: str) -> List[str]:
+        """Finds the packages owning a path.
+
+        Args:
+            path: The path, relative to the root.
+
+        Returns:
+            List[str]: The packages, sorted.
+        """
+        return self.lookup_many([path])[path]
+
+    def lookup_many(self, paths: Iterable[str]) -> Dict[str, List[str]]:
+        """Finds the packages owning many paths at once.
+
+        Notes:
+            The paths are looked up in sorted order, so every binary search starts where the previous one ended.
+
+        Args:
+            paths: The paths, relative to the root.
+
+        Returns:
+            Dict[str, List[str]]: The packages owning every path, mapped to the path.
+        """
+        results: Dict[str, List[str]] = {}
+        low: int = 0
+        for path in sorted(set(paths)):
+            key: bytes = path.encode()
+            low = self._bisect(key, low)
+            index: int = low
+            owners: List[str] = []
+            while index < self._count and self._path(index) == key:
+                owners.append(self._package(index))
+                index += 1
+            results[path] = sorted(owners)
+        return results
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        for index in range(self._count):
+            yield self._path(index).decode(), self._package(index)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def close(self) -> None:
+        """Unmaps the index file."""
+        self._map.close()
+
+
+def merge_index(
+    path: str,
+    source: Source,
+    added: Iterable[Tuple[str, str]],
+    removed: Set[Tuple[str, str]],
+) -> OwnerIndex:
+    """Updates an index file with the changes of some packages, without rebuilding it.
+
+    Args:
+        path: The path of the index file.
+        source: What the updated index is built from.
+        added: The added (path, package) pairs.
+        removed: The removed (path, package) pairs.
+
+    Returns:
+        OwnerIndex: The updated index.
+    """
+    old: OwnerIndex = OwnerIndex(path)
+    kept: Iterator[Tuple[str, str]] = (pair for pair in old if pair not in removed)
+    write_index(path, _unique(heapq.merge(kept, sorted(set(added)))), source)
+    old.close()
+    return OwnerIndex(path)
+
+
+def _unique(pairs: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, str]]:
+    previous: Tuple[str, str] = ("", "")
+    for pair in pairs:
+        if pair != previous:
+            yield pair
+        previous = pair
+
+
+def package_pairs(
+    packages: Iterable[database.Package], prefix: str = ""
+) -> List[Tuple[str, str]]:
+    """Lists the (path, package) pairs of packages.
+
+    Args:
+        packages: The packages, with their file lists.
+        prefix: Prepended to the package names, e.g. the repository.
+
+    Returns:
+        The pairs, sorted.
+    """
+    return sorted(
+        (path, prefix + package.name) for package in packages for path in package.files
+    )
+
+
+def lookup_packages(
+    packages: Iterable[database.Package], paths: Iterable[str], prefix: str = ""
+) -> Dict[str, List[str]]:
+    """Finds the packages owning many paths at once by going through their file lists, without an index file.
+
+    Notes:
+        This is what the lookups fall back to when the index file can't be written, e.g. without write access to
+        the database location.
+
+    Args:
+        packages: The packages, with their file lists.
+        paths: The paths, relative to the root.
+        prefix: Prepended to the package names, e.g. the repository.
+
+    Returns:
+        Dict[str, List[str]]: The names of the packages owning every path, mapped to the path.
+    """
+    results: Dict[str, List[str]] = {path: [] for path in paths}
+    for path, package in package_pairs(packages, prefix):
+        if path in results:
+            results[path].append(package)
+    return results
+
+
+def sync_owners(dbpath: str, repo: str) -> OwnerIndex:
+    """Opens the index of the .files database of a repository, rebuilding it if the database changed.
+
+    Args:
+        dbpath: The database location.
+        repo: The repository name.
+
+    Returns:
+        OwnerIndex: The index, mapping paths to repo/package names.
+    """
+    files_path: str = database.sync_db_path(dbpath, repo, "files")
+    stat: os.stat_result = os.stat(files_path)
+    source: Source = (stat.st_mtime_ns, stat.st_size)
+    path: str = os.path.join(database.state_dir(dbpath), f"sync-{repo}.owners")
+    if os.path.exists(path):
+        index: OwnerIndex = OwnerIndex(path)
+        if index.source == source:
+            return index
+        index.close()
+    packages: Dict[str, database.Package] = database.read_sync_db(files_path, repo)
+    write_index(path, package_pairs(packages.values(), f"{repo}/"), source)
+    return OwnerIndex(path)
+
+
+def lookup_sync(
+    dbpath: str, repos: List[str], paths: Iterable[str]
+) -> Dict[str, List[str]]:
+    """Finds the sync packages providing many paths at once.
+
+    Notes:
+        A repository whose index can't be written is searched without one.
+
+    Args:
+        dbpath: The database location.
+        repos: The repository names in priority order. Repositories without a .files database are skipped.
+        paths: The paths, relative to the root.
+
+    Returns:
+        Dict[str, List[str]]: The repo/package names providing every path, mapped to the path.
+    """
+    paths = list(paths)
+    results: Dict[str, List[str]] = {path: [] for path in paths}
+    for repo in repos:
+        files_path: str = database.sync_db_path(dbpath, repo, "files")
+        if not os.path.exists(files_path):
+            continue
+        found: Dict[str, List[str]]
+        try:
+            index: OwnerIndex = sync_owners(dbpath, repo)
+        except PermissionError:
+            found = lookup_packages(
+                database.read_sync_db(files_path, repo).values(), paths, f"{repo}/"
+            )
+        else:
+            found = index.lookup_many(paths)
+            index.close()
+        for path, owners in found.items():
+            results[path].extend(owners)
+    return results
@@ -0,0 +1,306 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Downloads the archives of the pending upgrades into the package cache ahead of the upgrade.
+
+The pending upgrades come from pacmanpie.upgrades.pending, so the plan is the one cached for the upgrade itself.
+Archives are downloaded one at a time into a .part file next to their final name, which a later run resumes with an
+HTTP range request. A finished archive is checked against the sha256 sum of its sync database entry before it's
+renamed, so the upgrade finds it in the cache and only has to verify and install it.
+"""
+from dataclasses import dataclass
+from typing import List, Optional
+from pacmanpie import database, upgrades
+from pacmanpie.config import PacmanConfig
+from pacmanpie.database import Package
+from pacmanpie.progress import RETRIEVAL, Progress, Task
+from pacmanpie.upgrades import Upgrade
+import ctypes
+import fcntl
+import hashlib
+import os
+import re
+import shutil
+import time
+import urllib.error
+import urllib.request
+
+_CHUNK_SIZE: int = 64 * 1024
+_IOPRIO_SET: dict = {"x86_64": 251, "i686": 289, "aarch64": 30, "armv7l": 314}
+# IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT
+_IOPRIO_IDLE: int = 3 << 13
+
+
+@dataclass
+class Download:
+    """An archive to download.
+
+    Args:
+        upgrade (Upgrade): The upgrade needing the archive.
+        urls (List[str]): The URLs of the archive, one per server of its repository.
+        sha256sum (Optional[str]): The checksum of the archive, from the sync database.
+        size (int): The size of the archive, from the sync database.
+    """
+
+    upgrade: Upgrade
+    urls: List[str]
+    sha256sum: Optional[str] = None
+    size: int = 0
+
+
+@dataclass
+class Fetched:
+    """The outcome of a download.
+
+    Args:
+        filename (str): The archive filename.
+        status (str): cached, downloaded, skipped or failed.
+        reason (Optional[str]): Why the archive was skipped or failed.
+    """
+
+    filename: str
+    status: str
+    reason: Optional[str] = None
+
+
+def parse_size(size: str) -> int:
+    """Parses a size with an optional binary unit suffix.
+
+    Args:
+        size: The size, e.g. 512K, 5G or 1048576.
+
+    Returns:
+        The size in bytes.
+
+    Raises:
+        ValueError: If the size can't be parsed.
+
+    Examples:
+        >>> parse_size("1.5M")
+        1572864
+    """
+    match: Optional[re.Match] = re.fullmatch(
+        r"([0-9.]+)\s*([KMGT]?)(?:i?B)?", size.strip(), re.IGNORECASE
+    )
+    if not match:
+        raise ValueError(f"invalid size: {size}")
+    return int(
+        float(match.group(1)) * 1024 ** " KMGT".index(match.group(2).upper() or " ")
+    )
+
+
+def lower_priority() -> None:
+    """Gives the current process the lowest CPU priority and, on Linux, the idle I/O scheduling class."""
+    os.nice(19)
+    number: Optional[int] = _IOPRIO_SET.get(os.uname().machine)
+    if number is None:
+        return
+    try:
+        # IOPRIO_WHO_PROCESS, the current process
+        ctypes.CDLL(None, use_errno=True).syscall(number, 1, 0, _IOPRIO_IDLE)
+    except (OSError, AttributeError):
+        pass
+
+
+def plan(dbpath: str, config: PacmanConfig) -> List[Download]:
+    """Lists the archives the pending upgrades need.
+
+    Args:
+        dbpath: The database location.
+        config: The configuration providing the repositories, their servers and the ignored packages.
+
+    Returns:
+        List[Download]: The archives, in the order of the upgrades.
+    """
+    downloads: List[Download] = []
+    upgrade: Upgrade
+    for upgrade in upgrades.pending(
+        dbpath, list(config.repos), config.ignore_pkgs, config.ignore_groups
+    ):
+        if not upgrade.filename:
+            continue
+        package: Package = database.load_sync_db(
+            database.sync_db_path(dbpath, upgrade.repo), upgrade.repo
+        )[upgrade.name]
+        downloads.append(
+            Download(
+                upgrade,
+                [
+                    f"{server.rstrip('/')}/{upgrade.filename}"
+                    for server in config.servers(upgrade.repo)
+                ],
+                package.sha256sum,
+                package.csize,
+            )
+        )
+    return downloads
+
+
+def cache_usage(cache_dir: str) -> int:
+    """Sums the sizes of the files of a package cache.
+
+    Args:
+        cache_dir: The cache directory.
+
+    Returns:
+        The size in bytes.
+    """
+    return sum(
+        entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file()
+    )
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as archive:
+        for chunk in iter(lambda: archive.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fetch(
+    download: Download,
+    cache_dir: str,
+    rate: Optional[int] = None,
+    task: Optional[Task] = None,
+) -> None:
+    """Downloads an archive into a package cache, resuming a previous attempt.
+
+    Args:
+        download: The archive.
+        cache_dir: The cache directory.
+        rate: The maximum amount of bytes per second, unlimited if None.
+        task: Where the progress is reported, if anywhere.
+
+    Raises:
+        OSError: If no server has the archive, or if the archive doesn't match its checksum.
+    """
+    path: str = os.path.join(cache_dir, download.upgrade.filename)
+    part: str = path + ".part"
+    errors: List[str] = []
+    for url in download.urls:
+        offset: int = os.path.getsize(part) if os.path.exists(part) else 0
+        request: urllib.request.Request = urllib.request.Request(url)
+        if offset:
+            request.add_header("Range", f"bytes={offset}-")
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                if response.status != 206:
+                    offset = 0
+                with open(part, "ab" if offset else "wb") as part_file:
+                    started: float = time.monotonic()
+                    received: int = 0
+                    for chunk in iter(lambda: response.read(_CHUNK_SIZE), b""):
+                        part_file.write(chunk)
+                        received += len(chunk)
+                        if task:
+                            task.update(offset + received, download.size)
+                        if rate:
+                            delay: float = received / rate - (
+                                time.monotonic() - started
+                            )
+                            if delay > 0:
+                                time.sleep(delay)
+        except urllib.error.HTTPError as error:
+            # 416 means the .part file is already complete
+            if error.code != 416:
+                errors.append(f"{url}: {error}")
+                continue
+        except (urllib.error.URLError, OSError) as error:
+            errors.append(f"{url}: {error}")
+            continue
+        if download.sha256sum and _sha256(part) != download.sha256sum:
+            os.remove(part)
+            raise OSError(f"{download.upgrade.filename} doesn't match its checksum")
+        os.replace(part, path)
+        if task:
+            task.finish()
+        return
+    raise OSError("; ".join(errors) or f"no server for {download.upgrade.filename}")
+
+
+def prefetch(
+    dbpath: str,
+    config: PacmanConfig,
+    rate: Optional[int] = None,
+    max_cache_size: Optional[int] = None,
+    progress: Optional[Progress] = None,
+) -> List[Fetched]:
+    """Downloads the archives of the pending upgrades into the package cache.
+
+    Notes:
+        Archives that would make the cache bigger than max_cache_size, or don't fit on its file system, are
+        skipped. Only one prefetch runs at a time per database location.
+
+    Args:
+        dbpath: The database location.
+        config: The configuration providing the repositories and the package cache.
+        rate: The maximum amount of bytes per second, unlimited if None.
+        max_cache_size: The maximum size of the package cache in bytes, unlimited if None.
+        progress: Where the downloads report their progress, if anywhere.
+
+    Returns:
+        List[Fetched]: The outcome of every download, in the order of the upgrades.
+
+    Raises:
+        RuntimeError: If another prefetch of the database location is running.
+    """
+    cache_dir: str = config.cache_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(database.state_dir(dbpath), "prefetch.lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError(f"another prefetch of {dbpath} is running")
+        usage: int = cache_usage(cache_dir)
+        results: List[Fetched] = []
+        download: Download
+        for download in plan(dbpath, config):
+            filename: str = download.upgrade.filename
+            path: str = os.path.join(cache_dir, filename)
+            if os.path.exists(path):
+                results.append(Fetched(filename, "cached"))
+                continue
+            part: str = path + ".part"
+            needed: int = download.size - (
+                os.path.getsize(part) if os.path.exists(part) else 0
+            )
+            if max_cache_size is not None and usage + needed > max_cache_size:
+                results.append(Fetched(filename, "skipped", "the cache is full"))
+                continue
+            if shutil.disk_usage(cache_dir).free < needed:
+                results.append(Fetched(filename, "skipped", "not enough free space"))
+                continue
+            task: Optional[Task] = (
+                progress.task(
+                    RETRIEVAL,
+                    f"{download.upgrade.name} {download.upgrade.new_version}",
+                    download.size,
+                    True,
+                )
+                if progress
+                else None
+            )
+            try:
+                fetch(download, cache_dir, rate, task)
+            except OSError as error:
+                if task:
+                    progress.discard(task)
+                results.append(Fetched(filename, "failed", str(error)))
+                continue
+            usage += max(needed, 0)
+            results.append(Fetched(filename, "downloaded"))
+        return results
@@ -0,0 +1,341 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Live transaction progress, rendered by one thread at a fixed frame rate.
+
+Every task has a single writer, e.g. the download or the worker it tracks, which only stores numbers into the task.
+Nothing is locked or rendered when a task is updated, so a callback costs the same no matter how many tasks are in
+flight. The render thread reads the tasks at its own pace: on a terminal it redraws the tasks in flight in place,
+otherwise it prints their state as plain lines every few seconds. A finished task is printed once, above the tasks
+in flight, like the rows of the concept::
+
+    ::Package Retrieval:
+        vim 8.2.0814-3
+            Retrieved: 1.7 MiB
+            Speed:     3.70 MiB/s
+            Remaining: 100%
+"""
+from typing import Callable, Dict, IO, List, Optional, Set, Tuple
+import sys
+import threading
+import time
+
+RETRIEVAL: str = "Package Retrieval"
+CHECKS: str = "Integrity Checks"
+INSTALLATION: str = "Package Installation"
+
+
+def format_size(size: float) -> str:
+    """Formats a size in bytes.
+
+    Args:
+        size: The size.
+
+    Returns:
+        The size in the biggest unit it has at least one of.
+
+    Examples:
+        >>> format_size(1733427)
+        '1.7 MiB'
+        >>> format_size(512)
+        '512.0 B'
+    """
+    unit: str
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "GiB"
+    return f"{size:.1f} {unit}"
+
+
+class Task:
+    """A progress counter, updated by a single writer.
+
+    Attributes:
+        section (str): The section the task is shown in, e.g. RETRIEVAL.
+        label (str): What the task does, e.g. the package.
+        total (int): The amount of work, e.g. bytes. 0 if it isn't known yet.
+        done (int): The amount of work done.
+        transfer (bool): Whether or not the work is bytes transferred, shown with the speed.
+        started (float): When the task was created, from time.monotonic.
+        finished (Optional[float]): When the task finished, None if it didn't.
+    """
+
+    __slots__ = ("section", "label", "total", "done", "transfer", "started", "finished")
+
+    def __init__(
+        self, section: str, label: str, total: int = 0, transfer: bool = False
+    ) -> None:
+        """The initialization of Task.
+
+        Args:
+            section: The section the task is shown in.
+            label: What the task does.
+            total: The amount of work.
+            transfer: Whether or not the work is bytes transferred.
+        """
+        self.section: str = section
+        self.label: str = label
+        self.total: int = total
+        self.done: int = 0
+        self.transfer: bool = transfer
+        self.started: float = time.monotonic()
+        self.finished: Optional[float] = None
+
+    def update(self, done: int, total: Optional[int] = None) -> None:
+        """Sets the amount of work done.
+
+        Args:
+            done: The amount of work done.
+            total: The amount of work, if it changed.
+        """
+        if total is not None:
+            self.total = total
+        self.done = done
+
+    def advance(self, amount: int = 1) -> None:
+        """Adds to the amount of work done.
+
+        Args:
+            amount: The amount of work just done.
+        """
+        self.done += amount
+
+    def finish(self) -> None:
+        """Marks the task as finished."""
+        if self.finished is None:
+            self.done = max(self.done, self.total)
+            self.finished = time.monotonic()
+
+    @property
+    def percent(self) -> int:
+        """The percentage of work done."""
+        if self.finished is not None:
+            return 100
+        return min(100 * self.done // self.total, 100) if self.total else 0
+
+    def rows(self) -> List[str]:
+        """The rows showing the task, without the section.
+
+        Returns:
+            List[str]: The rows.
+        """
+        rows: List[str] = [f"    {self.label}"]
+        if self.transfer:
+            elapsed: float = (self.finished or time.monotonic()) - self.started
+            rows.append(f"        Retrieved: {format_size(self.done)}")
+            rows.append(
+                f"        Speed:     {format_size(self.done / max(elapsed, 1e-3))}/s"
+            )
+        rows.append(f"        Remaining: {self.percent}%")
+        return rows
+
+
+class Progress:
+    """The tasks of a transaction and the thread rendering them.
+
+    Attributes:
+        frames (int): How many times the tasks were rendered.
+    """
+
+    def __init__(
+        self,
+        stream: Optional[IO[str]] = None,
+        fps: float = 10.0,
+        interval: float = 5.0,
+        tty: Optional[bool] = None,
+    ) -> None:
+        """The initialization of Progress.
+
+        Args:
+            stream: Where the progress is written, stderr by default.
+            fps: How many times a second the tasks are redrawn on a terminal.
+            interval: How many seconds pass between the plain lines printed if the stream isn't a terminal.
+            tty: Whether or not the stream is a terminal, detected if None.
+        """
+        self._stream: IO[str] = stream or sys.stderr
+        self._tty: bool = self._stream.isatty() if tty is None else tty
+        self._period: float = 1 / fps if self._tty else interval
+        self._tasks: List[Task] = []
+        self._sections: List[str] = []
+        self._drawn: int = 0
+        self._reported: Dict[int, int] = {}
+        self._finished: Set[int] = set()
+        self._stopped: threading.Event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.frames: int = 0
+
+    def task(
+        self, section: str, label: str, total: int = 0, transfer: bool = False
+    ) -> Task:
+        """Adds a task.
+
+        Args:
+            section: The section the task is shown in, e.g. RETRIEVAL.
+            label: What the task does, e.g. the package.
+            total: The amount of work, 0 if it isn't known yet.
+            transfer: Whether or not the work is bytes transferred, shown with the speed.
+
+        Returns:
+            Task: The task, to be updated by one writer.
+        """
+        task: Task = Task(section, label, total, transfer)
+        self._tasks.append(task)
+        return task
+
+    def discard(self, task: Task) -> None:
+        """Removes a task that won't finish, e.g. a failed download.
+
+        Args:
+            task: The task.
+        """
+        if task in self._tasks:
+            self._tasks.remove(task)
+
+    def download_callback(self, prefix: str = "") -> Callable[[str, int, int], None]:
+        """A libalpm download callback (filename, transferred, total) updating a task per file.
+
+        Args:
+            prefix: Prepended to the labels, e.g. the root.
+
+        Returns:
+            The callback.
+        """
+        tasks: Dict[str, Task] = {}
+
+        def callback(filename: str, transferred: int, total: int) -> None:
+            task: Optional[Task] = tasks.get(filename)
+            if task is None:
+                task = tasks[filename] = self.task(
+                    RETRIEVAL, prefix + filename, total, True
+                )
+            task.update(transferred, total)
+            if total and transferred >= total:
+                task.finish()
+
+        return callback
+
+    def progress_callback(
+        self, prefix: str = ""
+    ) -> Callable[[str, int, int, int], None]:
+        """A libalpm progress callback (target, percent, count, current) updating a task per target.
+
+        Notes:
+            Progress without a target belongs to the checks run before the packages are installed.
+
+        Args:
+            prefix: Prepended to the labels, e.g. the root.
+
+        Returns:
+            The callback.
+        """
+        tasks: Dict[str, Task] = {}
+
+        def callback(target: str, percent: int, count: int, current: int) -> None:
+            task: Optional[Task] = tasks.get(target)
+            if task is None:
+                task = tasks[target] = (
+                    self.task(INSTALLATION, f"{prefix}Installing {target}", 100)
+                    if target
+                    else self.task(CHECKS, f"{prefix}Check transaction", 100)
+                )
+            task.update(percent)
+            if percent >= 100:
+                task.finish()
+
+        return callback
+
+    def _split(self) -> Tuple[List[Task], List[Task]]:
+        tasks: List[Task] = list(self._tasks)
+        done: List[Task] = [task for task in tasks if task.finished is not None]
+        return done, [task for task in tasks if task.finished is None]
+
+    def _section(self, section: str) -> List[str]:
+        if section in self._sections:
+            return []
+        self._sections.append(section)
+        return [f"::{section}:"]
+
+    def render(self, final: bool = False) -> None:
+        """Writes the tasks that finished since the last frame, then the tasks in flight.
+
+        Args:
+            final: Whether or not this is the last frame, which leaves the tasks in flight in the output.
+        """
+        done, running = self._split()
+        lines: List[str] = []
+        if self._tty and self._drawn:
+            lines.append(f"\x1b[{self._drawn}F\x1b[J")
+        finished: List[Task] = [task for task in done if id(task) not in self._finished]
+        finished.sort(key=lambda task: task.finished)
+        task: Task
+        for task in finished:
+            lines.extend(self._section(task.section) + task.rows())
+            self._finished.add(id(task))
+        live: List[str] = []
+        if self._tty or final:
+            sections: List[str] = []
+            for task in running:
+                if task.section not in sections and task.section not in self._sections:
+                    sections.append(task.section)
+                    live.append(f"::{task.section}:")
+                live.extend(task.rows())
+        else:
+            for task in running:
+                if self._reported.get(id(task)) != task.percent:
+                    self._reported[id(task)] = task.percent
+                    live.append(
+                        f"{task.section}: {task.label.strip()}: {task.percent}%"
+                    )
+        lines.extend(live)
+        self._drawn = len(live) if self._tty and not final else 0
+        if lines:
+            self._stream.write(
+                "".join(
+                    line if line.startswith("\x1b") else line + "\n" for line in lines
+                )
+            )
+            self._stream.flush()
+        self.frames += 1
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._period):
+            self.render()
+
+    def start(self) -> "Progress":
+        """Starts the render thread.
+
+        Returns:
+            Progress: Itself.
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the render thread and renders the last frame."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        self.render(final=True)
+
+    def __enter__(self) -> "Progress":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
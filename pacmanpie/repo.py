@@ -0,0 +1,438 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Builds the sync databases (.db and .files) of a repository directory, like repo-add.
+
+The archives are read by worker processes, each streaming its archives once: the .PKGINFO and the file list come
+from the tar headers, and the checksums are computed from the same bytes, so nothing is extracted or read twice.
+What was read is cached next to the databases, keyed by the filename, modification time and size of the archive
+(and of its signature), so a rebuild only reads the archives that were added or changed, and writes nothing if
+none were. The databases are written as a stream through a multithreaded zstd compressor.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, IO, Iterator, List, Optional
+from pacmanpie import database
+from pacmanpie.vercmp import newest
+import base64
+import contextlib
+import gzip
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import tarfile
+
+_CACHE_VERSION: int = 1
+_ARCHIVE_MARKER: str = ".pkg.tar"
+# the desc fields of a sync database entry, in the order repo-add writes them
+_SYNC_FIELDS: List[str] = [
+    "FILENAME",
+    "NAME",
+    "BASE",
+    "VERSION",
+    "DESC",
+    "GROUPS",
+    "CSIZE",
+    "ISIZE",
+    "MD5SUM",
+    "SHA256SUM",
+    "PGPSIG",
+    "URL",
+    "LICENSE",
+    "ARCH",
+    "BUILDDATE",
+    "PACKAGER",
+    "REPLACES",
+    "CONFLICTS",
+    "PROVIDES",
+    "DEPENDS",
+    "OPTDEPENDS",
+]
+
+# .PKGINFO keys, mapped to their desc fields
+_PKGINFO_FIELDS: Dict[str, str] = {
+    "pkgname": "NAME",
+    "pkgver": "VERSION",
+    "pkgbase": "BASE",
+    "pkgdesc": "DESC",
+    "url": "URL",
+    "arch": "ARCH",
+    "builddate": "BUILDDATE",
+    "packager": "PACKAGER",
+    "size": "SIZE",
+    "license": "LICENSE",
+    "group": "GROUPS",
+    "replaces": "REPLACES",
+    "depend": "DEPENDS",
+    "optdepend": "OPTDEPENDS",
+    "conflict": "CONFLICTS",
+    "provides": "PROVIDES",
+    "backup": "BACKUP",
+}
+
+
+@dataclass
+class Entry:
+    """The database entry of a package archive.
+
+    Args:
+        filename (str): The archive filename.
+        key (List[int]): The modification time in nanoseconds and the size of the archive and of its signature.
+        desc (Dict[str, List[str]]): The desc fields, mapped to their values.
+        files (List[str]): The file list, directories ending with a slash.
+    """
+
+    filename: str
+    key: List[int]
+    desc: Dict[str, List[str]] = field(default_factory=dict)
+    files: List[str] = field(default_factory=list)
+
+    @property
+    def dirname(self) -> str:
+        """The name of the package directory inside the databases."""
+        return f"{self.desc['NAME'][0]}-{self.desc['VERSION'][0]}"
+
+
+@dataclass
+class Build:
+    """The outcome of a build.
+
+    Args:
+        packages (int): The amount of packages in the databases.
+        read (int): The amount of archives read, the others came from the cache.
+        written (bool): Whether or not the databases were written, which they aren't if no archive changed.
+    """
+
+    packages: int
+    read: int
+    written: bool
+
+
+class _HashingReader(io.RawIOBase):
+    """A file reader checksumming the bytes read through it."""
+
+    def __init__(self, raw: IO[bytes]) -> None:
+        """The initialization of _HashingReader.
+
+        Args:
+            raw: The file, opened without buffering.
+        """
+        self._raw: IO[bytes] = raw
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.size: int = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        count: int = self._raw.readinto(buffer)
+        data: memoryview = memoryview(buffer)[:count]
+        self.md5.update(data)
+        self.sha256.update(data)
+        self.size += count
+        return count
+
+
+def parse_pkginfo(text: str) -> Dict[str, List[str]]:
+    """Parses a .PKGINFO file into desc fields.
+
+    Args:
+        text: The content of the file.
+
+    Returns:
+        The desc fields, mapped to their values. Keys without a desc field (e.g. makedepend) are left out.
+
+    Examples:
+        >>> parse_pkginfo("# generated by makepkg\\npkgname = vim\\npkgver = 8.2.0814-3\\ndepend = gpm\\n")
+        {'NAME': ['vim'], 'VERSION': ['8.2.0814-3'], 'DEPENDS': ['gpm']}
+    """
+    fields: Dict[str, List[str]] = {}
+    for line in text.splitlines():
+        key, separator, value = line.partition(" = ")
+        if separator and not key.startswith("#") and key in _PKGINFO_FIELDS:
+            fields.setdefault(_PKGINFO_FIELDS[key], []).append(value)
+    return fields
+
+
+def _key(path: str) -> List[int]:
+    status: os.stat_result = os.stat(path)
+    try:
+        signature: os.stat_result = os.stat(path + ".sig")
+    except FileNotFoundError:
+        return [status.st_mtime_ns, status.st_size, 0, 0]
+    return [
+        status.st_mtime_ns,
+        status.st_size,
+        signature.st_mtime_ns,
+        signature.st_size,
+    ]
+
+
+def read_archive(path: str) -> Entry:
+    """Reads the database entry of a package archive in one pass.
+
+    Args:
+        path: The path of the archive.
+
+    Returns:
+        Entry: The entry.
+
+    Raises:
+        ValueError: If the archive has no .PKGINFO.
+    """
+    key: List[int] = _key(path)
+    pkginfo: Optional[Dict[str, List[str]]] = None
+    files: List[str] = []
+    with open(path, "rb", buffering=0) as raw:
+        hashing: _HashingReader = _HashingReader(raw)
+        reader: io.BufferedReader = io.BufferedReader(hashing, 1 << 20)
+        with database.stream_tar(reader) as archive:
+            for member in archive:
+                name: str = (
+                    member.name[2:] if member.name.startswith("./") else member.name
+                )
+                if name == ".PKGINFO":
+                    pkginfo = parse_pkginfo(archive.extractfile(member).read().decode())
+                elif name and not (name.startswith(".") and "/" not in name):
+                    files.append(name.rstrip("/") + "/" if member.isdir() else name)
+        # the end of the archive isn't part of any member, but of the checksums
+        for _ in iter(lambda: reader.read(1 << 20), b""):
+            pass
+    if pkginfo is None:
+        raise ValueError(f"{path} has no .PKGINFO")
+    fields: Dict[str, List[str]] = {
+        **pkginfo,
+        "FILENAME": [os.path.basename(path)],
+        "CSIZE": [str(hashing.size)],
+        "ISIZE": pkginfo.get("SIZE", []),
+        "MD5SUM": [hashing.md5.hexdigest()],
+        "SHA256SUM": [hashing.sha256.hexdigest()],
+    }
+    if key[3]:
+        with open(path + ".sig", "rb") as signature:
+            fields["PGPSIG"] = [base64.b64encode(signature.read()).decode()]
+    return Entry(
+        os.path.basename(path),
+        key,
+        {name: fields[name] for name in _SYNC_FIELDS if fields.get(name)},
+        sorted(files),
+    )
+
+
+def database_path(directory: str, name: str, kind: str = "db") -> str:
+    """The path of the symbolic link to a database of a repository directory.
+
+    Args:
+        directory: The repository directory.
+        name: The repository name.
+        kind: "db" or "files".
+
+    Returns:
+        The path, e.g. core.db, to be linked into the sync directory of a --dbpath.
+    """
+    return os.path.join(directory, f"{name}.{kind}")
+
+
+def _cache_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f".{name}.cache.json")
+
+
+def _read_cache(directory: str, name: str) -> Dict[str, Entry]:
+    try:
+        with open(_cache_path(directory, name)) as cache_file:
+            cached: dict = json.load(cache_file)
+        if cached["version"] != _CACHE_VERSION:
+            return {}
+        return {
+            filename: Entry(**entry) for filename, entry in cached["entries"].items()
+        }
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def _write_cache(directory: str, name: str, entries: Dict[str, Entry]) -> None:
+    path: str = _cache_path(directory, name)
+    temporary: str = database.temporary_path(path)
+    with open(temporary, "w") as cache_file:
+        json.dump(
+            {
+                "version": _CACHE_VERSION,
+                "entries": {
+                    filename: entry.__dict__ for filename, entry in entries.items()
+                },
+            },
+            cache_file,
+        )
+    os.replace(temporary, path)
+
+
+@contextlib.contextmanager
+def _compressed(path: str, compression: str) -> Iterator[IO[bytes]]:
+    """Opens a file for writing through a compressor.
+
+    Args:
+        path: The path of the file.
+        compression: "zst" for multithreaded zstd, "gz" for gzip.
+
+    Returns:
+        A context manager giving the stream to write the uncompressed data to.
+    """
+    with open(path, "wb") as output:
+        if compression == "zst":
+            import zstandard
+
+            with zstandard.ZstdCompressor(threads=-1).stream_writer(
+                output, closefd=False
+            ) as writer:
+                yield writer
+        else:
+            with gzip.GzipFile(fileobj=output, mode="wb", mtime=0) as writer:
+                yield writer
+
+
+def _add(archive: tarfile.TarFile, name: str, data: bytes, mtime: int) -> None:
+    member: tarfile.TarInfo = tarfile.TarInfo(name)
+    member.mtime = mtime
+    if name.endswith("/"):
+        member.type = tarfile.DIRTYPE
+        member.mode = 0o755
+        archive.addfile(member)
+        return
+    member.size = len(data)
+    member.mode = 0o644
+    archive.addfile(member, io.BytesIO(data))
+
+
+def write_database(
+    path: str, entries: List[Entry], files: bool, compression: str
+) -> None:
+    """Writes a sync database atomically.
+
+    Args:
+        path: The path of the database.
+        entries: The entries, in the order they are written.
+        files: Whether or not the file lists are written too, for a .files database.
+        compression: "zst" or "gz".
+    """
+    temporary: str = database.temporary_path(path)
+    with _compressed(temporary, compression) as writer:
+        with tarfile.open(
+            fileobj=writer, mode="w|", format=tarfile.GNU_FORMAT
+        ) as archive:
+            for entry in entries:
+                mtime: int = int((entry.desc.get("BUILDDATE") or ["0"])[0])
+                _add(archive, f"{entry.dirname}/", b"", mtime)
+                _add(
+                    archive,
+                    f"{entry.dirname}/desc",
+                    database.format_desc(entry.desc).encode(),
+                    mtime,
+                )
+                if files:
+                    _add(
+                        archive,
+                        f"{entry.dirname}/files",
+                        database.format_desc({"FILES": entry.files}).encode(),
+                        mtime,
+                    )
+    os.replace(temporary, path)
+
+
+def _link(path: str, target: str) -> None:
+    if os.path.islink(path) and os.readlink(path) == target:
+        return
+    temporary: str = database.temporary_path(path)
+    os.symlink(target, temporary)
+    os.replace(temporary, path)
+
+
+def build(
+    directory: str, name: str, jobs: Optional[int] = None, compression: str = "zst"
+) -> Build:
+    """Builds the .db and .files databases of the package archives of a directory.
+
+    Notes:
+        Of many versions of a package, only the newest is added. The databases are written as NAME.db.tar.zst and
+        NAME.files.tar.zst (or .gz), with the NAME.db and NAME.files symbolic links pointing to them, like repo-add
+        does.
+
+    Args:
+        directory: The repository directory.
+        name: The repository name.
+        jobs: The amount of worker processes reading archives, the amount of CPUs if None.
+        compression: "zst" for multithreaded zstd, "gz" for gzip.
+
+    Returns:
+        Build: The outcome.
+
+    Raises:
+        ValueError: If an archive has no .PKGINFO.
+        ImportError: If the compression (or an archive) is zstd, which needs the optional zstandard module.
+    """
+    # fails before any archive is read
+    if compression == "zst" and importlib.util.find_spec("zstandard") is None:
+        raise ImportError(
+            "zstd compression needs the optional zstandard module, use gz instead"
+        )
+    cached: Dict[str, Entry] = _read_cache(directory, name)
+    entries: Dict[str, Entry] = {}
+    changed: List[str] = []
+    for filename in sorted(os.listdir(directory)):
+        _, marker, extension = filename.partition(_ARCHIVE_MARKER)
+        if not marker or extension.endswith((".sig", ".part")):
+            continue
+        entry: Optional[Entry] = cached.get(filename)
+        if entry and entry.key == _key(os.path.join(directory, filename)):
+            entries[filename] = entry
+        else:
+            changed.append(os.path.join(directory, filename))
+    if len(changed) > 1 and jobs != 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            read: List[Entry] = list(executor.map(read_archive, changed))
+    else:
+        read = [read_archive(path) for path in changed]
+    entries.update((entry.filename, entry) for entry in read)
+    by_name: Dict[str, List[Entry]] = {}
+    for entry in entries.values():
+        by_name.setdefault(entry.desc["NAME"][0], []).append(entry)
+    added: List[Entry] = []
+    for versions in by_name.values():
+        version: str = newest(entry.desc["VERSION"][0] for entry in versions)
+        added.append(
+            next(entry for entry in versions if entry.desc["VERSION"][0] == version)
+        )
+    added.sort(key=lambda entry: entry.dirname)
+    paths: Dict[str, str] = {
+        kind: f"{name}.{kind}.tar.{compression}" for kind in ("db", "files")
+    }
+    up_to_date: bool = not changed and cached.keys() == entries.keys()
+    if up_to_date and all(
+        os.path.realpath(database_path(directory, name, kind))
+        == os.path.realpath(os.path.join(directory, filename))
+        and os.path.exists(os.path.join(directory, filename))
+        for kind, filename in paths.items()
+    ):
+        return Build(len(added), 0, False)
+    for kind, filename in paths.items():
+        write_database(
+            os.path.join(directory, filename), added, kind == "files", compression
+        )
+        _link(database_path(directory, name, kind), filename)
+    _write_cache(directory, name, entries)
+    return Build(len(added), len(read), True)
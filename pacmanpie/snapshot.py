@@ -0,0 +1,291 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""The transaction history of a --dbpath, and rolling it back from the package cache.
+
+Every transaction records the version every package it changed had before and after it, in a file of the
+transactions directory next to the database. The package set before a transaction is the installed one with that
+transaction and every later one undone, so rolling back only needs the archives of the versions it brings back,
+which are looked up in the package cache. libalpm installs them, and removes the packages that didn't exist yet, in
+a single transaction, which is recorded too and can be rolled back in turn.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional
+from pacmanpie import complete, database, lock, upgrades
+import json
+import os
+import time
+
+_ARCHIVE_MARKER: str = ".pkg.tar"
+
+
+@dataclass
+class Transaction:
+    """A recorded transaction.
+
+    Args:
+        id (int): The number of the transaction, increasing with every transaction.
+        time (float): When the transaction finished, as a UNIX timestamp.
+        reason (str): What the transaction did, e.g. upgrade.
+        changes (Dict[str, List[Optional[str]]]): The version before and after the transaction of every changed
+            package, mapped to its name. None if the package wasn't installed.
+    """
+
+    id: int
+    time: float
+    reason: str
+    changes: Dict[str, List[Optional[str]]] = field(default_factory=dict)
+
+
+@dataclass
+class Rollback:
+    """The changes bringing back the package set before a transaction.
+
+    Args:
+        install (List[str]): The archives to install, from the package cache.
+        remove (List[str]): The names of the packages to remove.
+        missing (List[str]): The packages (name-version) without an archive in the package cache.
+    """
+
+    install: List[str] = field(default_factory=list)
+    remove: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+
+
+def _directory(dbpath: str) -> str:
+    return os.path.join(database.state_dir(dbpath, create=False), "transactions")
+
+
+def transactions(dbpath: str) -> List[Transaction]:
+    """Lists the recorded transactions of a --dbpath.
+
+    Args:
+        dbpath: The database location.
+
+    Returns:
+        List[Transaction]: The transactions, oldest first.
+    """
+    directory: str = _directory(dbpath)
+    recorded: List[Transaction] = []
+    if not os.path.isdir(directory):
+        return recorded
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name)) as transaction_file:
+                recorded.append(Transaction(**json.load(transaction_file)))
+    return recorded
+
+
+def record(
+    dbpath: str, before: Dict[str, str], after: Dict[str, str], reason: str
+) -> Optional[Transaction]:
+    """Records a transaction from the package sets before and after it.
+
+    Args:
+        dbpath: The database location.
+        before: The installed versions before the transaction, mapped to the package names.
+        after: The installed versions after the transaction, mapped to the package names.
+        reason: What the transaction did.
+
+    Returns:
+        Optional[Transaction]: The transaction, None if it didn't change anything and so wasn't recorded.
+    """
+    changes: Dict[str, List[Optional[str]]] = {
+        name: [before.get(name), after.get(name)]
+        for name in sorted(set(before) | set(after))
+        if before.get(name) != after.get(name)
+    }
+    if not changes:
+        return None
+    recorded: List[Transaction] = transactions(dbpath)
+    transaction: Transaction = Transaction(
+        recorded[-1].id + 1 if recorded else 1, time.time(), reason, changes
+    )
+    os.makedirs(_directory(dbpath), exist_ok=True)
+    path: str = os.path.join(_directory(dbpath), f"{transaction.id:08d}.json")
+    temporary: str = database.temporary_path(path)
+    with open(temporary, "w") as transaction_file:
+        json.dump(transaction.__dict__, transaction_file)
+    os.replace(temporary, path)
+    return transaction
+
+
+@contextmanager
+def recording(dbpath: str, reason: str) -> Iterator[None]:
+    """Records the transaction run inside the context, even if it fails halfway.
+
+    Notes:
+        The caller has to hold the exclusive lock of the database location, so no other transaction is recorded
+        as part of this one.
+
+    Args:
+        dbpath: The database location.
+        reason: What the transaction does.
+
+    Returns:
+        A context manager recording the transaction when it exits.
+    """
+    before: Dict[str, str] = upgrades.local_versions(dbpath)
+    try:
+        yield
+    finally:
+        record(dbpath, before, upgrades.local_versions(dbpath), reason)
+
+
+def target(dbpath: str, transaction_id: int) -> Dict[str, str]:
+    """Computes the package set before a transaction.
+
+    Args:
+        dbpath: The database location.
+        transaction_id: The number of the transaction.
+
+    Returns:
+        The versions, mapped to the package names.
+
+    Raises:
+        ValueError: If the transaction wasn't recorded.
+    """
+    later: List[Transaction] = [
+        transaction
+        for transaction in transactions(dbpath)
+        if transaction.id >= transaction_id
+    ]
+    if not later or later[0].id != transaction_id:
+        raise ValueError(f"no transaction {transaction_id}")
+    versions: Dict[str, str] = upgrades.local_versions(dbpath)
+    for transaction in reversed(later):
+        for name, (before, _) in transaction.changes.items():
+            if before is None:
+                versions.pop(name, None)
+            else:
+                versions[name] = before
+    return versions
+
+
+def find_archives(cache_dirs: Iterable[str], arch: str) -> Dict[str, str]:
+    """Lists the package archives of the package caches.
+
+    Args:
+        cache_dirs: The cache directories, the first ones are preferred.
+        arch: The architecture of the machine, architecture independent archives are listed too.
+
+    Returns:
+        The paths of the archives, mapped to their package name and version (name-version).
+    """
+    archives: Dict[str, str] = {}
+    for cache_dir in cache_dirs:
+        if not os.path.isdir(cache_dir):
+            continue
+        for name in os.listdir(cache_dir):
+            stem, marker, extension = name.partition(_ARCHIVE_MARKER)
+            if not marker or extension.endswith((".sig", ".part")):
+                continue
+            package, _, package_arch = stem.rpartition("-")
+            if package_arch in (arch, "any"):
+                archives.setdefault(package, os.path.join(cache_dir, name))
+    return archives
+
+
+def plan(
+    dbpath: str, transaction_id: int, cache_dirs: Iterable[str], arch: str
+) -> Rollback:
+    """Computes the changes rolling back a transaction and every later one.
+
+    Args:
+        dbpath: The database location.
+        transaction_id: The number of the transaction.
+        cache_dirs: The package cache directories.
+        arch: The architecture of the machine.
+
+    Returns:
+        Rollback: The changes.
+
+    Raises:
+        ValueError: If the transaction wasn't recorded.
+    """
+    wanted: Dict[str, str] = target(dbpath, transaction_id)
+    installed: Dict[str, str] = upgrades.local_versions(dbpath)
+    archives: Dict[str, str] = find_archives(cache_dirs, arch)
+    rollback: Rollback = Rollback(
+        remove=sorted(name for name in installed if name not in wanted)
+    )
+    for name, version in sorted(wanted.items()):
+        if installed.get(name) == version:
+            continue
+        if f"{name}-{version}" in archives:
+            rollback.install.append(archives[f"{name}-{version}"])
+        else:
+            rollback.missing.append(f"{name}-{version}")
+    return rollback
+
+
+def rollback(
+    root: str,
+    dbpath: str,
+    transaction_id: int,
+    cache_dirs: Iterable[str],
+    arch: str,
+) -> Rollback:
+    """Brings back the package set before a transaction, as a single libalpm transaction.
+
+    Notes:
+        The archives are checked like pacman checks the archives of -U by default: a signature is checked if
+        there's one. libalpm checks the conflicts and runs the install scriptlets and hooks.
+
+    Args:
+        root: The installation root.
+        dbpath: The database location.
+        transaction_id: The number of the transaction.
+        cache_dirs: The package cache directories.
+        arch: The architecture of the machine.
+
+    Returns:
+        Rollback: The applied changes.
+
+    Raises:
+        ValueError: If the transaction wasn't recorded.
+        FileNotFoundError: If an archive isn't in the package cache, in which case nothing is changed.
+    """
+    with lock.exclusive(dbpath, pacman=False):
+        changes: Rollback = plan(dbpath, transaction_id, cache_dirs, arch)
+        if changes.missing:
+            raise FileNotFoundError(
+                f"not in the package cache: {', '.join(changes.missing)}"
+            )
+        if not changes.install and not changes.remove:
+            return changes
+        import pyalpm as libalpm
+
+        handle = libalpm.Handle(root, dbpath)
+        for cache_dir in cache_dirs:
+            handle.add_cachedir(cache_dir)
+        local_db = handle.get_localdb()
+        with recording(dbpath, f"rollback to {transaction_id}"):
+            transaction = handle.init_transaction()
+            try:
+                for path in changes.install:
+                    transaction.add_pkg(
+                        handle.load_pkg(path, libalpm.SIG_PACKAGE_OPTIONAL)
+                    )
+                for name in changes.remove:
+                    transaction.remove_pkg(local_db.get_pkg(name))
+                transaction.prepare()
+                transaction.commit()
+            finally:
+                transaction.release()
+    complete.refresh_local(dbpath)
+    return changes
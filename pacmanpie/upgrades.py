@@ -0,0 +1,350 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Computes the pending upgrades of a system as one join of the local and the merged sync versions.
+
+The sync repositories are merged once into a map of the package names to the package of the highest priority
+repository that has it, and into a map of the replaced names to their replacers. The installed versions come straight
+from the names of the local database directories, so no desc file is read. The result is cached next to the
+database, keyed by a digest of what it was computed from.
+"""
+from dataclasses import dataclass, field
+from fnmatch import fnmatchcase
+from typing import Dict, Iterable, List, Optional, Tuple
+from pacmanpie import database, lock
+from pacmanpie.database import Package
+from pacmanpie.vercmp import vercmp
+import hashlib
+import json
+import os
+import re
+import threading
+
+
+@dataclass
+class Upgrade:
+    """A package that has a newer version in a sync repository.
+
+    Args:
+        name (str): The package name.
+        old_version (str): The installed version.
+        new_version (str): The version in the sync repository.
+        repo (str): The sync repository.
+        filename (Optional[str]): The archive filename of the new version.
+        replaces (Optional[str]): The installed package replaced by this one, if it isn't a literal upgrade.
+    """
+
+    name: str
+    old_version: str
+    new_version: str
+    repo: str
+    filename: Optional[str] = None
+    replaces: Optional[str] = None
+
+
+@dataclass
+class SyncIndex:
+    """The sync repositories, merged by priority.
+
+    Args:
+        packages (Dict[str, Tuple[int, Package]]): The package of the highest priority repository, and the
+            priority of the repository (0 is the highest), mapped to the package names.
+        replacers (Dict[str, List[Tuple[int, str, Package]]]): The priority, the replaces entry and the package of
+            every package replacing a name, in priority order, mapped to the replaced name.
+    """
+
+    packages: Dict[str, Tuple[int, Package]] = field(default_factory=dict)
+    replacers: Dict[str, List[Tuple[int, str, Package]]] = field(default_factory=dict)
+
+
+def build_index(sync_dbs: List[Dict[str, Package]]) -> SyncIndex:
+    """Merges sync repositories.
+
+    Args:
+        sync_dbs: The sync repositories in priority order.
+
+    Returns:
+        SyncIndex: The merged repositories.
+    """
+    index: SyncIndex = SyncIndex()
+    for priority, packages in enumerate(sync_dbs):
+        for name, package in packages.items():
+            index.packages.setdefault(name, (priority, package))
+            for replaces in package.replaces:
+                index.replacers.setdefault(
+                    database.dependency_name(replaces), []
+                ).append((priority, replaces, package))
+    return index
+
+
+_index_cache: Dict[tuple, SyncIndex] = {}
+_index_cache_lock: threading.Lock = threading.Lock()
+
+
+def load_index(dbpath: str, repos: List[str]) -> SyncIndex:
+    """Merges the sync databases of a --dbpath, reusing the merged ones if no database changed.
+
+    Args:
+        dbpath: The database location.
+        repos: The repository names in priority order. Missing databases are skipped.
+
+    Returns:
+        SyncIndex: The merged repositories.
+    """
+    key: tuple = tuple(_sync_keys(dbpath, repos))
+    with _index_cache_lock:
+        if key not in _index_cache:
+            _index_cache.clear()
+            _index_cache[key] = build_index(database.load_sync_dbs(dbpath, repos))
+        return _index_cache[key]
+
+
+def local_versions(dbpath: str) -> Dict[str, str]:
+    """Lists the installed versions from the names of the local database directories.
+
+    Args:
+        dbpath: The database location.
+
+    Returns:
+        The installed versions, mapped to the package names.
+    """
+    return {
+        name: dirname[len(name) + 1 :]
+        for name, dirname in database.local_dirnames(dbpath).items()
+    }
+
+
+def satisfies(version: str, dependency: str) -> bool:
+    """Checks a version against the version constraint of a dependency or replaces entry.
+
+    Args:
+        version: The version.
+        dependency: The dependency, e.g. foo<2.0
+
+    Returns:
+        bool: Whether or not the version satisfies the constraint. A dependency without one is always satisfied.
+
+    Examples:
+        >>> satisfies("1.5-1", "foo<2.0")
+        True
+        >>> satisfies("2.0-1", "foo=2.0")
+        True
+    """
+    match: Optional[re.Match] = re.search("(<=|>=|<|>|=)(.*)$", dependency)
+    if not match:
+        return True
+    result: int = vercmp(version, match.group(2))
+    return {
+        "<": result < 0,
+        "<=": result <= 0,
+        "=": result == 0,
+        ">=": result >= 0,
+        ">": result > 0,
+    }[match.group(1)]
+
+
+def _ignored(
+    name: str,
+    package: Optional[Package],
+    ignore_pkgs: Iterable[str],
+    ignore_groups: Iterable[str],
+) -> bool:
+    return any(fnmatchcase(name, pattern) for pattern in ignore_pkgs) or bool(
+        package and set(package.groups) & set(ignore_groups)
+    )
+
+
+def find_upgrades(
+    local: Dict[str, str],
+    index: SyncIndex,
+    ignore_pkgs: Iterable[str] = (),
+    ignore_groups: Iterable[str] = (),
+) -> List[Upgrade]:
+    """Joins the installed versions with the merged sync repositories.
+
+    Notes:
+        Like libalpm, the highest priority repository having either the package or a replacer for it decides, and a
+        replacer wins over a literal upgrade from the same repository. An ignored package is neither upgraded nor
+        replaced, and an ignored replacer doesn't replace anything, so the package is upgraded literally
+        instead.
+
+    Args:
+        local: The installed versions, mapped to the package names.
+        index: The merged sync repositories.
+        ignore_pkgs: The IgnorePkg patterns.
+        ignore_groups: The IgnoreGroup groups.
+
+    Returns:
+        List[Upgrade]: The pending upgrades and replacements, sorted by the installed package name.
+    """
+    ignore_pkgs, ignore_groups = list(ignore_pkgs), list(ignore_groups)
+    upgrades: List[Upgrade] = []
+    for name in sorted(local.keys() & (index.packages.keys() | index.replacers.keys())):
+        version: str = local[name]
+        priority, package = index.packages.get(name, (None, None))
+        replacers: List[Tuple[int, Package]] = [
+            (replacer_priority, replacer)
+            for replacer_priority, replaces, replacer in index.replacers.get(name, [])
+            if (priority is None or replacer_priority <= priority)
+            and replacer.name not in local
+            and satisfies(version, replaces)
+        ]
+        if _ignored(name, package, ignore_pkgs, ignore_groups):
+            continue
+        replacers = [
+            (replacer_priority, replacer)
+            for replacer_priority, replacer in replacers
+            if not _ignored(replacer.name, replacer, ignore_pkgs, ignore_groups)
+        ]
+        if replacers:
+            first: int = replacers[0][0]
+            upgrades.extend(
+                Upgrade(
+                    replacer.name,
+                    version,
+                    replacer.version,
+                    replacer.repo or "",
+                    replacer.filename,
+                    name,
+                )
+                for replacer_priority, replacer in replacers
+                if replacer_priority == first
+            )
+            continue
+        if (
+            package is None
+            or package.version == version
+            or vercmp(package.version, version) <= 0
+        ):
+            continue
+        upgrades.append(
+            Upgrade(
+                name, version, package.version, package.repo or "", package.filename
+            )
+        )
+    return upgrades
+
+
+def _sync_keys(dbpath: str, repos: List[str]) -> Iterable[tuple]:
+    for repo in repos:
+        path: str = database.sync_db_path(dbpath, repo)
+        if os.path.exists(path):
+            yield (repo,) + database.file_key(path)
+
+
+def _cache_key(
+    dbpath: str,
+    sync_dbpath: str,
+    repos: List[str],
+    ignore_pkgs: List[str],
+    ignore_groups: List[str],
+) -> str:
+    """Digests what the pending upgrades of a --dbpath are computed from.
+
+    Notes:
+        Installing, upgrading or removing a package renames, adds or removes a directory of the local database, so
+        the stat of the directory changes with the installed versions.
+
+    Returns:
+        The digest.
+    """
+    local_path: str = os.path.join(dbpath, "local")
+    local: Optional[os.stat_result] = (
+        os.stat(local_path) if os.path.isdir(local_path) else None
+    )
+    return hashlib.sha1(
+        repr(
+            (
+                local and (local.st_mtime_ns, local.st_ctime_ns, local.st_ino),
+                list(_sync_keys(sync_dbpath, repos)),
+                ignore_pkgs,
+                ignore_groups,
+            )
+        ).encode()
+    ).hexdigest()
+
+
+_pending_cache: Dict[str, Tuple[str, List[Upgrade]]] = {}
+
+
+def pending(
+    dbpath: str,
+    repos: List[str],
+    ignore_pkgs: Iterable[str] = (),
+    ignore_groups: Iterable[str] = (),
+    sync_dbpath: Optional[str] = None,
+) -> List[Upgrade]:
+    """Computes the pending upgrades of a --dbpath, reusing the cached ones if nothing they depend on changed.
+
+    Notes:
+        The result is cached both in memory and in a file next to the database, so a process polling for upgrades
+        only stats the databases, and a new process only reads the file. The returned upgrades shouldn't be
+        modified. The databases are read under the shared lock of dbpath, so a commit is never seen half-done.
+
+    Args:
+        dbpath: The database location.
+        repos: The repository names in priority order.
+        ignore_pkgs: The IgnorePkg patterns.
+        ignore_groups: The IgnoreGroup groups.
+        sync_dbpath: The database location holding the sync databases, dbpath if None.
+
+    Returns:
+        List[Upgrade]: The pending upgrades and replacements, sorted by the installed package name.
+    """
+    sync_dbpath = sync_dbpath or dbpath
+    ignore_pkgs, ignore_groups = list(ignore_pkgs), list(ignore_groups)
+    with lock.shared(dbpath):
+        key: str = _cache_key(dbpath, sync_dbpath, repos, ignore_pkgs, ignore_groups)
+        memory: Optional[Tuple[str, List[Upgrade]]] = _pending_cache.get(dbpath)
+        if memory and memory[0] == key:
+            return list(memory[1])
+        path: str = os.path.join(
+            database.state_dir(dbpath, create=False), "upgrades.json"
+        )
+        try:
+            with open(path) as cache_file:
+                cached: dict = json.load(cache_file)
+            if cached["key"] == key:
+                _pending_cache[dbpath] = (
+                    key,
+                    [Upgrade(**upgrade) for upgrade in cached["upgrades"]],
+                )
+                return list(_pending_cache[dbpath][1])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        upgrades: List[Upgrade] = find_upgrades(
+            local_versions(dbpath),
+            load_index(sync_dbpath, repos),
+            ignore_pkgs,
+            ignore_groups,
+        )
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary: str = database.temporary_path(path)
+            with open(temporary, "w") as cache_file:
+                json.dump(
+                    {
+                        "key": key,
+                        "upgrades": [upgrade.__dict__ for upgrade in upgrades],
+                    },
+                    cache_file,
+                )
+            os.replace(temporary, path)
+        except PermissionError:
+            # without write access to dbpath, only the memory cache is kept
+            pass
+        _pending_cache[dbpath] = (key, upgrades)
+        return list(upgrades)
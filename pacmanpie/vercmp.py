@@ -0,0 +1,298 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+# -*- coding: utf-8 -*-
+"""Package version comparison, compatible with alpm's vercmp.
+
+A version is split once into its epoch, pkgver and pkgrel, and the pkgver and pkgrel are split once into segments,
+so comparing two parsed versions never has to look at their strings again.
+"""
+from functools import lru_cache
+from typing import Iterable, List, Optional, Tuple, Union
+import string
+
+_DIGITS: frozenset = frozenset(string.digits)
+_ALPHA: frozenset = frozenset(string.ascii_letters)
+_ALNUM: frozenset = _DIGITS | _ALPHA
+
+# (amount of separators before the segment, 1 if the segment is numeric else 0, the segment)
+_Segment = Tuple[int, int, Union[int, str]]
+# (segments, amount of trailing separators)
+_Part = Tuple[Tuple[_Segment, ...], int]
+
+
+def _split(part: str) -> _Part:
+    """Splits a pkgver or pkgrel into segments the same way rpmvercmp walks it.
+
+    Args:
+        part: The pkgver or pkgrel.
+
+    Returns:
+        The segments and the amount of trailing separators.
+
+    Examples:
+        >>> _split("8.2.0814rc1_")
+        (((0, 1, 8), (1, 1, 2), (1, 1, 814), (0, 0, 'rc'), (0, 1, 1)), 1)
+    """
+    segments: List[_Segment] = []
+    length: int = len(part)
+    position: int = 0
+    while True:
+        start: int = position
+        while position < length and part[position] not in _ALNUM:
+            position += 1
+        if position == length:
+            return tuple(segments), position - start
+        separators: int = position - start
+        start = position
+        kind: frozenset = _DIGITS if part[position] in _DIGITS else _ALPHA
+        while position < length and part[position] in kind:
+            position += 1
+        segment: str = part[start:position]
+        if kind is _DIGITS:
+            segments.append((separators, 1, int(segment)))
+        else:
+            segments.append((separators, 0, segment))
+
+
+def _compare(first: _Part, second: _Part) -> int:
+    """Compares two split pkgvers or pkgrels, following rpmvercmp.
+
+    Args:
+        first: The first split part.
+        second: The second split part.
+
+    Returns:
+        -1, 0 or 1 if first is older, the same as or newer than second.
+    """
+    first_segments, first_trailing = first
+    second_segments, second_trailing = second
+    for (first_separators, first_kind, first_value), (
+        second_separators,
+        second_kind,
+        second_value,
+    ) in zip(first_segments, second_segments):
+        if first_separators != second_separators:
+            return -1 if first_separators < second_separators else 1
+        if first_kind != second_kind:
+            # a numeric segment is newer than an alpha one
+            return 1 if first_kind else -1
+        if first_value != second_value:
+            return 1 if first_value > second_value else -1  # type: ignore
+    common: int = len(first_segments)
+    if common == len(second_segments):
+        return (first_trailing > 0) - (second_trailing > 0)
+    # one side ran out of segments: a remaining alpha segment never beats an empty string, anything else does.
+    if common < len(second_segments):
+        separators, kind, _ = second_segments[common]
+        return 1 if not kind and (first_trailing or not separators) else -1
+    separators, kind, _ = first_segments[len(second_segments)]
+    return -1 if not kind and (second_trailing or not separators) else 1
+
+
+class PackageVersion:
+    """A parsed [epoch:]pkgver[-pkgrel] package version.
+
+    Attributes:
+        version (str): The version string.
+        epoch (int): The epoch, 0 if it wasn't given.
+        pkgver (str): The upstream version.
+        pkgrel (Optional[str]): The release, None if it wasn't given.
+
+    Notes:
+        The pkgrel is only compared if both versions have one, so e.g. 1.0 is equal to both 1.0-1 and 1.0-2.
+
+    Examples:
+        >>> PackageVersion("1:8.2.0814-3")
+        <PackageVersion object: version=1:8.2.0814-3>
+        >>> PackageVersion("1.0rc") < PackageVersion("1.0") < PackageVersion("1:0.9")
+        True
+    """
+
+    __slots__ = ("version", "epoch", "pkgver", "pkgrel", "_pkgver", "_pkgrel")
+
+    def __init__(self, version: str) -> None:
+        """The initialization of PackageVersion.
+
+        Args:
+            version: The version string.
+        """
+        self.version: str = version
+        digits_end: int = 0
+        while digits_end < len(version) and version[digits_end] in _DIGITS:
+            digits_end += 1
+        release_start: int = version.rfind("-", digits_end)
+        pkgver_start: int = 0
+        self.epoch: int = 0
+        if version[digits_end : digits_end + 1] == ":":
+            self.epoch = int(version[:digits_end] or 0)
+            pkgver_start = digits_end + 1
+        if release_start == -1:
+            self.pkgver: str = version[pkgver_start:]
+            self.pkgrel: Optional[str] = None
+        else:
+            self.pkgver = version[pkgver_start:release_start]
+            self.pkgrel = version[release_start + 1 :]
+        self._pkgver: _Part = _split(self.pkgver)
+        self._pkgrel: Optional[_Part] = (
+            None if self.pkgrel is None else _split(self.pkgrel)
+        )
+
+    def compare(self, other: "PackageVersion") -> int:
+        """Compares the version with another one.
+
+        Args:
+            other: The other version.
+
+        Returns:
+            int: -1, 0 or 1 if the version is older, the same as or newer than the other one.
+        """
+        if self.version == other.version:
+            return 0
+        if self.epoch != other.epoch:
+            return -1 if self.epoch < other.epoch else 1
+        result: int = _compare(self._pkgver, other._pkgver)
+        if result or self._pkgrel is None or other._pkgrel is None:
+            return result
+        return _compare(self._pkgrel, other._pkgrel)
+
+    def __lt__(self, other: "PackageVersion") -> bool:
+        return self.compare(other) < 0
+
+    def __le__(self, other: "PackageVersion") -> bool:
+        return self.compare(other) <= 0
+
+    def __gt__(self, other: "PackageVersion") -> bool:
+        return self.compare(other) > 0
+
+    def __ge__(self, other: "PackageVersion") -> bool:
+        return self.compare(other) >= 0
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, PackageVersion):
+            return NotImplemented
+        return self.compare(other) == 0
+
+    def __ne__(self, other: object) -> bool:
+        if not isinstance(other, PackageVersion):
+            return NotImplemented
+        return self.compare(other) != 0
+
+    def __hash__(self) -> int:
+        # the pkgrel is left out, since versions with and without one can be equal
+        return hash((self.epoch, self._pkgver[0], self._pkgver[1] > 0))
+
+    def __repr__(self) -> str:
+        return f"<{self.__class__.__name__} object: version={self.version}>"
+
+
+@lru_cache(maxsize=65536)
+def parse_version(version: str) -> PackageVersion:
+    """Parses a version, reusing the already parsed version if it was seen recently.
+
+    Args:
+        version: The version string.
+
+    Returns:
+        PackageVersion: The parsed version.
+    """
+    return PackageVersion(version)
+
+
+def vercmp(first: str, second: str) -> int:
+    """Compares two versions, like alpm's vercmp.
+
+    Args:
+        first: The first version.
+        second: The second version.
+
+    Returns:
+        int: -1, 0 or 1 if first is older, the same as or newer than second.
+
+    Examples:
+        >>> vercmp("8.2.0814-3", "8.2.0814-10")
+        -1
+        >>> vercmp("1:1.0", "2.0")
+        1
+    """
+    if first == second:
+        return 0
+    return parse_version(first).compare(parse_version(second))
+
+
+def compare_versions(pairs: Iterable[Tuple[str, str]]) -> List[int]:
+    """Compares many pairs of versions at once.
+
+    Args:
+        pairs: The pairs of versions.
+
+    Returns:
+        List[int]: The vercmp result of every pair, in order.
+    """
+    return [vercmp(first, second) for first, second in pairs]
+
+
+def sort_versions(versions: Iterable[str], reverse: bool = False) -> List[str]:
+    """Sorts versions from oldest to newest.
+
+    Args:
+        versions: The versions.
+        reverse: Whether or not the versions should be sorted from newest to oldest instead.
+
+    Returns:
+        List[str]: The sorted versions.
+
+    Examples:
+        >>> sort_versions(["1.0", "1.0rc1", "1:0.1", "0.9-2"])
+        ['0.9-2', '1.0rc1', '1.0', '1:0.1']
+    """
+    return sorted(versions, key=parse_version, reverse=reverse)
+
+
+def rank_versions(versions: Iterable[str]) -> List[int]:
+    """Ranks versions, equal versions sharing the same rank.
+
+    Args:
+        versions: The versions.
+
+    Returns:
+        List[int]: The rank of every version in order, 0 being the oldest.
+
+    Examples:
+        >>> rank_versions(["2.0", "1.0", "1.0-1", "1.5"])
+        [2, 0, 0, 1]
+    """
+    parsed: List[PackageVersion] = [parse_version(version) for version in versions]
+    ranks: List[int] = [0] * len(parsed)
+    rank: int = 0
+    previous: Optional[PackageVersion] = None
+    for index in sorted(range(len(parsed)), key=parsed.__getitem__):
+        if previous is not None and parsed[index].compare(previous):
+            rank += 1
+        ranks[index] = rank
+        previous = parsed[index]
+    return ranks
+
+
+def newest(versions: Iterable[str]) -> Optional[str]:
+    """Finds the newest of many versions.
+
+    Args:
+        versions: The versions.
+
+    Returns:
+        Optional[str]: The newest version, None if no versions were given.
+    """
+    return max(versions, key=parse_version, default=None)
@@ -0,0 +1,236 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import hashlib
+import io
+import os
+import stat
+import tarfile
+import tempfile
+import pytest
+from typing import Dict, List, Optional
+from pacmanpie.database import format_desc
+
+
+def package_fields(
+    name: str, version: str, **fields: List[str]
+) -> Dict[str, List[str]]:
+    """Generates the desc fields of a fixture package.
+
+    Args:
+        name: The package name.
+        version: The package version.
+        **fields: Extra fields, e.g. DEPENDS=["glibc"].
+
+    Returns:
+        The fields.
+    """
+    return {
+        "NAME": [name],
+        "VERSION": [version],
+        "FILENAME": [f"{name}-{version}-x86_64.pkg.tar.gz"],
+        **fields,
+    }
+
+
+def make_local_package(
+    dbpath: str,
+    name: str,
+    version: str,
+    files: Optional[List[str]] = None,
+    **fields: List[str],
+) -> str:
+    """Writes a fixture package into the local database of a --dbpath.
+
+    Args:
+        dbpath: The database location.
+        name: The package name.
+        version: The package version.
+        files: The file list of the package.
+        **fields: Extra desc fields.
+
+    Returns:
+        The path of the package directory.
+    """
+    path: str = os.path.join(dbpath, "local", f"{name}-{version}")
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "desc"), "w") as desc_file:
+        desc_file.write(format_desc(package_fields(name, version, **fields)))
+    with open(os.path.join(path, "files"), "w") as files_file:
+        files_file.write(format_desc({"FILES": files or []}))
+    return path
+
+
+def make_sync_db(
+    dbpath: str, repo: str, packages: List[Dict[str, List[str]]], extension: str = "db"
+) -> str:
+    """Writes a fixture sync database into a --dbpath.
+
+    Args:
+        dbpath: The database location.
+        repo: The repository name.
+        packages: The desc fields of every package, a FILES field goes into the files entry.
+        extension: "db" for the package database, "files" for the file lists database.
+
+    Returns:
+        The path of the database.
+    """
+    path: str = os.path.join(dbpath, "sync", f"{repo}.{extension}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tarfile.open(path, "w:gz") as archive:
+        for fields in packages:
+            fields = dict(fields)
+            dirname: str = f"{fields['NAME'][0]}-{fields['VERSION'][0]}"
+            entries: Dict[str, Dict[str, List[str]]] = {
+                "desc": {key: value for key, value in fields.items() if key != "FILES"}
+            }
+            if "FILES" in fields:
+                entries["files"] = {"FILES": fields["FILES"]}
+            for kind, entry in entries.items():
+                data: bytes = format_desc(entry).encode()
+                member: tarfile.TarInfo = tarfile.TarInfo(f"{dirname}/{kind}")
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+    return path
+
+
+def make_mtree(root: str, paths: List[str]) -> bytes:
+    """Generates the gzip compressed .MTREE of files in a root, the way makepkg does.
+
+    Args:
+        root: The root holding the files.
+        paths: The paths of the files, relative to the root.
+
+    Returns:
+        The .MTREE.
+    """
+    lines: List[str] = ["#mtree", "/set type=file uid=0 gid=0 mode=644"]
+    for path in paths:
+        full_path: str = os.path.join(root, path)
+        status: os.stat_result = os.lstat(full_path)
+        keywords: List[str] = [
+            f"uid={status.st_uid}",
+            f"gid={status.st_gid}",
+            f"time={status.st_mtime:.9f}",
+        ]
+        if stat.S_ISLNK(status.st_mode):
+            keywords += ["type=link", f"link={os.readlink(full_path)}"]
+        elif stat.S_ISDIR(status.st_mode):
+            keywords += ["type=dir", f"mode={stat.S_IMODE(status.st_mode):o}"]
+        else:
+            with open(full_path, "rb") as checked_file:
+                digest: str = hashlib.sha256(checked_file.read()).hexdigest()
+            keywords += [
+                f"mode={stat.S_IMODE(status.st_mode):o}",
+                f"size={status.st_size}",
+                f"sha256digest={digest}",
+            ]
+        escaped: str = "".join(
+            f"\\{ord(character):03o}" if character in " \\#" else character
+            for character in path
+        )
+        lines.append(f"./{escaped} {' '.join(keywords)}")
+    return gzip.compress("\n".join(lines).encode() + b"\n")
+
+
+def make_package_archive(
+    cache_dir: str,
+    name: str,
+    version: str,
+    files: Dict[str, bytes],
+    arch: str = "x86_64",
+    compression: str = "gz",
+    **pkginfo: List[str],
+) -> str:
+    """Builds a fixture package archive the way makepkg does, .PKGINFO first.
+
+    Args:
+        cache_dir: Where the archive is written.
+        name: The package name.
+        version: The package version.
+        files: The content of every file, mapped to its path. A path ending with a slash is a directory, and
+            content starting with "->" makes a symbolic link to the rest of it.
+        arch: The package architecture.
+        compression: "gz" or "zst".
+        **pkginfo: Extra .PKGINFO keys, e.g. backup.
+
+    Returns:
+        The path of the archive.
+    """
+    with tempfile.TemporaryDirectory() as staging:
+        for path, content in files.items():
+            full_path: str = os.path.join(staging, path)
+            if path.endswith("/"):
+                os.makedirs(full_path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if content.startswith(b"->"):
+                os.symlink(content[2:].decode(), full_path)
+                continue
+            with open(full_path, "wb") as package_file:
+                package_file.write(content)
+            os.utime(full_path, (1600000000, 1600000000))
+        lines: List[str] = [
+            f"pkgname = {name}",
+            f"pkgver = {version}",
+            f"arch = {arch}",
+        ]
+        for key, values in pkginfo.items():
+            lines.extend(f"{key} = {value}" for value in values)
+        metadata: Dict[str, bytes] = {
+            ".PKGINFO": ("\n".join(lines) + "\n").encode(),
+            ".MTREE": make_mtree(staging, [path.rstrip("/") for path in files]),
+        }
+        buffer: io.BytesIO = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as archive:
+            for member_name, data in metadata.items():
+                member: tarfile.TarInfo = tarfile.TarInfo(member_name)
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+            for path in files:
+                archive.add(
+                    os.path.join(staging, path.rstrip("/")),
+                    path.rstrip("/"),
+                    recursive=False,
+                )
+    path: str = os.path.join(
+        cache_dir, f"{name}-{version}-{arch}.pkg.tar.{compression}"
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(path, "wb") as archive_file:
+        if compression == "zst":
+            import zstandard
+
+            archive_file.write(zstandard.ZstdCompressor().compress(buffer.getvalue()))
+        else:
+            archive_file.write(gzip.compress(buffer.getvalue()))
+    return path
+
+
+@pytest.fixture
+def paths(tmp_path) -> Dict[str, str]:
+    """A root, a database location, a package cache and a repository directory.
+
+    Returns:
+        The paths, by their role.
+    """
+    return {
+        "root": str(tmp_path / "root"),
+        "dbpath": str(tmp_path / "db"),
+        "cache": str(tmp_path / "cache"),
+        "repo": str(tmp_path / "repo"),
+    }
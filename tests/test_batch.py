@@ -0,0 +1,256 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import os
+import threading
+import pytest
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+from typing import List, Tuple
+from pacmanpie import batch, database
+from pacmanpie.config import PacmanConfig
+from pacmanpie.progress import Progress
+from conftest import make_local_package, make_sync_db, package_fields
+
+CONFIG: PacmanConfig = PacmanConfig(repos={"core": [], "extra": []})
+
+
+@pytest.fixture
+def roots(tmp_path) -> List[batch.RootSpec]:
+    """Three chroots sharing the core and extra repositories of a host dbpath.
+
+    Returns:
+        The chroots, the host dbpath is their parent directory's 'host'.
+    """
+    host: str = str(tmp_path / "host")
+    make_sync_db(
+        host,
+        "core",
+        [package_fields("glibc", "2.32-1"), package_fields("bash", "5.1.0-1")],
+    )
+    make_sync_db(
+        host, "extra", [package_fields("bash", "9.9-1"), package_fields("vim", "8.2-2")]
+    )
+    specs: List[batch.RootSpec] = []
+    for number in range(3):
+        spec: batch.RootSpec = batch.parse_root(str(tmp_path / f"chroot{number}"))
+        make_local_package(spec.dbpath, "glibc", "2.31-1")
+        make_local_package(spec.dbpath, "bash", "5.1.0-1")
+        if number:
+            make_local_package(spec.dbpath, "vim", f"8.{number}-1")
+        specs.append(spec)
+    return specs
+
+
+def test_if_plan_finds_pending_upgrades(roots: List[batch.RootSpec]) -> None:
+    """
+    Notes:
+        This can fail if the repository priority isn't respected (bash of extra shadowed by core), or if packages
+        that are up to date are listed.
+
+    Returns:
+        Nothing will be returned.
+    """
+    host: str = os.path.join(os.path.dirname(roots[0].root), "host")
+    summaries: List[batch.RootSummary] = batch.plan(roots, host, CONFIG)
+    assert [
+        [(upgrade.name, upgrade.new_version) for upgrade in summary.upgrades]
+        for summary in summaries
+    ] == [
+        [("glibc", "2.32-1")],
+        [("glibc", "2.32-1"), ("vim", "8.2-2")],
+        [("glibc", "2.32-1"), ("vim", "8.2-2")],
+    ]
+    assert summaries[0].upgrades[0].repo == "core"
+
+
+def test_if_ignored_packages_are_not_upgraded(
+    roots: List[batch.RootSpec], tmp_path
+) -> None:
+    """
+    Notes:
+        This can fail if the IgnorePkg patterns aren't applied to the plan, or if a root whose only upgrades are
+        ignored is upgraded anyway.
+
+    Returns:
+        Nothing will be returned.
+    """
+    config: PacmanConfig = PacmanConfig(
+        cache_dirs=[str(tmp_path)],
+        repos={"core": [], "extra": []},
+        ignore_pkgs=["glib*"],
+    )
+    calls: List[str] = []
+
+    def upgrader(spec: batch.RootSpec, download_only: bool) -> None:
+        calls.append(os.path.basename(spec.root))
+
+    summaries: List[batch.RootSummary] = batch.run(
+        roots, str(tmp_path / "host"), config, upgrader=upgrader
+    )
+    assert [
+        [upgrade.name for upgrade in summary.upgrades] for summary in summaries
+    ] == [[], ["vim"], ["vim"]]
+    assert "chroot0" not in calls
+
+
+def test_if_sync_dbs_are_parsed_once(roots: List[batch.RootSpec], monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if the roots don't share the parsed sync databases.
+
+    Returns:
+        Nothing will be returned.
+    """
+    host: str = os.path.join(os.path.dirname(roots[0].root), "host")
+    reads: List[str] = []
+    read_sync_db = database.read_sync_db
+
+    def counting_read_sync_db(path: str, repo: str):
+        reads.append(repo)
+        return read_sync_db(path, repo)
+
+    monkeypatch.setattr(database, "_sync_cache", {})
+    monkeypatch.setattr(database, "read_sync_db", counting_read_sync_db)
+    batch.plan(roots, host, CONFIG)
+    batch.plan(roots, host, CONFIG)
+    assert reads == ["core", "extra"]
+
+
+def test_if_run_downloads_once_then_upgrades_concurrently(
+    roots: List[batch.RootSpec], tmp_path
+) -> None:
+    """
+    Notes:
+        This can fail if a root whose archives are already cached downloads them again, if a root without upgrades
+        is touched or if the worker-pool limit isn't respected.
+
+    Returns:
+        Nothing will be returned.
+    """
+    host: str = str(tmp_path / "host")
+    cache_dir: str = str(tmp_path / "cache")
+    os.makedirs(cache_dir)
+    config: PacmanConfig = PacmanConfig(
+        cache_dirs=[cache_dir], repos={"core": [], "extra": []}
+    )
+    calls: List[Tuple[str, bool]] = []
+    running: List[int] = [0, 0]
+    lock: threading.Lock = threading.Lock()
+
+    def upgrader(spec: batch.RootSpec, download_only: bool) -> None:
+        with lock:
+            calls.append((os.path.basename(spec.root), download_only))
+            running[0] += 1
+            running[1] = max(running)
+        if download_only:
+            summary: batch.RootSummary
+            for summary in batch.plan([spec], host, config):
+                for upgrade in summary.upgrades:
+                    open(os.path.join(cache_dir, upgrade.filename), "w").close()
+        with lock:
+            running[0] -= 1
+
+    summaries: List[batch.RootSummary] = batch.run(
+        roots, host, config, jobs=2, upgrader=upgrader
+    )
+    assert [call for call in calls if call[1]] == [("chroot0", True), ("chroot1", True)]
+    assert sorted(call[0] for call in calls if not call[1]) == [
+        "chroot0",
+        "chroot1",
+        "chroot2",
+    ]
+    assert running[1] <= 2
+    assert not any(summary.error for summary in summaries)
+
+
+def test_if_failing_root_is_reported(roots: List[batch.RootSpec], tmp_path) -> None:
+    """
+    Notes:
+        This can fail if an error in one root stops the others or isn't put in its summary.
+
+    Returns:
+        Nothing will be returned.
+    """
+
+    def upgrader(spec: batch.RootSpec, download_only: bool) -> None:
+        if spec.root.endswith("chroot1"):
+            raise RuntimeError("failed to commit transaction")
+
+    summaries: List[batch.RootSummary] = batch.run(
+        roots,
+        str(tmp_path / "host"),
+        PacmanConfig(cache_dirs=[str(tmp_path)], repos={"core": [], "extra": []}),
+        upgrader=upgrader,
+    )
+    assert [summary.error for summary in summaries] == [
+        None,
+        "failed to commit transaction",
+        None,
+    ]
+    assert summaries[1].as_dict()["error"] == "failed to commit transaction"
+
+
+def test_if_sync_dbs_are_linked(roots: List[batch.RootSpec], tmp_path) -> None:
+    """
+    Notes:
+        This can fail if the sync databases of a root don't point to the shared ones afterwards.
+
+    Returns:
+        Nothing will be returned.
+    """
+    host: str = str(tmp_path / "host")
+    batch.link_sync_dbs(roots[0].dbpath, host, ["core", "extra", "missing"])
+    batch.link_sync_dbs(roots[0].dbpath, host, ["core", "extra", "missing"])
+    assert sorted(os.listdir(os.path.join(roots[0].dbpath, "sync"))) == [
+        "core.db",
+        "extra.db",
+    ]
+    assert os.path.samefile(
+        database.sync_db_path(roots[0].dbpath, "core"),
+        database.sync_db_path(host, "core"),
+    )
+
+
+def test_if_worker_progress_reaches_the_parent() -> None:
+    """
+    Notes:
+        This can fail if the libalpm callbacks of the worker processes don't reach the progress of this process,
+        or if the roots share their tasks.
+
+    Returns:
+        Nothing will be returned.
+    """
+    stream: io.StringIO = io.StringIO()
+    live: Progress = Progress(stream, tty=False)
+    with Manager() as manager:
+        events = manager.Queue()
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            for root in ("chroot0", "chroot1"):
+                executor.submit(
+                    batch._report, events, "download", f"{root}: ", "vim.pkg", 5, 10
+                ).result()
+                executor.submit(
+                    batch._report, events, "progress", f"{root}: ", "vim", 100, 1, 1
+                ).result()
+        events.put(None)
+        batch._relay(events, live)
+    live.stop()
+    output: str = stream.getvalue()
+    for root in ("chroot0", "chroot1"):
+        assert f"    {root}: vim.pkg\n        Retrieved: 5.0 B" in output
+        assert f"    {root}: Installing vim\n        Remaining: 100%" in output
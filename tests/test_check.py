@@ -0,0 +1,188 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pytest
+from typing import List, Set, Tuple
+from pacmanpie import check
+from pacmanpie.check import MtreeEntry
+from conftest import make_local_package, make_mtree
+
+VIM_FILES: List[str] = ["usr/", "usr/bin/", "usr/bin/vim", "usr/bin/vi", "etc/vimrc"]
+
+
+@pytest.fixture
+def installation(tmp_path) -> Tuple[str, str]:
+    """A root with vim and many files of a big package installed, and a database location describing it.
+
+    Returns:
+        The root and the database location.
+    """
+    root: str = str(tmp_path / "root")
+    dbpath: str = str(tmp_path / "db")
+    os.makedirs(os.path.join(root, "usr", "bin"))
+    os.makedirs(os.path.join(root, "etc"))
+    os.makedirs(os.path.join(root, "usr", "share", "big data"))
+    with open(os.path.join(root, "usr", "bin", "vim"), "wb") as vim:
+        vim.write(b"vim binary")
+    os.symlink("vim", os.path.join(root, "usr", "bin", "vi"))
+    with open(os.path.join(root, "etc", "vimrc"), "w") as vimrc:
+        vimrc.write("set nocompatible\n")
+    big_files: List[str] = [f"usr/share/big data/{number}" for number in range(1500)]
+    for path in big_files:
+        with open(os.path.join(root, path), "w") as big_file:
+            big_file.write(path)
+    for name, files, fields in (
+        ("vim", VIM_FILES, {"BACKUP": ["etc/vimrc\tabc"]}),
+        ("big", ["usr/share/big data/"] + big_files, {}),
+    ):
+        path: str = make_local_package(dbpath, name, "1-1", files, **fields)
+        with open(os.path.join(path, "mtree"), "wb") as mtree:
+            mtree.write(make_mtree(root, [file.rstrip("/") for file in files]))
+    return root, dbpath
+
+
+def mismatches(root: str, dbpath: str, **kwargs) -> Set[Tuple[str, str, str]]:
+    """Checks a root.
+
+    Args:
+        root: The installation root.
+        dbpath: The database location.
+        **kwargs: Passed to check.audit.
+
+    Returns:
+        The mismatches, as (package, path, reason).
+    """
+    return {
+        (mismatch.package, mismatch.path, mismatch.reason)
+        for mismatch in check.audit(root, dbpath, check.read_entries(dbpath), **kwargs)
+    }
+
+
+def test_if_mtree_is_parsed() -> None:
+    """
+    Notes:
+        This can fail if the /set defaults, escaped paths or keywords of an .MTREE aren't parsed like libarchive
+        does, or if the package metadata files aren't skipped.
+
+    Returns:
+        Nothing will be returned.
+    """
+    data: bytes = b"""#mtree
+/set type=file uid=0 gid=0 mode=644
+./.PKGINFO time=1.0 size=10 md5digest=abc
+./etc time=1590000000.0 type=dir
+./etc/my\\040file time=1590000000.5 mode=600 size=3 sha256digest=def
+/set mode=755
+./usr/bin/vi time=1.0 type=link link=vim
+"""
+    assert check.parse_mtree(data, "vim", ["etc/my file"]) == [
+        MtreeEntry("vim", "etc", "dir", 0o644, mtime=1590000000),
+        MtreeEntry(
+            "vim", "etc/my file", "file", 0o600, 0, 0, 3, 1590000000, "def", None, True
+        ),
+        MtreeEntry("vim", "usr/bin/vi", "link", 0o755, mtime=1, link="vim"),
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_if_mismatches_are_found(installation: Tuple[str, str], jobs: int) -> None:
+    """
+    Notes:
+        This can fail if an untouched root has mismatches, or if a changed file, mode, symlink or missing file
+        isn't reported, in process or sharded across worker processes.
+
+    Args:
+        jobs: The amount of worker processes.
+
+    Returns:
+        Nothing will be returned.
+    """
+    root, dbpath = installation
+    assert mismatches(root, dbpath, jobs=jobs) == set()
+    vim: str = os.path.join(root, "usr", "bin", "vim")
+    status: os.stat_result = os.stat(vim)
+    with open(vim, "wb") as vim_file:
+        vim_file.write(b"VIM BINARY")
+    os.utime(vim, ns=(status.st_atime_ns, status.st_mtime_ns))
+    os.chmod(os.path.join(root, "usr", "share", "big data", "7"), 0o600)
+    os.remove(os.path.join(root, "usr", "share", "big data", "1499"))
+    os.remove(os.path.join(root, "usr", "bin", "vi"))
+    os.symlink("nvim", os.path.join(root, "usr", "bin", "vi"))
+    with open(os.path.join(root, "etc", "vimrc"), "w") as vimrc:
+        vimrc.write("set compatible\n")
+    assert mismatches(root, dbpath, jobs=jobs) == {
+        ("vim", "usr/bin/vim", "checksum mismatch"),
+        ("vim", "usr/bin/vi", "symlink target mismatch"),
+        ("big", "usr/share/big data/7", "permissions mismatch"),
+        ("big", "usr/share/big data/1499", "missing"),
+    }
+
+
+def test_if_unchanged_files_are_not_hashed(
+    installation: Tuple[str, str], monkeypatch
+) -> None:
+    """
+    Notes:
+        This can fail if a file whose stat didn't change since it last matched its checksum is hashed again, or if
+        a changed file isn't.
+
+    Returns:
+        Nothing will be returned.
+    """
+    root, dbpath = installation
+    hashed: List[str] = []
+    digest = check._digest
+
+    def counting_digest(path: str, length: int) -> str:
+        hashed.append(os.path.relpath(path, root))
+        return digest(path, length)
+
+    monkeypatch.setattr(check, "_digest", counting_digest)
+    assert mismatches(root, dbpath, jobs=1) == set()
+    assert len(hashed) == 1501
+    hashed.clear()
+    assert mismatches(root, dbpath, jobs=1) == set()
+    assert hashed == []
+    vim: str = os.path.join(root, "usr", "bin", "vim")
+    status: os.stat_result = os.stat(vim)
+    with open(vim, "wb") as vim_file:
+        vim_file.write(b"VIM BINARY")
+    os.utime(vim, ns=(status.st_atime_ns, status.st_mtime_ns))
+    assert mismatches(root, dbpath, jobs=1) == {
+        ("vim", "usr/bin/vim", "checksum mismatch")
+    }
+    assert hashed == ["usr/bin/vim"]
+    hashed.clear()
+    assert mismatches(root, dbpath, jobs=1, use_cache=False) == {
+        ("vim", "usr/bin/vim", "checksum mismatch")
+    }
+    assert len(hashed) == 1501
+
+
+def test_if_packages_are_selected(installation: Tuple[str, str]) -> None:
+    """
+    Notes:
+        This can fail if checking some packages reads the entries of the others, or if a package that isn't
+        installed doesn't raise a ValueError naming it.
+
+    Returns:
+        Nothing will be returned.
+    """
+    _, dbpath = installation
+    assert {entry.package for entry in check.read_entries(dbpath, ["vim"])} == {"vim"}
+    with pytest.raises(ValueError, match="nosuchpkg"):
+        check.read_entries(dbpath, ["vim", "nosuchpkg"])
@@ -0,0 +1,128 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+import pytest
+from typing import Dict, List
+from pacmanpie import complete
+from pacmanpie.complete import LOCAL, SYNC, NameCache
+from pacmanpie.database import Package
+from pacmanpie.journal import Journal
+from conftest import make_local_package, make_sync_db, package_fields
+
+
+@pytest.fixture
+def dbpath(tmp_path) -> str:
+    """A database location with vim and a foreign package installed, and core and extra repositories.
+
+    Returns:
+        The database location.
+    """
+    path: str = str(tmp_path / "db")
+    make_local_package(path, "vim", "8.2-1")
+    make_local_package(path, "vim-foreign", "1-1")
+    make_sync_db(path, "core", [package_fields("glibc", "2.32-1")])
+    make_sync_db(
+        path,
+        "extra",
+        [package_fields("vim", "8.2-2"), package_fields("vim-runtime", "8.2-2")],
+    )
+    return path
+
+
+def test_if_prefixes_are_completed(tmp_path) -> None:
+    """
+    Notes:
+        This can fail if a prefix search of the name cache misses a name, returns a name without the prefix or
+        ignores the requested kinds.
+
+    Returns:
+        Nothing will be returned.
+    """
+    names: Dict[str, int] = {
+        f"lib{number}": LOCAL if number % 3 else SYNC for number in range(1000)
+    }
+    names.update({"li": LOCAL | SYNC, "lib": SYNC, "zsh": LOCAL})
+    path: str = str(tmp_path / "names.cache")
+    complete.write_cache(path, names)
+    cache: NameCache = NameCache(path)
+    for prefix in ("", "l", "lib", "lib1", "lib99", "lib999", "lib9999", "m", "zsh"):
+        for kinds in (LOCAL, SYNC, LOCAL | SYNC):
+            assert cache.complete(prefix, kinds) == sorted(
+                name
+                for name, name_kinds in names.items()
+                if name.startswith(prefix) and name_kinds & kinds
+            )
+    assert cache.names() == names
+
+
+def test_if_cache_follows_transactions(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if the name cache isn't regenerated from the local and sync databases, or if a commit doesn't
+        update its installed names.
+
+    Returns:
+        Nothing will be returned.
+    """
+    complete.refresh(dbpath, ["core", "extra"])
+    cache: NameCache = NameCache(complete.cache_path(dbpath))
+    assert cache.complete("vim", LOCAL) == ["vim", "vim-foreign"]
+    assert cache.complete("vim", SYNC) == ["vim", "vim-runtime"]
+    Journal(dbpath).commit(
+        add=[Package("vim-runtime", "8.2-2", package_fields("vim-runtime", "8.2-2"))],
+        remove=["vim-foreign"],
+    )
+    cache = NameCache(complete.cache_path(dbpath))
+    assert cache.complete("vim", LOCAL) == ["vim", "vim-runtime"]
+    assert cache.complete("", SYNC) == ["glibc", "vim", "vim-runtime"]
+
+
+def test_if_fast_path_runs_isolated(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if answering a completion needs anything outside the standard library, e.g. pacmanpie itself,
+        rich or pyalpm, which aren't importable in an isolated interpreter without site-packages.
+
+    Returns:
+        Nothing will be returned.
+    """
+    complete.refresh(dbpath, ["core", "extra"])
+
+    def run(*arguments: str) -> List[str]:
+        return (
+            subprocess.run(
+                [sys.executable, "-I", "-S", complete.__file__, *arguments],
+                stdout=subprocess.PIPE,
+                check=True,
+                cwd=os.path.dirname(dbpath),
+            )
+            .stdout.decode()
+            .split()
+        )
+
+    assert run("--sync", "--dbpath", dbpath, "--", "vim") == ["vim", "vim-runtime"]
+    assert run("--local", "--dbpath", dbpath, "vim-") == ["vim-foreign"]
+    assert run("--dbpath", dbpath, "g") == ["glibc"]
+    assert run("--dbpath", dbpath, "--", "x") == []
+    assert (
+        subprocess.run(
+            [sys.executable, "-I", "-S", complete.__file__, "--dbpath", "/nonexistent"]
+        ).returncode
+        == 1
+    )
@@ -0,0 +1,267 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import signal
+import subprocess
+import sys
+import pytest
+from typing import Dict, List
+from pacmanpie import database, journal
+from pacmanpie.database import Package
+from pacmanpie.journal import DerivedIndex, Journal
+from pacmanpie.owners import OwnerIndex, package_pairs
+from conftest import make_local_package, package_fields
+
+# commits an upgrade of vim and the removal of nano, killing itself at the n-th rename or fsync
+CRASHING_COMMIT: str = """
+import os
+import signal
+import sys
+from pacmanpie import journal
+from pacmanpie.database import Package
+
+dbpath, kill_at = sys.argv[1], int(sys.argv[2])
+calls = [0]
+
+
+def killing(function):
+    def wrapper(*args):
+        calls[0] += 1
+        if calls[0] == kill_at:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return function(*args)
+
+    return wrapper
+
+
+os.replace = killing(os.replace)
+journal._fsync = killing(journal._fsync)
+fields = {"NAME": ["vim"], "VERSION": ["2-1"], "DEPENDS": ["glibc", "vim-runtime=2-1"]}
+journal.Journal(dbpath).commit(
+    add=[Package("vim", "2-1", fields, ["usr/", "usr/bin/", "usr/bin/vim"])],
+    remove=["nano"],
+    mtrees={"vim": b"mtree"},
+)
+"""
+
+
+def package(name: str, version: str, files: List[str], **fields: List[str]) -> Package:
+    """Generates a fixture package to commit.
+
+    Args:
+        name: The package name.
+        version: The package version.
+        files: The file list.
+        **fields: Extra desc fields.
+
+    Returns:
+        The package.
+    """
+    return Package(name, version, package_fields(name, version, **fields), files)
+
+
+def installed(dbpath: str) -> Dict[str, str]:
+    """Lists the installed packages.
+
+    Args:
+        dbpath: The database location.
+
+    Returns:
+        The installed versions, mapped to the package names.
+    """
+    return {
+        name: local_package.version
+        for name, local_package in database.read_local_db(dbpath).items()
+    }
+
+
+def without_seq(index: DerivedIndex) -> dict:
+    """The indexes as plain data, ignoring the journal record they are up to date with.
+
+    Args:
+        index: The indexes.
+
+    Returns:
+        The indexes.
+    """
+    data: dict = index.as_dict()
+    data.pop("seq")
+    data.pop("generation")
+    return data
+
+
+@pytest.fixture
+def dbpath(tmp_path) -> str:
+    """A database location with vim, nano and bash installed.
+
+    Returns:
+        The database location.
+    """
+    path: str = str(tmp_path / "db")
+    make_local_package(path, "vim", "1-1", ["usr/", "usr/bin/", "usr/bin/vim"])
+    make_local_package(
+        path, "nano", "1-1", ["usr/", "usr/bin/", "usr/bin/nano"], PROVIDES=["editor"]
+    )
+    make_local_package(path, "bash", "1-1", ["usr/", "usr/bin/", "usr/bin/bash"])
+    return path
+
+
+def test_if_commit_writes_only_changed_entries(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if the commit doesn't install, upgrade and remove the packages, or if it rewrites the entry
+        of an unchanged package.
+
+    Returns:
+        Nothing will be returned.
+    """
+    bash_path: str = os.path.join(dbpath, "local", "bash-1-1")
+    bash_inode: int = os.stat(os.path.join(bash_path, "desc")).st_ino
+    Journal(dbpath).commit(
+        add=[
+            package("vim", "2-1", ["usr/bin/vim"], BACKUP=["etc/vimrc\tabc"]),
+            package("gvim", "2-1", ["usr/bin/gvim"]),
+        ],
+        remove=["nano"],
+        mtrees={"vim": b"\x1f\x8bmtree"},
+    )
+    assert installed(dbpath) == {"vim": "2-1", "gvim": "2-1", "bash": "1-1"}
+    assert os.stat(os.path.join(bash_path, "desc")).st_ino == bash_inode
+    vim: Package = database.read_local_package(dbpath, "vim-2-1", files=True)
+    assert vim.files == ["usr/bin/vim"]
+    assert vim.fields["BACKUP"] == ["etc/vimrc\tabc"]
+    with open(os.path.join(dbpath, "local", "vim-2-1", "mtree"), "rb") as mtree:
+        assert mtree.read() == b"\x1f\x8bmtree"
+    with open(os.path.join(dbpath, "local", "vim-2-1", "desc")) as desc:
+        assert "%BACKUP%" not in desc.read()
+
+
+def test_if_index_is_updated_incrementally(dbpath: str, monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if the indexes loaded after some commits differ from indexes built from scratch, or if they
+        are rebuilt from the whole local database instead of the journal.
+
+    Returns:
+        Nothing will be returned.
+    """
+    commits: Journal = Journal(dbpath)
+    commits.index()
+    commits.owners()
+    commits.commit(
+        add=[package("vim", "2-1", ["usr/bin/vim", "usr/bin/ex"], DEPENDS=["glibc"])]
+    )
+    commits.commit(remove=["nano"])
+    commits.commit(add=[package("ed", "1-1", ["usr/bin/ed"], PROVIDES=["editor=1"])])
+
+    def read_local_db(*args, **kwargs):
+        raise AssertionError("the indexes shouldn't be rebuilt")
+
+    monkeypatch.setattr(database, "read_local_db", read_local_db)
+    index: DerivedIndex = Journal(dbpath).index()
+    owner_index: OwnerIndex = Journal(dbpath).owners()
+    monkeypatch.undo()
+    rebuilt: DerivedIndex = DerivedIndex.build(database.read_local_db(dbpath).values())
+    assert without_seq(index) == without_seq(rebuilt)
+    assert list(owner_index) == package_pairs(
+        database.read_local_db(dbpath, True).values()
+    )
+    assert owner_index.lookup("usr/bin/ex") == ["vim"]
+    assert owner_index.lookup("usr/") == ["bash"]
+    assert index.provides == {"editor": {"ed"}}
+    assert index.required_by == {"glibc": {"vim"}}
+
+
+def test_if_foreign_changes_rebuild_the_index(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if a package installed without the journal (e.g. by pacman) is missing from the indexes.
+
+    Returns:
+        Nothing will be returned.
+    """
+    commits: Journal = Journal(dbpath)
+    commits.commit(add=[package("ed", "1-1", ["usr/bin/ed"])])
+    commits.index()
+    commits.owners()
+    make_local_package(dbpath, "zsh", "1-1", ["usr/bin/zsh"], DEPENDS=["glibc"])
+    commits.commit(add=[package("ed", "2-1", ["usr/bin/ed"])])
+    assert commits.index().required_by == {"glibc": {"zsh"}}
+    assert commits.owners().lookup("usr/bin/zsh") == ["zsh"]
+
+
+def test_if_journal_is_compacted(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if the done records pile up forever, or if compacting them loses a change.
+
+    Returns:
+        Nothing will be returned.
+    """
+    commits: Journal = Journal(dbpath)
+    for number in range(journal._COMPACT_AFTER * 2):
+        commits.commit(add=[package("ed", f"{number}-1", [f"usr/share/ed/{number}"])])
+    assert len(os.listdir(commits.path)) <= journal._COMPACT_AFTER + 2
+    owner_index: OwnerIndex = Journal(dbpath).owners()
+    assert owner_index.lookup(f"usr/share/ed/{journal._COMPACT_AFTER * 2 - 1}") == [
+        "ed"
+    ]
+    assert owner_index.lookup("usr/share/ed/0") == []
+    assert commits.commit() == journal._COMPACT_AFTER * 2 + 1
+
+
+@pytest.mark.parametrize("kill_at", range(1, 20))
+def test_if_crashed_commit_is_recovered(dbpath: str, kill_at: int) -> None:
+    """
+    Notes:
+        This can fail if a commit killed at any rename or fsync leaves the local database or its indexes in a state
+        other than before or after the commit, or if a commit that reached the journal is lost.
+
+    Args:
+        kill_at: The rename or fsync the commit is killed at.
+
+    Returns:
+        Nothing will be returned.
+    """
+    before: Dict[str, str] = installed(dbpath)
+    Journal(dbpath).index()
+    Journal(dbpath).owners()
+    process: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, "-c", CRASHING_COMMIT, dbpath, str(kill_at)],
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+        stderr=subprocess.PIPE,
+    )
+    assert process.returncode in (0, -signal.SIGKILL), process.stderr.decode()
+    commits: Journal = Journal(dbpath)
+    reached_journal: bool = any(
+        name.endswith(".pending") for name in os.listdir(commits.path)
+    )
+    commits.recover()
+    after: Dict[str, str] = installed(dbpath)
+    if reached_journal or process.returncode == 0:
+        assert after == {"vim": "2-1", "bash": "1-1"}
+    else:
+        assert after in (before, {"vim": "2-1", "bash": "1-1"})
+    assert without_seq(commits.index()) == without_seq(
+        DerivedIndex.build(database.read_local_db(dbpath).values())
+    )
+    assert list(commits.owners()) == package_pairs(
+        database.read_local_db(dbpath, files=True).values()
+    )
+    assert sorted(os.listdir(os.path.join(dbpath, "local"))) == sorted(
+        f"{name}-{version}" for name, version in after.items()
+    )
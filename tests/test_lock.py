@@ -0,0 +1,410 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import fcntl
+import os
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from typing import Dict, List
+from pacmanpie import database, lock
+from pacmanpie.database import Package
+from pacmanpie.journal import Journal
+from pacmanpie.owners import OwnerIndex
+from conftest import make_local_package, package_fields
+
+COMMITS: int = 40
+READER_THREADS: int = 8
+READER_PROCESSES: int = 3
+OVERLAPPING_READERS: int = 16
+WRITER_BOUND: float = 2
+
+# checks the invariants of the local database until the stop file exists, printing the amount of reads
+READER: str = """
+import os
+import sys
+from pacmanpie import database
+from pacmanpie.journal import Journal
+
+dbpath, stop = sys.argv[1], sys.argv[2]
+reads = 0
+# reads at least once, even if it starts after the writer is done
+while not reads or not os.path.exists(stop):
+    local = Journal(dbpath)
+    with local.reading():
+        versions = {
+            name: package.version
+            for name, package in database.read_local_db(dbpath).items()
+        }
+        assert versions["vim"] == versions["vim-runtime"], versions
+        owners = local.owners()
+        number = versions["vim"].split("-")[0]
+        assert owners.lookup(f"usr/share/vim/{number}") == ["vim-runtime"], number
+        owners.close()
+    reads += 1
+print(reads)
+"""
+
+
+def vim(version: str) -> List[Package]:
+    """Generates vim and vim-runtime, which are always upgraded together.
+
+    Args:
+        version: The version of both packages.
+
+    Returns:
+        The packages.
+    """
+    number: str = version.split("-")[0]
+    return [
+        Package("vim", version, package_fields("vim", version), ["usr/bin/vim"]),
+        Package(
+            "vim-runtime",
+            version,
+            package_fields("vim-runtime", version),
+            [f"usr/share/vim/{number}"],
+        ),
+    ]
+
+
+def check_invariants(dbpath: str) -> None:
+    """Asserts that both vim packages have the same version and own their files.
+
+    Args:
+        dbpath: The database location.
+    """
+    local: Journal = Journal(dbpath)
+    with local.reading():
+        versions: Dict[str, str] = {
+            name: package.version
+            for name, package in database.read_local_db(dbpath).items()
+        }
+        assert versions["vim"] == versions["vim-runtime"]
+        owners: OwnerIndex = local.owners()
+        number: str = versions["vim"].split("-")[0]
+        assert owners.lookup(f"usr/share/vim/{number}") == ["vim-runtime"]
+        owners.close()
+
+
+@pytest.fixture
+def dbpath(tmp_path) -> str:
+    """A database location with vim 0-1 and vim-runtime 0-1 installed.
+
+    Returns:
+        The database location.
+    """
+    path: str = str(tmp_path / "db")
+    make_local_package(path, "vim", "0-1", ["usr/bin/vim"])
+    make_local_package(path, "vim-runtime", "0-1", ["usr/share/vim/0"])
+    return path
+
+
+def test_if_readers_share_the_lock(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if a reader waits for another reader, which would break the barrier.
+
+    Returns:
+        Nothing will be returned.
+    """
+    barrier: threading.Barrier = threading.Barrier(READER_THREADS, timeout=10)
+    errors: List[BaseException] = []
+
+    def read() -> None:
+        try:
+            with lock.shared(dbpath, timeout=10):
+                barrier.wait()
+        except BaseException as error:
+            errors.append(error)
+
+    threads: List[threading.Thread] = [
+        threading.Thread(target=read) for _ in range(READER_THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_if_writer_excludes_readers_and_writers(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if a lock is granted while another thread holds the exclusive lock, or if the exclusive lock
+        is granted while another thread reads.
+
+    Returns:
+        Nothing will be returned.
+    """
+    outcomes: List[str] = []
+
+    def try_lock(mode) -> None:
+        try:
+            with mode(dbpath, timeout=0.1):
+                outcomes.append("granted")
+        except BlockingIOError:
+            outcomes.append("refused")
+
+    def in_thread(mode) -> None:
+        thread: threading.Thread = threading.Thread(target=try_lock, args=(mode,))
+        thread.start()
+        thread.join()
+
+    with lock.exclusive(dbpath):
+        in_thread(lock.shared)
+        in_thread(lock.exclusive)
+    with lock.shared(dbpath):
+        in_thread(lock.exclusive)
+        in_thread(lock.shared)
+    in_thread(lock.exclusive)
+    assert outcomes == ["refused", "refused", "refused", "granted", "granted"]
+
+
+def test_if_locks_are_reentrant(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if a thread deadlocks on a lock it already holds, or if a shared lock can be turned into an
+        exclusive one.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert lock.held(dbpath) is None
+    with lock.exclusive(dbpath, timeout=1):
+        with lock.shared(dbpath, timeout=1), lock.exclusive(dbpath, timeout=1):
+            assert lock.held(dbpath) == lock.EXCLUSIVE
+    with lock.shared(dbpath, timeout=1):
+        with lock.shared(dbpath, timeout=1):
+            assert lock.held(dbpath) == lock.SHARED
+        with pytest.raises(RuntimeError):
+            with lock.exclusive(dbpath, timeout=1):
+                pass
+    assert lock.held(dbpath) is None
+
+
+def test_if_readers_need_no_write_access(tmp_path, monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if a reader creates the pacmanpie directory, or fails instead of going without the lock
+        when it can't create the lock files. A writer should still fail then.
+
+    Returns:
+        Nothing will be returned.
+    """
+    dbpath: str = str(tmp_path / "db")
+    make_local_package(dbpath, "vim", "1-1", ["usr/bin/vim"])
+
+    def denied(path: str, *args, **kwargs) -> None:
+        raise PermissionError(13, "Permission denied", path)
+
+    monkeypatch.setattr(os, "makedirs", denied)
+    with lock.shared(dbpath, timeout=1):
+        assert lock.held(dbpath) == lock.SHARED
+    assert not os.path.exists(os.path.join(dbpath, "pacmanpie"))
+    with pytest.raises(PermissionError):
+        with lock.exclusive(dbpath, timeout=1):
+            pass
+    monkeypatch.undo()
+    with lock.exclusive(dbpath, timeout=1):
+        pass
+    # the lock files exist now, so readers lock them without creating anything
+    monkeypatch.setattr(os, "makedirs", denied)
+    rw_lock: int = os.open(os.path.join(dbpath, "pacmanpie", "rw.lock"), os.O_RDONLY)
+    try:
+        with lock.shared(dbpath, timeout=1):
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(rw_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    finally:
+        os.close(rw_lock)
+
+
+def test_if_commit_holds_db_lck(dbpath: str, monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if db.lck doesn't exist while the local database is written, if it's left behind, or if a
+        commit runs while pacman holds it.
+
+    Returns:
+        Nothing will be returned.
+    """
+    db_lck: str = os.path.join(dbpath, "db.lck")
+    seen: List[bool] = []
+    apply = Journal._apply
+
+    def watched_apply(self, record: dict) -> None:
+        seen.append(os.path.exists(db_lck))
+        apply(self, record)
+
+    monkeypatch.setattr(Journal, "_apply", watched_apply)
+    Journal(dbpath).commit(add=vim("1-1"))
+    assert seen == [True]
+    assert not os.path.exists(db_lck)
+    # pacman leaves an empty db.lck
+    open(db_lck, "w").close()
+    with pytest.raises(BlockingIOError):
+        Journal(dbpath).commit(add=vim("2-1"))
+    assert os.path.exists(db_lck)
+    with lock.shared(dbpath, timeout=0):
+        assert database.read_local_db(dbpath)["vim"].version == "1-1"
+
+
+def test_if_readers_never_see_a_commit_half_done(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if a reader thread or process sees vim and vim-runtime of different commits, or a stale file
+        owner index, while one writer keeps upgrading them. It can also fail if the writer or a reader starves.
+
+    Returns:
+        Nothing will be returned.
+    """
+    stop: str = os.path.join(os.path.dirname(dbpath), "stop")
+    processes: List[subprocess.Popen] = [
+        subprocess.Popen(
+            [sys.executable, "-c", READER, dbpath, stop],
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(sys.path)},
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        for _ in range(READER_PROCESSES)
+    ]
+    done: threading.Event = threading.Event()
+    errors: List[BaseException] = []
+    reads: List[int] = []
+
+    def read() -> None:
+        count: int = 0
+        try:
+            while not done.is_set():
+                check_invariants(dbpath)
+                count += 1
+            check_invariants(dbpath)
+        except BaseException as error:
+            errors.append(error)
+        reads.append(count)
+
+    threads: List[threading.Thread] = [
+        threading.Thread(target=read) for _ in range(READER_THREADS)
+    ]
+    for thread in threads:
+        thread.start()
+    started: float = time.monotonic()
+    try:
+        for number in range(1, COMMITS + 1):
+            Journal(dbpath).commit(add=vim(f"{number}-1"))
+    finally:
+        done.set()
+        open(stop, "w").close()
+        for thread in threads:
+            thread.join()
+    assert time.monotonic() - started < 60
+    outputs: List[bytes] = []
+    for process in processes:
+        stdout, stderr = process.communicate(timeout=60)
+        assert process.returncode == 0, stderr.decode()
+        outputs.append(stdout)
+    assert not errors
+    assert all(count > 0 for count in reads)
+    assert all(int(output) > 0 for output in outputs)
+    assert database.read_local_db(dbpath)["vim"].version == f"{COMMITS}-1"
+    assert not os.path.exists(os.path.join(dbpath, "db.lck"))
+
+
+def test_if_overlapping_readers_dont_starve_a_writer(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if new readers keep getting the lock while a writer waits, as the readers always overlap
+        so the lock is never free of them.
+
+    Returns:
+        Nothing will be returned.
+    """
+    done: threading.Event = threading.Event()
+    errors: List[BaseException] = []
+
+    def read() -> None:
+        try:
+            while not done.is_set():
+                with lock.shared(dbpath):
+                    time.sleep(0.005)
+        except BaseException as error:
+            errors.append(error)
+
+    threads: List[threading.Thread] = [
+        threading.Thread(target=read) for _ in range(OVERLAPPING_READERS)
+    ]
+    for thread in threads:
+        thread.start()
+    waits: List[float] = []
+    try:
+        time.sleep(0.1)
+        for _ in range(10):
+            started: float = time.monotonic()
+            with lock.exclusive(dbpath, pacman=False):
+                waits.append(time.monotonic() - started)
+            time.sleep(0.01)
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+    assert not errors
+    assert max(waits) < WRITER_BOUND, waits
+
+
+def test_if_a_waiting_writer_holds_back_new_readers(dbpath: str) -> None:
+    """
+    Notes:
+        This can fail if a reader gets the lock while a writer waits for a long reader, so the writer could be
+        starved, or if the writer isn't granted the lock as soon as the long reader is done.
+
+    Returns:
+        Nothing will be returned.
+    """
+    order: List[str] = []
+    reading: threading.Event = threading.Event()
+    waiting: threading.Event = threading.Event()
+
+    def long_read() -> None:
+        with lock.shared(dbpath):
+            reading.set()
+            waiting.wait(5)
+            time.sleep(0.3)
+            order.append("long reader")
+
+    def write() -> None:
+        waiting.set()
+        with lock.exclusive(dbpath, pacman=False):
+            order.append("writer")
+
+    def read() -> None:
+        with lock.shared(dbpath):
+            order.append("reader")
+
+    reader: threading.Thread = threading.Thread(target=long_read)
+    reader.start()
+    reading.wait(5)
+    writer: threading.Thread = threading.Thread(target=write)
+    writer.start()
+    waiting.wait(5)
+    time.sleep(0.1)
+    started: float = time.monotonic()
+    read()
+    blocked: float = time.monotonic() - started
+    for thread in (reader, writer):
+        thread.join()
+    assert order == ["long reader", "writer", "reader"]
+    assert blocked > 0.1
@@ -0,0 +1,189 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import random
+import pytest
+from typing import Dict, List, Tuple
+from pacmanpie import database, owners
+from pacmanpie.owners import OwnerIndex
+from pacmanpie.journal import Journal
+from conftest import make_local_package, make_sync_db, package_fields
+
+
+@pytest.fixture
+def pairs() -> List[Tuple[str, str]]:
+    """Random (path, package) pairs, where directories have many owners.
+
+    Returns:
+        The pairs, sorted.
+    """
+    rng: random.Random = random.Random(0)
+    result: List[Tuple[str, str]] = []
+    for number in range(500):
+        name: str = f"package{number}"
+        result.extend([("usr/", name), ("usr/lib/", name)])
+        result.extend(
+            (f"usr/lib/lib{rng.randint(0, 10 ** 6)}-{number}.so", name)
+            for _ in range(10)
+        )
+    return sorted(result)
+
+
+def test_if_lookups_match_the_pairs(pairs: List[Tuple[str, str]], tmp_path) -> None:
+    """
+    Notes:
+        This can fail if a batch lookup in the memory-mapped index disagrees with a dictionary built from the same
+        pairs, including for unknown paths and paths with many owners.
+
+    Returns:
+        Nothing will be returned.
+    """
+    path: str = str(tmp_path / "index")
+    owners.write_index(path, pairs, (1, 2))
+    index: OwnerIndex = OwnerIndex(path)
+    expected: Dict[str, List[str]] = {}
+    for file_path, package in pairs:
+        expected.setdefault(file_path, []).append(package)
+    queries: List[str] = list(expected) + ["usr/lib/missing.so", "", "zzz"]
+    results: Dict[str, List[str]] = index.lookup_many(queries)
+    assert results == {query: sorted(expected.get(query, [])) for query in queries}
+    assert index.lookup("usr/") == sorted(f"package{number}" for number in range(500))
+    assert index.source == (1, 2)
+    assert list(index) == pairs
+    assert len(index) == len(pairs)
+
+
+def test_if_merge_applies_changes(pairs: List[Tuple[str, str]], tmp_path) -> None:
+    """
+    Notes:
+        This can fail if merging changes into an index gives a different index than writing it from scratch.
+
+    Returns:
+        Nothing will be returned.
+    """
+    path: str = str(tmp_path / "index")
+    owners.write_index(path, pairs, (1, 1))
+    removed: set = {pair for pair in pairs if pair[1] == "package7"}
+    added: List[Tuple[str, str]] = [("usr/", "new"), ("usr/bin/new", "new")]
+    index: OwnerIndex = owners.merge_index(path, (1, 2), added, removed)
+    assert list(index) == sorted(set(pairs) - removed | set(added))
+    assert index.lookup("usr/bin/new") == ["new"]
+    assert index.source == (1, 2)
+
+
+def test_if_sync_index_is_only_rebuilt_when_files_db_changes(
+    tmp_path, monkeypatch
+) -> None:
+    """
+    Notes:
+        This can fail if the index of a .files database is rebuilt although the database didn't change, or isn't
+        rebuilt although it did.
+
+    Returns:
+        Nothing will be returned.
+    """
+    dbpath: str = str(tmp_path / "db")
+    make_sync_db(
+        dbpath,
+        "core",
+        [package_fields("glibc", "2.32-1", FILES=["usr/", "usr/lib/libc.so.6"])],
+        "files",
+    )
+    make_sync_db(
+        dbpath,
+        "extra",
+        [package_fields("vim", "8.2-1", FILES=["usr/", "usr/bin/vim"])],
+        "files",
+    )
+    reads: List[str] = []
+    read_sync_db = database.read_sync_db
+
+    def counting_read_sync_db(path: str, repo: str):
+        reads.append(repo)
+        return read_sync_db(path, repo)
+
+    monkeypatch.setattr(database, "read_sync_db", counting_read_sync_db)
+    paths: List[str] = ["usr/", "usr/bin/vim", "usr/bin/missing"]
+    expected: Dict[str, List[str]] = {
+        "usr/": ["core/glibc", "extra/vim"],
+        "usr/bin/vim": ["extra/vim"],
+        "usr/bin/missing": [],
+    }
+    assert owners.lookup_sync(dbpath, ["core", "extra", "missing"], paths) == expected
+    assert owners.lookup_sync(dbpath, ["core", "extra"], paths) == expected
+    assert reads == ["core", "extra"]
+    make_sync_db(
+        dbpath,
+        "extra",
+        [package_fields("vim", "8.2-2", FILES=["usr/", "usr/bin/vim", "usr/bin/ex"])],
+        "files",
+    )
+    os.utime(database.sync_db_path(dbpath, "extra", "files"), ns=(1, 1))
+    assert owners.lookup_sync(dbpath, ["core", "extra"], ["usr/bin/ex"]) == {
+        "usr/bin/ex": ["extra/vim"]
+    }
+    assert reads == ["core", "extra", "extra"]
+
+
+def test_if_paths_are_normalized() -> None:
+    """
+    Notes:
+        This can fail if a path isn't converted to the form used by file lists.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert owners.normalize("/usr/lib/../lib/libalpm.so") == "usr/lib/libalpm.so"
+    assert owners.normalize("/") == ""
+
+
+def test_if_lookups_work_without_write_access(tmp_path, monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if reading the local database needs the pacmanpie directory to be created, if a sync lookup
+        fails instead of searching the file lists when its index can't be written, or if that search disagrees
+        with the index.
+
+    Returns:
+        Nothing will be returned.
+    """
+    dbpath: str = str(tmp_path / "db")
+    make_local_package(dbpath, "vim", "8.2-1", ["usr/", "usr/bin/vim"])
+    make_sync_db(
+        dbpath,
+        "extra",
+        [package_fields("vim", "8.2-2", FILES=["usr/", "usr/bin/vim", "usr/bin/ex"])],
+        "files",
+    )
+
+    def denied(path: str, *args, **kwargs) -> None:
+        raise PermissionError(13, "Permission denied", path)
+
+    monkeypatch.setattr(os, "makedirs", denied)
+    with Journal(dbpath).reading():
+        packages: Dict[str, database.Package] = database.read_local_db(
+            dbpath, files=True
+        )
+    assert owners.lookup_packages(packages.values(), ["usr/", "usr/bin/ex"]) == {
+        "usr/": ["vim"],
+        "usr/bin/ex": [],
+    }
+    assert owners.lookup_sync(dbpath, ["extra"], ["usr/bin/ex", "usr/lib/"]) == {
+        "usr/bin/ex": ["extra/vim"],
+        "usr/lib/": [],
+    }
+    assert not os.path.exists(database.state_dir(dbpath, create=False))
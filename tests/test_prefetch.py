@@ -0,0 +1,247 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import http.server
+import os
+import threading
+import time
+import pytest
+from functools import partial
+from typing import Dict, Iterator, List, Optional
+from pacmanpie import prefetch
+from pacmanpie.config import PacmanConfig
+from pacmanpie.prefetch import Fetched
+from conftest import make_local_package, make_sync_db, package_fields
+
+ARCHIVES: Dict[str, bytes] = {
+    "vim-8.2-2-x86_64.pkg.tar.gz": os.urandom(300 * 1024),
+    "glibc-2.32-1-x86_64.pkg.tar.gz": os.urandom(100 * 1024),
+}
+
+
+class MirrorHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves a mirror directory, with the range requests a resumed download makes."""
+
+    requests: List[Optional[str]] = []
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        MirrorHandler.requests.append(self.headers.get("Range"))
+        path: str = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as archive:
+            data: bytes = archive.read()
+        start: int = 0
+        if self.headers.get("Range"):
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(data):
+                self.send_error(416)
+                return
+            self.send_response(206)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+
+@pytest.fixture
+def mirror(tmp_path) -> Iterator[str]:
+    """A localhost mirror serving the core and extra archives.
+
+    Returns:
+        The server URL, with $repo to substitute.
+    """
+    for repo, filename in (
+        ("extra", "vim-8.2-2-x86_64.pkg.tar.gz"),
+        ("core", "glibc-2.32-1-x86_64.pkg.tar.gz"),
+    ):
+        os.makedirs(str(tmp_path / "mirror" / repo), exist_ok=True)
+        with open(str(tmp_path / "mirror" / repo / filename), "wb") as archive:
+            archive.write(ARCHIVES[filename])
+    server: http.server.ThreadingHTTPServer = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0),
+        partial(MirrorHandler, directory=str(tmp_path / "mirror")),
+    )
+    thread: threading.Thread = threading.Thread(
+        target=server.serve_forever, daemon=True
+    )
+    thread.start()
+    MirrorHandler.requests = []
+    yield f"http://127.0.0.1:{server.server_address[1]}/$repo"
+    server.shutdown()
+    server.server_close()
+
+
+def setup(tmp_path, mirror: str, vim_sha256sum: Optional[str] = None) -> PacmanConfig:
+    """Writes a database location needing upgrades of vim and glibc.
+
+    Args:
+        mirror: The server URL.
+        vim_sha256sum: The checksum of the vim archive in the sync database, the right one if None.
+
+    Returns:
+        The configuration, with a broken server before the mirror.
+    """
+    dbpath: str = str(tmp_path / "db")
+    make_local_package(dbpath, "vim", "8.2-1")
+    make_local_package(dbpath, "glibc", "2.31-1")
+    for repo, name, version in (("core", "glibc", "2.32-1"), ("extra", "vim", "8.2-2")):
+        filename: str = f"{name}-{version}-x86_64.pkg.tar.gz"
+        checksum: str = hashlib.sha256(ARCHIVES[filename]).hexdigest()
+        if name == "vim" and vim_sha256sum:
+            checksum = vim_sha256sum
+        make_sync_db(
+            dbpath,
+            repo,
+            [
+                package_fields(
+                    name,
+                    version,
+                    SHA256SUM=[checksum],
+                    CSIZE=[str(len(ARCHIVES[filename]))],
+                )
+            ],
+        )
+    return PacmanConfig(
+        cache_dirs=[str(tmp_path / "cache")],
+        repos={
+            "core": ["http://127.0.0.1:9/unreachable/$repo", mirror],
+            "extra": [mirror],
+        },
+    )
+
+
+def statuses(results: List[Fetched]) -> Dict[str, str]:
+    """Summarizes the outcome of a prefetch.
+
+    Args:
+        results: The outcome of every download.
+
+    Returns:
+        The status of every archive, mapped to the archive filename.
+    """
+    return {result.filename: result.status for result in results}
+
+
+def test_if_archives_are_prefetched_once(tmp_path, mirror: str) -> None:
+    """
+    Notes:
+        This can fail if the archives of the pending upgrades aren't downloaded into the cache (trying the next
+        server when one fails), or if they are downloaded again.
+
+    Returns:
+        Nothing will be returned.
+    """
+    config: PacmanConfig = setup(tmp_path, mirror)
+    dbpath: str = str(tmp_path / "db")
+    assert statuses(prefetch.prefetch(dbpath, config)) == {
+        "glibc-2.32-1-x86_64.pkg.tar.gz": "downloaded",
+        "vim-8.2-2-x86_64.pkg.tar.gz": "downloaded",
+    }
+    for filename, data in ARCHIVES.items():
+        with open(os.path.join(config.cache_dir, filename), "rb") as archive:
+            assert archive.read() == data
+    assert statuses(prefetch.prefetch(dbpath, config)) == {
+        "glibc-2.32-1-x86_64.pkg.tar.gz": "cached",
+        "vim-8.2-2-x86_64.pkg.tar.gz": "cached",
+    }
+    assert MirrorHandler.requests == [None, None]
+
+
+def test_if_download_is_resumed(tmp_path, mirror: str) -> None:
+    """
+    Notes:
+        This can fail if an interrupted download starts over instead of resuming where it stopped.
+
+    Returns:
+        Nothing will be returned.
+    """
+    config: PacmanConfig = setup(tmp_path, mirror)
+    filename: str = "vim-8.2-2-x86_64.pkg.tar.gz"
+    os.makedirs(config.cache_dir)
+    with open(os.path.join(config.cache_dir, filename + ".part"), "wb") as part:
+        part.write(ARCHIVES[filename][:1000])
+    prefetch.prefetch(str(tmp_path / "db"), config)
+    assert "bytes=1000-" in MirrorHandler.requests
+    with open(os.path.join(config.cache_dir, filename), "rb") as archive:
+        assert archive.read() == ARCHIVES[filename]
+    assert not os.path.exists(os.path.join(config.cache_dir, filename + ".part"))
+
+
+def test_if_rate_is_capped(tmp_path, mirror: str) -> None:
+    """
+    Notes:
+        This can fail if the downloads are faster than the bandwidth cap.
+
+    Returns:
+        Nothing will be returned.
+    """
+    config: PacmanConfig = setup(tmp_path, mirror)
+    rate: int = 2 * 1024 * 1024
+    started: float = time.monotonic()
+    prefetch.prefetch(str(tmp_path / "db"), config, rate=rate)
+    # the first chunk of every archive is free
+    minimum: float = (
+        sum(map(len, ARCHIVES.values())) - 2 * prefetch._CHUNK_SIZE
+    ) / rate
+    assert time.monotonic() - started >= minimum
+
+
+def test_if_cache_size_and_checksums_are_respected(tmp_path, mirror: str) -> None:
+    """
+    Notes:
+        This can fail if an archive that would make the cache too big is downloaded, or if an archive that doesn't
+        match its checksum is kept.
+
+    Returns:
+        Nothing will be returned.
+    """
+    config: PacmanConfig = setup(tmp_path, mirror, vim_sha256sum="0" * 64)
+    results: List[Fetched] = prefetch.prefetch(
+        str(tmp_path / "db"), config, max_cache_size=200 * 1024
+    )
+    assert statuses(results) == {
+        "glibc-2.32-1-x86_64.pkg.tar.gz": "downloaded",
+        "vim-8.2-2-x86_64.pkg.tar.gz": "skipped",
+    }
+    results = prefetch.prefetch(str(tmp_path / "db"), config)
+    assert statuses(results) == {
+        "glibc-2.32-1-x86_64.pkg.tar.gz": "cached",
+        "vim-8.2-2-x86_64.pkg.tar.gz": "failed",
+    }
+    assert os.listdir(config.cache_dir) == ["glibc-2.32-1-x86_64.pkg.tar.gz"]
+
+
+def test_if_sizes_are_parsed() -> None:
+    """
+    Notes:
+        This can fail if a size given on the command line isn't converted to bytes.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert prefetch.parse_size("1048576") == 1024**2
+    assert prefetch.parse_size("512K") == 512 * 1024
+    assert prefetch.parse_size("1.5MiB") == 3 * 1024**2 // 2
+    assert prefetch.parse_size("5g") == 5 * 1024**3
+    with pytest.raises(ValueError):
+        prefetch.parse_size("lots")
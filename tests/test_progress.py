@@ -0,0 +1,117 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import threading
+import time
+from typing import Callable, List
+from pacmanpie import progress
+from pacmanpie.progress import Progress, Task
+
+
+class Terminal(io.StringIO):
+    """A stream pretending to be a terminal."""
+
+    def isatty(self) -> bool:
+        return True
+
+
+def test_if_rows_match_the_concept() -> None:
+    """
+    Notes:
+        This can fail if a task isn't shown like the "Remaining: 100%" rows of the concept.
+
+    Returns:
+        Nothing will be returned.
+    """
+    task: Task = Task(progress.RETRIEVAL, "vim 8.2.0814-3", 2 * 1024**2, True)
+    task.update(1024**2)
+    rows: List[str] = task.rows()
+    assert rows[0] == "    vim 8.2.0814-3"
+    assert rows[1] == "        Retrieved: 1.0 MiB"
+    assert rows[2].startswith("        Speed:     ") and rows[2].endswith("/s")
+    assert rows[3] == "        Remaining: 50%"
+    task.finish()
+    assert task.rows()[3] == "        Remaining: 100%"
+    assert progress.format_size(1733427) == "1.7 MiB"
+    assert progress.format_size(3 * 1024**4) == "3072.0 GiB"
+
+
+def test_if_rendering_is_throttled() -> None:
+    """
+    Notes:
+        This can fail if many workers updating their tasks make the renderer draw more often than its interval, or
+        if a finished task isn't printed exactly once when the stream isn't a terminal.
+
+    Returns:
+        Nothing will be returned.
+    """
+    stream: io.StringIO = io.StringIO()
+    live: Progress = Progress(stream, interval=0.02)
+    callbacks: List[Callable[[str, int, int], None]] = [
+        live.download_callback() for _ in range(8)
+    ]
+
+    def download(number: int) -> None:
+        for transferred in range(0, 20001):
+            callbacks[number](f"package{number}.pkg.tar.zst", transferred, 20000)
+
+    started: float = time.monotonic()
+    with live:
+        threads: List[threading.Thread] = [
+            threading.Thread(target=download, args=(number,)) for number in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed: float = time.monotonic() - started
+    output: str = stream.getvalue()
+    assert "\x1b" not in output
+    assert live.frames <= elapsed / 0.02 + 2
+    assert output.count("::Package Retrieval:") == 1
+    for number in range(8):
+        assert output.count(f"    package{number}.pkg.tar.zst\n") == 1
+    assert output.count("Remaining: 100%") == 8
+
+
+def test_if_terminal_is_redrawn_in_place() -> None:
+    """
+    Notes:
+        This can fail if the tasks in flight aren't redrawn over the previous frame on a terminal, or if the
+        libalpm callbacks don't put the checks and the installations in their sections.
+
+    Returns:
+        Nothing will be returned.
+    """
+    stream: Terminal = Terminal()
+    live: Progress = Progress(stream, fps=100)
+    callback: Callable[[str, int, int, int], None] = live.progress_callback("root: ")
+    with live:
+        callback("", 100, 1, 1)
+        callback("vim", 10, 2, 1)
+        time.sleep(0.05)
+        callback("vim", 100, 2, 1)
+        callback("vim-runtime", 50, 2, 2)
+        time.sleep(0.05)
+    output: str = stream.getvalue()
+    assert "\x1b[" in output
+    assert live.frames >= 2
+    final: str = output.rsplit("\x1b[J", 1)[1]
+    assert "::Integrity Checks:" in output
+    assert "    root: Check transaction\n        Remaining: 100%" in output
+    assert output.count("    root: Installing vim\n        Remaining: 100%") == 1
+    assert "    root: Installing vim-runtime\n        Remaining: 50%" in final
@@ -0,0 +1,198 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import os
+import sys
+import pytest
+from typing import Dict, List
+from pacmanpie import database, owners, repo, upgrades
+from pacmanpie.database import Package
+from conftest import make_local_package, make_package_archive
+
+
+def archive(directory: str, name: str, version: str, compression: str = "gz") -> str:
+    """Builds a fixture archive.
+
+    Args:
+        directory: Where the archive is written.
+        name: The package name.
+        version: The package version.
+        compression: "gz" or "zst".
+
+    Returns:
+        The path of the archive.
+    """
+    return make_package_archive(
+        directory,
+        name,
+        version,
+        {"usr/": b"", "usr/bin/": b"", f"usr/bin/{name}": f"{name} {version}".encode()},
+        compression=compression,
+        depend=["glibc"],
+        size=["1024"],
+    )
+
+
+def test_if_the_databases_are_readable_through_dbpath(paths: dict) -> None:
+    """
+    Notes:
+        This can fail if the desc fields or checksums differ from what repo-add writes, if the .files database
+        lacks the file lists, or if the databases can't be used as the sync databases of a --dbpath.
+
+    Returns:
+        Nothing will be returned.
+    """
+    path: str = archive(paths["repo"], "vim", "2-1", "zst")
+    archive(paths["repo"], "ed", "1-1")
+    with open(path + ".sig", "wb") as signature:
+        signature.write(b"\x89signature")
+    assert repo.build(paths["repo"], "internal", jobs=2) == repo.Build(2, 2, True)
+    packages: Dict[str, Package] = database.read_sync_db(
+        repo.database_path(paths["repo"], "internal"), "internal"
+    )
+    assert sorted(packages) == ["ed", "vim"]
+    with open(path, "rb") as archive_file:
+        content: bytes = archive_file.read()
+    assert packages["vim"].fields == {
+        "FILENAME": ["vim-2-1-x86_64.pkg.tar.zst"],
+        "NAME": ["vim"],
+        "VERSION": ["2-1"],
+        "CSIZE": [str(len(content))],
+        "ISIZE": ["1024"],
+        "MD5SUM": [hashlib.md5(content).hexdigest()],
+        "SHA256SUM": [hashlib.sha256(content).hexdigest()],
+        "PGPSIG": ["iXNpZ25hdHVyZQ=="],
+        "ARCH": ["x86_64"],
+        "DEPENDS": ["glibc"],
+    }
+    os.makedirs(os.path.join(paths["dbpath"], "sync"))
+    for kind in ("db", "files"):
+        os.symlink(
+            repo.database_path(paths["repo"], "internal", kind),
+            database.sync_db_path(paths["dbpath"], "internal", kind),
+        )
+    assert owners.lookup_sync(paths["dbpath"], ["internal"], ["usr/bin/vim"]) == {
+        "usr/bin/vim": ["internal/vim"]
+    }
+    make_local_package(paths["dbpath"], "vim", "1-1")
+    assert [
+        (upgrade.name, upgrade.new_version, upgrade.filename)
+        for upgrade in upgrades.pending(paths["dbpath"], ["internal"])
+    ] == [("vim", "2-1", "vim-2-1-x86_64.pkg.tar.zst")]
+
+
+def test_if_pkginfo_keys_become_desc_fields() -> None:
+    """
+    Notes:
+        This can fail if the .PKGINFO keys aren't mapped to desc fields, if repeated keys don't keep every value,
+        or if comments and keys without a desc field are kept.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert repo.parse_pkginfo(
+        "# generated by makepkg\n"
+        "pkgname = vim\n"
+        "pkgver = 1-1\n"
+        "arch = x86_64\n"
+        "backup = etc/vimrc\n"
+        "depend = glibc\n"
+        "depend = gpm\n"
+        "makedepend = gtk3\n"
+    ) == {
+        "NAME": ["vim"],
+        "VERSION": ["1-1"],
+        "ARCH": ["x86_64"],
+        "BACKUP": ["etc/vimrc"],
+        "DEPENDS": ["glibc", "gpm"],
+    }
+
+
+def test_if_a_rebuild_only_reads_changed_archives(paths: dict, monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if an unchanged archive is read again, if nothing is written when an archive changed, if
+        an older version is added next to a newer one, or if a removed archive stays in the databases.
+
+    Returns:
+        Nothing will be returned.
+    """
+    for number in range(10):
+        archive(paths["repo"], f"package{number}", "1-1")
+    repo.build(paths["repo"], "internal", jobs=1)
+    read: List[str] = []
+    read_archive = repo.read_archive
+
+    def counting(path: str) -> repo.Entry:
+        read.append(os.path.basename(path))
+        return read_archive(path)
+
+    monkeypatch.setattr(repo, "read_archive", counting)
+    assert repo.build(paths["repo"], "internal", jobs=1) == repo.Build(10, 0, False)
+    archive(paths["repo"], "package0", "2-1")
+    os.remove(os.path.join(paths["repo"], "package9-1-1-x86_64.pkg.tar.gz"))
+    assert repo.build(paths["repo"], "internal", jobs=1) == repo.Build(9, 1, True)
+    assert read == ["package0-2-1-x86_64.pkg.tar.gz"]
+    packages: Dict[str, Package] = database.read_sync_db(
+        repo.database_path(paths["repo"], "internal", "files"), "internal"
+    )
+    assert len(packages) == 9
+    assert packages["package0"].version == "2-1"
+    assert packages["package0"].files == ["usr/", "usr/bin/", "usr/bin/package0"]
+
+
+def test_if_the_compression_can_be_changed(paths: dict) -> None:
+    """
+    Notes:
+        This can fail if the database links keep pointing to the databases of the old compression, or if an
+        archive without a .PKGINFO is accepted.
+
+    Returns:
+        Nothing will be returned.
+    """
+    archive(paths["repo"], "vim", "1-1")
+    repo.build(paths["repo"], "internal")
+    assert repo.build(paths["repo"], "internal", compression="gz").written
+    assert os.readlink(repo.database_path(paths["repo"], "internal")) == (
+        "internal.db.tar.gz"
+    )
+    assert list(
+        database.read_sync_db(repo.database_path(paths["repo"], "internal"), "internal")
+    ) == ["vim"]
+    with open(os.path.join(paths["repo"], "broken-1-1-any.pkg.tar"), "wb") as broken:
+        broken.write(bytes(10240))
+    with pytest.raises(ValueError):
+        repo.build(paths["repo"], "internal")
+
+
+def test_if_zstd_needs_zstandard(paths: dict, monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if a zstd build without the zstandard module reads the archives before failing, or doesn't
+        fail with an ImportError, or if a gzip build needs the module.
+
+    Returns:
+        Nothing will be returned.
+    """
+    archive(paths["repo"], "vim", "1-1")
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    monkeypatch.setattr(repo, "read_archive", None)
+    with pytest.raises(ImportError, match="gz"):
+        repo.build(paths["repo"], "internal")
+    monkeypatch.undo()
+    monkeypatch.setitem(sys.modules, "zstandard", None)
+    assert repo.build(paths["repo"], "internal", compression="gz").packages == 1
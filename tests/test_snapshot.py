@@ -0,0 +1,168 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import pytest
+from typing import Dict, Iterable, List
+from pacmanpie import snapshot, upgrades
+from pacmanpie.database import Package
+from pacmanpie.journal import Journal
+from pacmanpie.snapshot import Rollback, Transaction
+from conftest import package_fields
+
+PACKAGES: int = 40
+
+
+def commit(
+    dbpath: str, reason: str, add: Dict[str, str], remove: Iterable[str] = ()
+) -> None:
+    """Commits packages to the local database, as a recorded transaction.
+
+    Args:
+        dbpath: The database location.
+        reason: What the transaction does.
+        add: The versions of the packages to install, mapped to their names.
+        remove: The names of the packages to remove.
+    """
+    with snapshot.recording(dbpath, reason):
+        Journal(dbpath).commit(
+            add=[
+                Package(name, version, package_fields(name, version), [])
+                for name, version in add.items()
+            ],
+            remove=remove,
+        )
+
+
+def cache_archives(cache_dir: str, add: Dict[str, str]) -> List[str]:
+    """Puts empty archives into a package cache.
+
+    Args:
+        cache_dir: The cache directory.
+        add: The versions of the packages, mapped to their names.
+
+    Returns:
+        The paths of the archives.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    paths: List[str] = []
+    for name, version in add.items():
+        paths.append(os.path.join(cache_dir, f"{name}-{version}-x86_64.pkg.tar.zst"))
+        open(paths[-1], "w").close()
+    return paths
+
+
+def test_if_transactions_are_recorded(paths: dict) -> None:
+    """
+    Notes:
+        This can fail if a transaction isn't recorded with the versions before and after it, if a transaction
+        changing nothing is recorded, if the package set before a transaction is computed wrongly, or if listing
+        the transactions creates anything.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert snapshot.transactions(paths["dbpath"]) == []
+    assert not os.path.exists(paths["dbpath"])
+    commit(paths["dbpath"], "install", {"vim": "1-1"})
+    commit(paths["dbpath"], "upgrade", {"vim": "2-1", "ed": "1-1"})
+    with snapshot.recording(paths["dbpath"], "nothing"):
+        pass
+    recorded: List[Transaction] = snapshot.transactions(paths["dbpath"])
+    assert [(transaction.id, transaction.reason) for transaction in recorded] == [
+        (1, "install"),
+        (2, "upgrade"),
+    ]
+    assert recorded[1].changes == {"ed": [None, "1-1"], "vim": ["1-1", "2-1"]}
+    assert snapshot.target(paths["dbpath"], 2) == {"vim": "1-1"}
+    assert snapshot.target(paths["dbpath"], 1) == {}
+    with pytest.raises(ValueError):
+        snapshot.target(paths["dbpath"], 3)
+
+
+def test_if_archives_are_found_in_the_cache(paths: dict) -> None:
+    """
+    Notes:
+        This can fail if signatures, partial downloads or archives of another architecture are used, or if a
+        package name containing dashes is split wrongly.
+
+    Returns:
+        Nothing will be returned.
+    """
+    cache: str = paths["cache"]
+    os.makedirs(cache)
+    names: List[str] = [
+        "vim-1:8.2-1-x86_64.pkg.tar.zst",
+        "vim-1:8.2-1-x86_64.pkg.tar.zst.sig",
+        "vim-runtime-8.2-1-any.pkg.tar.xz",
+        "gvim-8.2-1-aarch64.pkg.tar.zst",
+        "ed-1-1-x86_64.pkg.tar.zst.part",
+        "README",
+    ]
+    for name in names:
+        open(os.path.join(cache, name), "w").close()
+    assert snapshot.find_archives([cache, paths["root"]], "x86_64") == {
+        "vim-1:8.2-1": os.path.join(cache, names[0]),
+        "vim-runtime-8.2-1": os.path.join(cache, names[2]),
+    }
+
+
+def test_if_rollback_is_planned(paths: dict) -> None:
+    """
+    Notes:
+        This can fail if rolling back doesn't bring back the old versions from the cache, doesn't remove the
+        newer packages, touches packages that didn't change, or if rolling back a rollback isn't planned.
+
+    Returns:
+        Nothing will be returned.
+    """
+    cache: str = paths["cache"]
+    old: Dict[str, str] = {f"package{number}": "1-1" for number in range(PACKAGES)}
+    new: Dict[str, str] = dict.fromkeys(old, "2-1")
+    commit(paths["dbpath"], "install", {**old, "vim": "1-1"})
+    commit(paths["dbpath"], "upgrade", {**new, "ed": "1-1"})
+    archives: List[str] = cache_archives(cache, old)
+    cache_archives(cache, new)
+    changes: Rollback = snapshot.plan(paths["dbpath"], 2, [cache], "x86_64")
+    assert changes == Rollback(install=sorted(archives), remove=["ed"])
+    commit(paths["dbpath"], "rollback to 2", old, ["ed"])
+    assert upgrades.local_versions(paths["dbpath"]) == {**old, "vim": "1-1"}
+    changes = snapshot.plan(paths["dbpath"], 3, [cache], "x86_64")
+    assert changes.remove == []
+    assert len(changes.install) == PACKAGES
+    assert changes.missing == ["ed-1-1"]
+    assert snapshot.plan(paths["dbpath"], 1, [cache], "x86_64") == Rollback(
+        remove=sorted([*old, "vim"])
+    )
+
+
+def test_if_rollback_needs_every_archive(paths: dict) -> None:
+    """
+    Notes:
+        This can fail if a rollback with an archive missing from the cache changes anything.
+
+    Returns:
+        Nothing will be returned.
+    """
+    cache: str = paths["cache"]
+    commit(paths["dbpath"], "install", {"vim": "1-1"})
+    commit(paths["dbpath"], "upgrade", {"vim": "2-1"})
+    cache_archives(cache, {"vim": "2-1"})
+    assert snapshot.plan(paths["dbpath"], 2, [cache], "x86_64").missing == ["vim-1-1"]
+    with pytest.raises(FileNotFoundError):
+        snapshot.rollback(paths["root"], paths["dbpath"], 2, [cache], "x86_64")
+    assert upgrades.local_versions(paths["dbpath"]) == {"vim": "2-1"}
+    assert len(snapshot.transactions(paths["dbpath"])) == 2
@@ -0,0 +1,233 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import pytest
+from typing import Dict, List, Optional, Tuple
+from pacmanpie import config, upgrades
+from pacmanpie.database import Package
+from pacmanpie.upgrades import SyncIndex, Upgrade
+from conftest import make_local_package, make_sync_db, package_fields
+
+
+def sync_package(repo: str, name: str, version: str, **fields: List[str]) -> Package:
+    """Generates a fixture sync package.
+
+    Args:
+        repo: The repository name.
+        name: The package name.
+        version: The package version.
+        **fields: Extra desc fields.
+
+    Returns:
+        The package.
+    """
+    return Package(name, version, package_fields(name, version, **fields), repo=repo)
+
+
+def found(
+    upgrade_list: List[Upgrade],
+) -> List[Tuple[str, str, str, Optional[str]]]:
+    """Summarizes upgrades.
+
+    Args:
+        upgrade_list: The upgrades.
+
+    Returns:
+        The repository, name, new version and replaced package of every upgrade.
+    """
+    return [
+        (upgrade.repo, upgrade.name, upgrade.new_version, upgrade.replaces)
+        for upgrade in upgrade_list
+    ]
+
+
+@pytest.fixture
+def index() -> SyncIndex:
+    """core, extra and community repositories shadowing and replacing packages of each other.
+
+    Returns:
+        The merged repositories.
+    """
+    return upgrades.build_index(
+        [
+            {
+                "bash": sync_package("core", "bash", "5.1.0-1"),
+                "glibc": sync_package("core", "glibc", "2.32-1"),
+                "libfoo": sync_package("core", "libfoo", "2-1"),
+            },
+            {
+                "bash": sync_package("extra", "bash", "9.9-1"),
+                "neovim": sync_package("extra", "neovim", "0.5-1", REPLACES=["vim<9"]),
+                "gimp": sync_package("extra", "gimp", "2.10-2", GROUPS=["graphics"]),
+                "vim": sync_package("extra", "vim", "9.0-1"),
+                "zsh": sync_package("extra", "zsh", "5.8-1"),
+            },
+            {
+                "bash-ng": sync_package(
+                    "community", "bash-ng", "1-1", REPLACES=["bash"]
+                ),
+                "zsh-ng": sync_package("community", "zsh-ng", "1-1", REPLACES=["zsh"]),
+                "ed-ng": sync_package("community", "ed-ng", "1-1", REPLACES=["ed"]),
+            },
+        ]
+    )
+
+
+def test_if_join_respects_priority_and_versions(index: SyncIndex) -> None:
+    """
+    Notes:
+        This can fail if a package shadowed by a higher priority repository, an up to date package or a package
+        newer than its sync version is upgraded.
+
+    Returns:
+        Nothing will be returned.
+    """
+    local: Dict[str, str] = {
+        "bash": "5.1.0-1",
+        "glibc": "2.31-1",
+        "libfoo": "3-1",
+        "gimp": "2.10-1",
+        "unknown": "1-1",
+    }
+    assert found(upgrades.find_upgrades(local, index)) == [
+        ("extra", "gimp", "2.10-2", None),
+        ("core", "glibc", "2.32-1", None),
+    ]
+
+
+def test_if_replacements_are_found(index: SyncIndex) -> None:
+    """
+    Notes:
+        This can fail if a replacer doesn't replace a matching installed package, or if it replaces a package of a
+        higher priority repository, a package whose version doesn't match or a package it is installed next to.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert found(
+        upgrades.find_upgrades(
+            {"vim": "8.2-1", "bash": "5.1.0-1", "zsh": "5.7-1", "ed": "1-1"}, index
+        )
+    ) == [
+        ("community", "ed-ng", "1-1", "ed"),
+        ("extra", "neovim", "0.5-1", "vim"),
+        ("extra", "zsh", "5.8-1", None),
+    ]
+    assert found(
+        upgrades.find_upgrades({"vim": "8.9-1", "neovim": "0.4-1"}, index)
+    ) == [
+        ("extra", "neovim", "0.5-1", None),
+        ("extra", "vim", "9.0-1", None),
+    ]
+    assert found(upgrades.find_upgrades({"vim": "9.0-1"}, index)) == []
+
+
+def test_if_ignored_packages_are_skipped(index: SyncIndex) -> None:
+    """
+    Notes:
+        This can fail if a package matching an IgnorePkg pattern or belonging to an IgnoreGroup group is upgraded,
+        replaced or used as a replacer, or if ignoring the replacer of a package also drops its literal upgrade.
+
+    Returns:
+        Nothing will be returned.
+    """
+    local: Dict[str, str] = {
+        "glibc": "2.31-1",
+        "gimp": "2.10-1",
+        "vim": "8.2-1",
+        "ed": "1-1",
+        "zsh": "5.7-1",
+    }
+    assert found(
+        upgrades.find_upgrades(local, index, ["gli*", "vim", "ed-ng"], ["graphics"])
+    ) == [("extra", "zsh", "5.8-1", None)]
+    replaced: SyncIndex = upgrades.build_index(
+        [
+            {
+                "foo": sync_package("core", "foo", "2.0-1"),
+                "bar": sync_package("core", "bar", "1.0-1", REPLACES=["foo"]),
+            }
+        ]
+    )
+    assert found(upgrades.find_upgrades({"foo": "1.0-1"}, replaced, ["bar"])) == [
+        ("core", "foo", "2.0-1", None)
+    ]
+    assert found(upgrades.find_upgrades({"foo": "1.0-1"}, replaced)) == [
+        ("core", "bar", "1.0-1", "foo")
+    ]
+
+
+def test_if_pending_upgrades_are_cached(tmp_path, monkeypatch) -> None:
+    """
+    Notes:
+        This can fail if the pending upgrades are computed again although nothing changed (in this process or in
+        a new one), or aren't although a package was installed or a sync database changed.
+
+    Returns:
+        Nothing will be returned.
+    """
+    dbpath: str = str(tmp_path / "db")
+    make_sync_db(dbpath, "core", [package_fields("glibc", "2.32-1")])
+    make_sync_db(dbpath, "extra", [package_fields("vim", "8.2-2")])
+    make_local_package(dbpath, "glibc", "2.31-1")
+    computed: List[int] = []
+    find_upgrades = upgrades.find_upgrades
+
+    def counting_find_upgrades(*args) -> List[Upgrade]:
+        computed.append(1)
+        return find_upgrades(*args)
+
+    monkeypatch.setattr(upgrades, "find_upgrades", counting_find_upgrades)
+    repos: List[str] = ["core", "extra"]
+    assert found(upgrades.pending(dbpath, repos)) == [("core", "glibc", "2.32-1", None)]
+    assert found(upgrades.pending(dbpath, repos)) == [("core", "glibc", "2.32-1", None)]
+    monkeypatch.setattr(upgrades, "_pending_cache", {})
+    assert found(upgrades.pending(dbpath, repos)) == [("core", "glibc", "2.32-1", None)]
+    assert len(computed) == 1
+    make_local_package(dbpath, "vim", "8.2-1")
+    assert [upgrade.name for upgrade in upgrades.pending(dbpath, repos)] == [
+        "glibc",
+        "vim",
+    ]
+    shutil.rmtree(os.path.join(dbpath, "local", "glibc-2.31-1"))
+    make_local_package(dbpath, "glibc", "2.32-1")
+    assert [upgrade.name for upgrade in upgrades.pending(dbpath, repos)] == ["vim"]
+    make_sync_db(dbpath, "extra", [package_fields("vim", "8.2-3")])
+    os.utime(os.path.join(dbpath, "sync", "extra.db"), ns=(1, 1))
+    assert found(upgrades.pending(dbpath, repos)) == [("extra", "vim", "8.2-3", None)]
+    assert found(upgrades.pending(dbpath, repos, ["vim"])) == []
+    assert len(computed) == 5
+
+
+def test_if_ignores_are_read(tmp_path) -> None:
+    """
+    Notes:
+        This can fail if the IgnorePkg and IgnoreGroup options of pacman.conf aren't read.
+
+    Returns:
+        Nothing will be returned.
+    """
+    path: str = str(tmp_path / "pacman.conf")
+    with open(path, "w") as config_file:
+        config_file.write(
+            "[options]\nIgnorePkg = linux linux-*\nIgnorePkg = glibc\n"
+            "IgnoreGroup = gnome\n\n[core]\nServer = https://mirror/$repo\n"
+        )
+    pacman_config: config.PacmanConfig = config.read_config(path)
+    assert pacman_config.ignore_pkgs == ["linux", "linux-*", "glibc"]
+    assert pacman_config.ignore_groups == ["gnome"]
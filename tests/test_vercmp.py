@@ -0,0 +1,333 @@
+#  pacman-pie: A pythonic implementation of Arch Linux's pacman using pyalpm.
+#  Copyright (C) 2020  ALinuxPerson
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import string
+import pytest
+from typing import List, Optional, Tuple
+from pacmanpie.vercmp import (
+    PackageVersion,
+    compare_versions,
+    newest,
+    parse_version,
+    rank_versions,
+    sort_versions,
+    vercmp,
+)
+
+# the cases of pacman's own vercmp test suite
+KNOWN_RESULTS: List[Tuple[str, str, int]] = [
+    # all similar length, no pkgrel
+    ("1.5.0", "1.5.0", 0),
+    ("1.5.1", "1.5.0", 1),
+    # mixed length
+    ("1.5.1", "1.5", 1),
+    # with pkgrel, simple
+    ("1.5.0-1", "1.5.0-1", 0),
+    ("1.5.0-1", "1.5.0-2", -1),
+    ("1.5.0-1", "1.5.1-1", -1),
+    ("1.5.0-2", "1.5.1-1", -1),
+    # with pkgrel, mixed lengths
+    ("1.5-1", "1.5.1-1", -1),
+    ("1.5-2", "1.5.1-1", -1),
+    ("1.5-2", "1.5.1-2", -1),
+    # mixed pkgrel inclusion
+    ("1.5", "1.5-1", 0),
+    ("1.5-1", "1.5", 0),
+    ("1.1-1", "1.1", 0),
+    ("1.0-1", "1.1", -1),
+    ("1.1-1", "1.0", 1),
+    # alphanumeric versions
+    ("1.5b-1", "1.5-1", -1),
+    ("1.5b", "1.5", -1),
+    ("1.5b-1", "1.5", -1),
+    ("1.5b", "1.5.1", -1),
+    # from the manpage
+    ("1.0a", "1.0alpha", -1),
+    ("1.0alpha", "1.0b", -1),
+    ("1.0b", "1.0beta", -1),
+    ("1.0beta", "1.0rc", -1),
+    ("1.0rc", "1.0", -1),
+    # going crazy? alpha-dotted versions
+    ("1.5.a", "1.5", 1),
+    ("1.5.b", "1.5.a", 1),
+    ("1.5.1", "1.5.b", 1),
+    # alpha dots and dashes
+    ("1.5.b-1", "1.5.b", 0),
+    ("1.5-1", "1.5.b", -1),
+    # same/similar content, differing separators
+    ("2.0", "2_0", 0),
+    ("2.0_a", "2_0.a", 0),
+    ("2.0a", "2.0.a", -1),
+    ("2___a", "2_a", 1),
+    # epoch included version comparisons
+    ("0:1.0", "0:1.0", 0),
+    ("0:1.0", "0:1.1", -1),
+    ("1:1.0", "0:1.0", 1),
+    ("1:1.0", "0:1.1", 1),
+    ("1:1.0", "2:1.1", -1),
+    # epoch + sometimes present pkgrel
+    ("1:1.0", "0:1.0-1", 1),
+    ("1:1.0-1", "0:1.1-1", 1),
+    # epoch included on one version
+    ("0:1.0", "1.0", 0),
+    ("0:1.1", "1.0", 1),
+    ("0:1.1", "1.1", 0),
+    ("1.0", "0:1.1", -1),
+    ("1:1.0", "1.0", 1),
+    ("1:1.1", "1.1", 1),
+    ("1.1", "1:1.1", -1),
+]
+
+
+def reference_rpmvercmp(first: str, second: str) -> int:
+    """A line by line port of alpm's rpmvercmp, used as the oracle of the property tests.
+
+    Args:
+        first: The first pkgver or pkgrel.
+        second: The second pkgver or pkgrel.
+
+    Returns:
+        -1, 0 or 1.
+    """
+    if first == second:
+        return 0
+    alnum: str = string.ascii_letters + string.digits
+    one: int = 0
+    two: int = 0
+    while one < len(first) and two < len(second):
+        start_one, start_two = one, two
+        while one < len(first) and first[one] not in alnum:
+            one += 1
+        while two < len(second) and second[two] not in alnum:
+            two += 1
+        if one == len(first) or two == len(second):
+            break
+        if one - start_one != two - start_two:
+            return -1 if one - start_one < two - start_two else 1
+        start_one, start_two = one, two
+        is_number: bool = first[one] in string.digits
+        kind: str = string.digits if is_number else string.ascii_letters
+        while one < len(first) and first[one] in kind:
+            one += 1
+        while two < len(second) and second[two] in kind:
+            two += 1
+        if two == start_two:
+            return 1 if is_number else -1
+        first_segment: str = first[start_one:one]
+        second_segment: str = second[start_two:two]
+        if is_number:
+            first_segment = first_segment.lstrip("0")
+            second_segment = second_segment.lstrip("0")
+            if len(first_segment) != len(second_segment):
+                return 1 if len(first_segment) > len(second_segment) else -1
+        if first_segment != second_segment:
+            return 1 if first_segment > second_segment else -1
+    if one == len(first) and two == len(second):
+        return 0
+    if (one == len(first) and second[two] not in string.ascii_letters) or (
+        one < len(first) and first[one] in string.ascii_letters
+    ):
+        return -1
+    return 1
+
+
+def reference_vercmp(first: str, second: str) -> int:
+    """A port of alpm_pkg_vercmp, used as the oracle of the property tests.
+
+    Args:
+        first: The first version.
+        second: The second version.
+
+    Returns:
+        -1, 0 or 1.
+    """
+
+    def parse(version: str) -> Tuple[str, str, Optional[str]]:
+        end: int = 0
+        while end < len(version) and version[end] in string.digits:
+            end += 1
+        release: int = version.rfind("-", end)
+        epoch, start = ("0", 0)
+        if version[end : end + 1] == ":":
+            epoch, start = (version[:end] or "0", end + 1)
+        if release == -1:
+            return epoch, version[start:], None
+        return epoch, version[start:release], version[release + 1 :]
+
+    if first == second:
+        return 0
+    first_epoch, first_pkgver, first_pkgrel = parse(first)
+    second_epoch, second_pkgver, second_pkgrel = parse(second)
+    result: int = reference_rpmvercmp(first_epoch, second_epoch)
+    if result == 0:
+        result = reference_rpmvercmp(first_pkgver, second_pkgver)
+        if result == 0 and first_pkgrel is not None and second_pkgrel is not None:
+            result = reference_rpmvercmp(first_pkgrel, second_pkgrel)
+    return result
+
+
+def generate_package_version(rng: random.Random) -> str:
+    """Generates a random, often weird, package version.
+
+    Args:
+        rng: The random number generator.
+
+    Returns:
+        The version string.
+    """
+    alphabet: str = "0011223399ab._~+-"
+    version: str = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 10)))
+    if rng.random() < 0.2:
+        version = f"{rng.randint(0, 3)}:{version}"
+    return version
+
+
+@pytest.mark.parametrize("first,second,result", KNOWN_RESULTS)
+def test_if_known_results_match(first: str, second: str, result: int) -> None:
+    """
+    Notes:
+        This can fail if vercmp disagrees with pacman's vercmp test suite, in either direction.
+
+    Args:
+        first: The first version.
+        second: The second version.
+        result: The expected result.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert vercmp(first, second) == result
+    assert vercmp(second, first) == -result
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_if_vercmp_matches_reference(seed: int) -> None:
+    """
+    Notes:
+        This can fail if the precomputed comparison of PackageVersion disagrees with a line by line port of alpm's
+        vercmp for random versions.
+
+    Args:
+        seed: The seed of the random versions.
+
+    Returns:
+        Nothing will be returned.
+    """
+    rng: random.Random = random.Random(seed)
+    for _ in range(2000):
+        first: str = generate_package_version(rng)
+        second: str = generate_package_version(rng)
+        assert vercmp(first, second) == reference_vercmp(first, second), (first, second)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_if_vercmp_is_antisymmetric_and_reflexive(seed: int) -> None:
+    """
+    Notes:
+        This can fail if swapping the versions doesn't negate the result, or if a version isn't equal to itself.
+
+    Args:
+        seed: The seed of the random versions.
+
+    Returns:
+        Nothing will be returned.
+    """
+    rng: random.Random = random.Random(seed)
+    for _ in range(2000):
+        first: str = generate_package_version(rng)
+        second: str = generate_package_version(rng)
+        assert vercmp(first, second) == -vercmp(second, first)
+        assert PackageVersion(first) == PackageVersion(first)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_if_equal_versions_hash_equally(seed: int) -> None:
+    """
+    Notes:
+        This can fail if two equal versions have different hashes.
+
+    Args:
+        seed: The seed of the random versions.
+
+    Returns:
+        Nothing will be returned.
+    """
+    rng: random.Random = random.Random(seed)
+    for _ in range(2000):
+        first: PackageVersion = PackageVersion(generate_package_version(rng))
+        second: PackageVersion = PackageVersion(generate_package_version(rng))
+        if first == second:
+            assert hash(first) == hash(second)
+
+
+def test_if_parsed_versions_are_cached() -> None:
+    """
+    Notes:
+        This can fail if parsing the same version twice doesn't reuse the parsed version.
+
+    Returns:
+        Nothing will be returned.
+    """
+    assert parse_version("1:8.2.0814-3") is parse_version("1:8.2.0814-3")
+
+
+def test_if_package_version_has_no_dict() -> None:
+    """
+    Notes:
+        This can fail if PackageVersion stops using __slots__.
+
+    Returns:
+        Nothing will be returned.
+    """
+    version: PackageVersion = PackageVersion("1:8.2.0814-3")
+    assert not hasattr(version, "__dict__")
+    assert (version.epoch, version.pkgver, version.pkgrel) == (1, "8.2.0814", "3")
+
+
+def test_if_batch_comparisons_check_out() -> None:
+    """
+    Notes:
+        This can fail if the batch API disagrees with vercmp.
+
+    Returns:
+        Nothing will be returned.
+    """
+    versions: List[str] = [
+        "1.0rc",
+        "2:0.1",
+        "1.0",
+        "1.0-2",
+        "1.0b",
+        "1:1.0",
+        "0.9.9-1",
+    ]
+    assert sort_versions(versions) == [
+        "0.9.9-1",
+        "1.0b",
+        "1.0rc",
+        "1.0",
+        "1.0-2",
+        "1:1.0",
+        "2:0.1",
+    ]
+    assert sort_versions(versions, reverse=True)[0] == "2:0.1"
+    assert rank_versions(versions) == [2, 5, 3, 3, 1, 4, 0]
+    assert newest(versions) == "2:0.1"
+    assert newest([]) is None
+    assert compare_versions(zip(versions, versions[1:])) == [
+        vercmp(first, second) for first, second in zip(versions, versions[1:])
+    ]